@@ -1,32 +1,2365 @@
-# Import necessary modules for file handling, regular expressions, and numerical operations
+# Import necessary modules for file handling and numerical operations
 import os  # For file system operations like checking file paths
-import re  # For pattern matching and parsing G-code lines
+import mmap  # For memory-mapping G-code files instead of reading them into memory
+import json  # For cache metadata files
+import hashlib  # For content hashes of G-code files
+import sys  # For the command-line exit status
+import io  # For silencing per-file reports in batch mode
+import glob  # For expanding wildcard inputs in batch mode
+import multiprocessing  # For the pipes that carry the modal state between parallel parsing workers
+import time  # For batch throughput reporting
+import argparse  # For the batch command-line interface
+import contextlib  # For redirecting output of batch workers and for profiling stages
+import tracemalloc  # For the peak allocation of profiled stages
+import cProfile  # For profiling a chosen stage function by function
+import pstats  # For the listing of a profiled stage
+from concurrent.futures import ProcessPoolExecutor, as_completed  # For converting many files in parallel
+from concurrent.futures.process import BrokenProcessPool  # For carrying on after a worker process dies
+from dataclasses import dataclass, field, asdict  # For the typed metadata result and stage records
+from typing import Optional  # For optional fields of the metadata result and stage records
 import numpy as np  # For numerical calculations and array manipulations
 import matplotlib.pyplot as plt  # For plotting data
 from mpl_toolkits.mplot3d import Axes3D  # For 3D plotting support
-from matplotlib.widgets import Slider  # For interactive sliders in plots
-from stl import mesh as Mesh  # For working with STL mesh files
-from stl import mesh  # Import again for convenience, allows shorter syntax
-import tkinter as tk  # For creating GUI elements
-from tkinter import messagebox, scrolledtext  # Additional GUI elements for pop-ups and scrollable text boxes
-from tkinterdnd2 import TkinterDnD, DND_FILES  # For drag-and-drop file functionality in tkinter
+from mpl_toolkits.mplot3d.art3d import Line3DCollection  # For drawing all path segments as one artist
+from matplotlib.widgets import Slider, RadioButtons  # For the Z slider and colouring choice in plots
+try:
+    import tkinter as tk  # For creating GUI elements
+    from tkinter import messagebox, scrolledtext  # Additional GUI elements for pop-ups and scrollable text boxes
+    from tkinterdnd2 import TkinterDnD, DND_FILES  # For drag-and-drop file functionality in tkinter
+except ImportError:
+    # Headless machines running batch conversions may not have Tk; only the GUI needs it
+    tk = None
+
+
+# Columnar toolpath parsing engine
+# The whole G-code buffer is tokenized with NumPy array operations instead of per-line regex searches.
+# Every motion line (G0, G1, G2, G3) becomes one or more rows of a structured array. Axes a line does not
+# mention keep their previous value, G90/G91, M82/M83 and G92 change how later coordinates are read, and
+# G2/G3 arcs are split into chords. All of this is done for a whole batch of lines at once.
+
+# Move types stored in the 'move' column of a toolpath
+MOVE_TRAVEL = 0   # E unchanged: the nozzle moves without extruding
+MOVE_EXTRUDE = 1  # E increased: filament is laid down
+MOVE_RETRACT = 2  # E decreased: filament is pulled back
+
+# One row per move with compact float32/int columns (29 bytes per row)
+TOOLPATH_DTYPE = np.dtype([
+    ('x', np.float32),     # X position after the move
+    ('y', np.float32),     # Y position after the move
+    ('z', np.float32),     # Z position after the move
+    ('e', np.float32),     # Total filament fed after the move; G92 resets and relative E are folded in
+    ('de', np.float32),    # Filament fed by the move itself, taken before the total is rounded to float32
+    ('f', np.float32),     # Feedrate in mm/min
+    ('line', np.uint32),   # 1-based line number in the source G-code
+    ('move', np.uint8),    # One of the MOVE_* constants
+])
+
+# Largest distance, in mm, between an arc and the chords it is split into
+ARC_TOLERANCE = 0.01
+
+# Commands the parser acts on, as stored in the 'command' column of the tokenizer's records
+_G0, _G1, _G2, _G3, _G90, _G91, _G92, _M82, _M83 = range(9)
+# Command number (plus 100 for M codes) to command, for every command number below 200
+_COMMAND_LUT = np.full(200, 255, dtype=np.uint8)
+for _command, _number in ((_G0, 0), (_G1, 1), (_G2, 2), (_G3, 3), (_G90, 90), (_G91, 91), (_G92, 92),
+                          (_M82, 182), (_M83, 183)):
+    _COMMAND_LUT[_number] = _command
+
+# Words read from each command line: axes, then arc centre offsets (I, J) and radius (R)
+_AXES = 'XYZEF'
+_WORDS = _AXES + 'IJR'
+# What the tokenizer records for each command line: the words it gives (NaN where absent), its line index and the
+# command. Padded to nine float64 slots so the words can be scattered through a flat float64 view of the records.
+_RECORD_DTYPE = np.dtype({'names': [word.lower() for word in _WORDS] + ['line', 'command'],
+                          'formats': [np.float64] * len(_WORDS) + [np.uint32, np.uint8],
+                          'offsets': [8 * slot for slot in range(len(_WORDS))] + [64, 68],
+                          'itemsize': 72})
+_RECORD_SLOTS = _RECORD_DTYPE.itemsize // 8
+# Positions are accumulated as integer nanometres, which is exact for every coordinate with up to 6 decimals,
+# so relative moves never drift and the result does not depend on how the file was split into batches
+_UNITS_PER_MM = 10 ** 6
+# Bytes of G-code tokenized per batch; large enough to amortize NumPy call overhead, small enough to stay in cache
+PARSE_CHUNK_BYTES = 1 << 20
+# Number of characters the vectorized number parser reads after an axis letter
+_NUMBER_WIDTH = 16
+_POWERS_OF_TEN = 10.0 ** np.arange(_NUMBER_WIDTH + 1)
+
+# Lookup tables used to classify every byte of the buffer at once
+_WORD_LUT = np.zeros(256, dtype=bool)
+_WORD_LUT[[ord(c) for c in _WORDS]] = True
+_WORD_SLOT_LUT = np.zeros(256, dtype=np.intp)
+_WORD_SLOT_LUT[[ord(c) for c in _WORDS]] = np.arange(len(_WORDS))
+_DIGIT_LUT = np.zeros(256, dtype=bool)
+_DIGIT_LUT[ord('0'):ord('9') + 1] = True
+_NUMBER_START_LUT = _DIGIT_LUT.copy()
+_NUMBER_START_LUT[[ord('-'), ord('+'), ord('.')]] = True
+
+
+# Modal state of the parser, carried from one chunk of G-code to the next
+class ModalState:
+    def __init__(self):
+        # Position of each axis in G-code coordinates, in integer nanometres
+        self.x = 0
+        self.y = 0
+        self.z = 0
+        self.e = 0
+        # Machine position minus G-code coordinate, changed by G92
+        self.x_offset = 0
+        self.y_offset = 0
+        self.z_offset = 0
+        self.e_offset = 0
+        self.f = 0.0
+        self.relative = False    # G91: X, Y, Z and E coordinates are relative
+        self.relative_e = False  # M83: E coordinates are relative even under G90
+
+    def copy(self):
+        state = ModalState()
+        state.__dict__.update(self.__dict__)
+        return state
+
+
+# Read the byte at each position, with 0 for positions past the end of the buffer
+def _bytes_at(buf, positions):
+    if len(buf) == 0:
+        return np.zeros(len(positions), dtype=np.uint8)
+    out = buf[np.minimum(positions, len(buf) - 1)]
+    out[positions >= len(buf)] = 0
+    return out
+
+
+# Convert the number tokens starting at the given byte positions into floats in one batch
+# Returns the values and a mask of the tokens that held a valid number
+def _parse_numbers(buf, starts):
+    count = len(starts)
+    first = _bytes_at(buf, starts)
+    negative = first == ord('-')
+    positions = starts + (negative | (first == ord('+')))
+    # A valid number has a digit either first or right after a leading decimal point
+    lead = _bytes_at(buf, positions)
+    has_digit = _DIGIT_LUT[lead] | ((lead == ord('.')) & _DIGIT_LUT[_bytes_at(buf, positions + 1)])
+    # Bounds checks are only needed when a token sits within one number width of the end of the buffer
+    in_bounds = count == 0 or positions.max() + _NUMBER_WIDTH < len(buf)
+
+    # Digits and at most one decimal point; anything else ends the number
+    # Horner's rule runs column by column over all tokens at once
+    mantissa = np.zeros(count, dtype=np.float64)
+    frac_digits = np.zeros(count, dtype=np.int64)
+    alive = np.ones(count, dtype=bool)
+    seen_dot = np.zeros(count, dtype=bool)
+    for i in range(_NUMBER_WIDTH):
+        chars = buf[positions] if in_bounds else _bytes_at(buf, positions)
+        digit = alive & _DIGIT_LUT[chars]
+        dot = alive & (chars == ord('.')) & ~seen_dot
+        alive = digit | dot
+        if not alive.any():
+            break
+        mantissa = np.where(digit, mantissa * 10 + (chars - ord('0')), mantissa)
+        frac_digits += digit & seen_dot
+        seen_dot |= dot
+        positions += 1
+
+    # The mantissa holds every digit exactly, so one division gives the correctly rounded value
+    values = mantissa / _POWERS_OF_TEN[frac_digits]
+    values[negative] = -values[negative]
+    # Tokens longer than the fixed width are rare and fall back to Python's float()
+    for i in np.flatnonzero(alive):
+        end = int(starts[i])
+        while end < len(buf) and (_DIGIT_LUT[buf[end]] or buf[end] in b'+-.'):
+            end += 1
+        try:
+            values[i] = float(bytes(buf[starts[i]:end]))
+        except ValueError:
+            has_digit[i] = False
+    # Positions are tracked in whole nanometres (see _UNITS_PER_MM), so round the rare finer values once here
+    fine = (frac_digits > 6) | alive
+    if fine.any():
+        values[fine] = np.rint(values[fine] * _UNITS_PER_MM) / _UNITS_PER_MM
+    return values, has_digit
+
+
+# Carry the last known value of a column forward over its NaN gaps
+def _forward_fill(values, initial):
+    known = ~np.isnan(values)
+    index = np.where(known, np.arange(len(values)), -1)
+    np.maximum.accumulate(index, out=index)
+    filled = values[index]
+    filled[index < 0] = initial
+    return filled
+
+
+# Tokenize a chunk of raw G-code bytes into command records in a single pass
+# Records hold only what each line says (NaN for words it does not give) and the line's index in the chunk,
+# so chunks can be tokenized independently and in any order
+def tokenize_gcode(data):
+    buf = np.frombuffer(data, dtype=np.uint8)
+
+    # Locate every line and the first comment character on it
+    newlines = np.flatnonzero(buf == ord('\n'))
+    line_starts = np.concatenate(([0], newlines + 1))
+    line_ends = np.concatenate((newlines, [len(buf)]))
+    comment_starts = line_ends.copy()
+    semicolons = np.flatnonzero(buf == ord(';'))
+    semicolon_lines = np.searchsorted(line_starts, semicolons, side='right') - 1
+    # Semicolons come in order, so the first one on each line is where its line number changes
+    # (comparing against -1 first keeps this valid for batches without any comment)
+    first = np.diff(semicolon_lines, prepend=-1) != 0
+    comment_starts[semicolon_lines[first]] = semicolons[first]
+
+    # Command lines start with G or M and a one- or two-digit number that is not followed by another digit or
+    # a decimal point (G1 and G10, or G92 and G92.1, are different commands)
+    letter = _bytes_at(buf, line_starts)
+    first_digit, second_digit, third_digit = (_bytes_at(buf, line_starts + offset).astype(np.int16)
+                                              for offset in (1, 2, 3))
+    ends_after_one = ~_DIGIT_LUT[second_digit] & (second_digit != ord('.'))
+    ends_after_two = _DIGIT_LUT[second_digit] & ~_DIGIT_LUT[third_digit] & (third_digit != ord('.'))
+    number = np.where(ends_after_one, first_digit - ord('0'),
+                      np.where(ends_after_two, (first_digit - ord('0')) * 10 + second_digit - ord('0'), 199))
+    number[~_DIGIT_LUT[first_digit]] = 199
+    number += 100 * (letter == ord('M'))
+    command = np.where((letter == ord('G')) | (letter == ord('M')), _COMMAND_LUT[np.minimum(number, 199)], 255)
+    command_lines = np.flatnonzero(command != 255)
+
+    # Words: a word letter followed by a number, on a command line, before any comment
+    words = np.flatnonzero(_WORD_LUT[buf])
+    words = words[_NUMBER_START_LUT[_bytes_at(buf, words + 1)]]
+    word_lines = np.searchsorted(line_starts, words, side='right') - 1
+    keep = (command[word_lines] != 255) & (words < comment_starts[word_lines])
+    words, word_lines = words[keep], word_lines[keep]
+    values, ok = _parse_numbers(buf, words + 1)
+    words, values = words[ok], values[ok]
+    rows = np.searchsorted(command_lines, word_lines[ok])
+    letters = buf[words]
+
+    # Scatter every word into its record's slot for that letter
+    records = np.empty(len(command_lines), dtype=_RECORD_DTYPE)
+    slots = records.view(np.float64)
+    slots.fill(np.nan)
+    # Assign in reverse so the first word wins when a line repeats a letter
+    slots[(rows * _RECORD_SLOTS + _WORD_SLOT_LUT[letters])[::-1]] = values[::-1]
+    records['line'] = command_lines
+    records['command'] = command[command_lines]
+    return records
+
+
+# Value of a two-state mode (G90/G91, M82/M83) in effect at every record
+def _mode_at(commands, on, off, initial):
+    changes = (commands == on) | (commands == off)
+    if not changes.any():
+        return np.full(len(commands), initial)
+    index = np.where(changes, np.arange(len(commands)), -1)
+    np.maximum.accumulate(index, out=index)
+    mode = commands[index] == on
+    mode[index < 0] = initial
+    return mode
+
+
+# Machine position of one axis, in mm, after every record
+# Absolute moves and G92 set the G-code coordinate, relative moves add to it; G92 also moves the offset between
+# G-code coordinates and the machine so the machine position stays put. 'state' is updated in place.
+def _axis_positions(records, axis, relative, moving, setting, bare, state):
+    values = records[axis]
+    given = ~np.isnan(values)
+    offset = getattr(state, axis + '_offset')
+    stepping = given & moving & relative
+    # G92 rows that set this axis: the ones that give it, and the ones without any axis word (all axes to zero)
+    setting = setting & (given | bare)
+    if offset == 0 and not setting.any() and not stepping.any():
+        # Absolute moves only: every position is the last value given, which is already a whole number of
+        # nanometres (see _parse_numbers), so this matches the integer path below exactly
+        positions = _forward_fill(values, getattr(state, axis) / _UNITS_PER_MM)
+        if len(records):
+            setattr(state, axis, int(np.rint(positions[-1] * _UNITS_PER_MM)))
+        return positions
+
+    steps = np.zeros(len(records), dtype=np.int64)
+    steps[given] = np.rint(values[given] * _UNITS_PER_MM)
+    sets = (given & moving & ~relative) | setting
+    targets = np.where(sets, steps, 0)
+    steps[~stepping] = 0
+
+    # Coordinate after every record: the value of the last record that set it plus the relative steps since then
+    # Integer sums are exact, so this equals adding the steps one at a time
+    total = np.cumsum(steps)
+    last = np.where(sets, np.arange(len(records)), -1)
+    np.maximum.accumulate(last, out=last)
+    known = np.maximum(last, 0)
+    coordinate = total + np.where(last >= 0, targets[known] - total[known], getattr(state, axis))
+
+    # G92 shifts the offset by however far it moved the coordinate
+    previous = np.concatenate(([getattr(state, axis)], coordinate[:-1]))
+    offsets = offset + np.cumsum(np.where(setting, previous - coordinate, 0))
+
+    if len(records):
+        setattr(state, axis, int(coordinate[-1]))
+        setattr(state, axis + '_offset', int(offsets[-1]))
+    return (coordinate + offsets) / _UNITS_PER_MM
+
+
+# Split G2/G3 arcs into chords that stay within 'tolerance' of the arc, in one batch
+# Arcs go from (x0, y0) to (x1, y1) around a centre at offset (i, j) from the start, or with radius r when
+# neither I nor J is given (a negative radius selects the longer way round)
+# Returns the centre, radius, start angle, signed sweep and chord count of every arc
+def _arc_geometry(x0, y0, x1, y1, i, j, r, clockwise, tolerance):
+    use_radius = np.isnan(i) & np.isnan(j) & ~np.isnan(r)
+    i = np.nan_to_num(i)
+    j = np.nan_to_num(j)
+    if use_radius.any():
+        # Centre on the perpendicular bisector of the chord, on the side given by direction and sign of R
+        half_x, half_y = (x1 - x0) / 2, (y1 - y0) / 2
+        half = np.hypot(half_x, half_y)
+        radius = np.abs(r)
+        height = np.sqrt(np.maximum(radius * radius - half * half, 0.0))
+        side = np.where(clockwise ^ (r < 0), -1.0, 1.0)
+        scale = np.divide(side * height, half, out=np.zeros_like(half), where=half > 0)
+        i = np.where(use_radius, half_x - half_y * scale, i)
+        j = np.where(use_radius, half_y + half_x * scale, j)
+
+    cx, cy = x0 + i, y0 + j
+    radius = np.hypot(i, j)
+    start = np.arctan2(y0 - cy, x0 - cx)
+    # Counter-clockwise angle from start to end in [0, 2 pi); the same point at both ends means a full circle
+    sweep = np.mod(np.arctan2(y1 - cy, x1 - cx) - start, 2 * np.pi)
+    closed = (np.abs(x1 - x0) < 1e-9) & (np.abs(y1 - y0) < 1e-9)
+    sweep[closed] = 2 * np.pi
+    sweep = np.where(clockwise, np.where(closed, -2 * np.pi, sweep - 2 * np.pi), sweep)
+
+    # A chord spanning angle a is at most r (1 - cos(a / 2)) from the arc
+    largest = 2 * np.arccos(np.clip(1 - tolerance / np.maximum(radius, 1e-12), -1.0, 1.0))
+    counts = np.maximum(np.ceil(np.abs(sweep) / np.maximum(largest, 1e-9)), 1).astype(np.int64)
+    return cx, cy, radius, start, sweep, counts
+
+
+# Apply the modal state to tokenized records and build the toolpath array
+# 'state' is the modal state before the records and is updated in place so the next records can continue from it;
+# 'line_offset' is the number of lines before the chunk the records came from
+# The result depends only on the records and the incoming state, never on how the file was split into chunks
+def resolve_records(records, state, line_offset=0, arc_tolerance=ARC_TOLERANCE):
+    commands = records['command']
+    moving = commands <= _G3
+    setting = commands == _G92
+    bare = setting & np.isnan(records['x']) & np.isnan(records['y']) & np.isnan(records['z']) & np.isnan(records['e'])
+    relative = _mode_at(commands, _G91, _G90, state.relative)
+    extruder_relative = _mode_at(commands, _M83, _M82, state.relative_e)
+    relative_e = relative | extruder_relative
+    start_positions = {axis: (getattr(state, axis) + getattr(state, axis + '_offset')) / _UNITS_PER_MM
+                       for axis in 'xyze'}
+    positions = {axis: _axis_positions(records, axis, relative_e if axis == 'e' else relative, moving, setting,
+                                       bare, state)
+                 for axis in 'xyze'}
+    if len(records):
+        state.relative = bool(relative[-1])
+        state.relative_e = bool(extruder_relative[-1])
+    f = np.where(moving, records['f'], np.nan)
+    feedrates = _forward_fill(f, state.f)
+    if len(records):
+        state.f = float(feedrates[-1])
+
+    # Every motion record ends at its machine position and starts where the record before it ended
+    motion = np.flatnonzero(moving)
+    arcs = np.flatnonzero(commands[motion] >= _G2)
+    ends = {axis: positions[axis][motion] for axis in 'xyze'}
+    previous_e = np.concatenate(([start_positions['e']], positions['e'][:-1]))[motion]
+
+    if not len(arcs):
+        toolpath = np.empty(len(motion), dtype=TOOLPATH_DTYPE)
+        for axis in 'xyze':
+            toolpath[axis] = ends[axis]
+        toolpath['f'] = feedrates[motion]
+        toolpath['line'] = records['line'][motion] + line_offset + 1
+        e = ends['e']
+    else:
+        # Every arc becomes 'counts' chords; everything else stays a single move
+        arc_index = motion[arcs]
+        before = arc_index - 1
+        starts = {axis: np.where(before >= 0, positions[axis][np.maximum(before, 0)], start_positions[axis])
+                  for axis in 'xyze'}
+        arc_ends = {axis: ends[axis][arcs] for axis in 'xyze'}
+        cx, cy, radius, start_angle, sweep, arc_counts = _arc_geometry(
+            starts['x'], starts['y'], arc_ends['x'], arc_ends['y'],
+            records['i'][arc_index], records['j'][arc_index], records['r'][arc_index],
+            commands[arc_index] == _G2, arc_tolerance)
+        counts = np.ones(len(motion), dtype=np.int64)
+        counts[arcs] = arc_counts
+        owner = np.repeat(np.arange(len(motion)), counts)
+        last = np.cumsum(counts) - 1
+        columns = {axis: ends[axis][owner] for axis in 'xyze'}
+
+        # Chord points of every arc, at equal angles; Z and E change linearly along the arc (helical moves)
+        arc_of_motion = np.full(len(motion), -1)
+        arc_of_motion[arcs] = np.arange(len(arcs))
+        arc_rows = np.flatnonzero(arc_of_motion[owner] >= 0)
+        arc = arc_of_motion[owner[arc_rows]]
+        fraction = (arc_rows - (last[arcs] - arc_counts)[arc]) / arc_counts[arc]
+        angle = start_angle[arc] + sweep[arc] * fraction
+        columns['x'][arc_rows] = cx[arc] + radius[arc] * np.cos(angle)
+        columns['y'][arc_rows] = cy[arc] + radius[arc] * np.sin(angle)
+        for axis in 'ze':
+            columns[axis][arc_rows] = starts[axis][arc] + (arc_ends[axis] - starts[axis])[arc] * fraction
+        # The last chord of every arc lands exactly on the arc's end point
+        for axis in 'xyze':
+            columns[axis][last[arcs]] = arc_ends[axis]
+
+        toolpath = np.empty(len(owner), dtype=TOOLPATH_DTYPE)
+        for axis in 'xyze':
+            toolpath[axis] = columns[axis]
+        toolpath['f'] = feedrates[motion][owner]
+        toolpath['line'] = records['line'][motion][owner] + line_offset + 1
+        e = columns['e']
+        previous_e = np.concatenate((previous_e[:1], e[:-1]))
+
+    # Classify each move by how the extruder position changed
+    # Past 65 m of filament a float32 total is only good to 0.008 mm, a quarter of what a 1 mm extrusion feeds,
+    # so the amount each move feeds is kept separately, from the exact positions
+    toolpath['de'] = e - previous_e
+    toolpath['move'] = MOVE_TRAVEL
+    toolpath['move'][e > previous_e] = MOVE_EXTRUDE
+    toolpath['move'][e < previous_e] = MOVE_RETRACT
+    return toolpath, state
+
+
+# Tokenize a chunk of raw G-code bytes and resolve it into a toolpath array
+# 'state' is the modal state before the chunk and is updated in place so the next chunk can continue from it
+# 'line_offset' is the number of lines that came before the chunk
+def parse_toolpath_chunk(data, state=None, line_offset=0, arc_tolerance=ARC_TOLERANCE):
+    if state is None:
+        state = ModalState()
+    return resolve_records(tokenize_gcode(data), state, line_offset, arc_tolerance)
+
+
+
+# Streaming file ingestion
+# G-code files are memory-mapped and handed to each stage as line-aligned byte batches, so no stage ever
+# holds the whole file. Peak memory of a streaming pass does not depend on file size:
+#   - one batch of PARSE_CHUNK_BYTES (1 MB) copied out of the mapping (a single line longer than that is
+#     a batch of its own),
+#   - the tokenizer's temporaries for that batch, measured at about 10 MB for 1 MB of Slic3r output,
+#   - mapped pages of batches already consumed are released with madvise(MADV_DONTNEED) where the OS supports it.
+# A streaming pass therefore stays around 15 MB above the interpreter (measured on a 170 MB file). Stages that
+# keep a result (parse_toolpath keeps 29 bytes per move) add only the size of that result on top.
+class GcodeSource:
+    def __init__(self, data=b"", path=None):
+        # Raw G-code bytes: an mmap for files, a bytes object for pasted G-code
+        self.data = data
+        # Path of the file the data came from, if any
+        self.path = path
+        # Number of lines, known once a pass has read every batch
+        self.line_count = None
+
+    # Memory-map a G-code file read-only
+    @classmethod
+    def from_file(cls, path):
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return cls(b"", path)  # Empty files cannot be mapped
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(data, path)
+
+    # Wrap G-code that is already in memory: bytes, one string, or a list of lines
+    @classmethod
+    def from_text(cls, text):
+        if isinstance(text, (bytes, bytearray)):
+            return cls(bytes(text))
+        if not isinstance(text, str):
+            text = "\n".join(line.rstrip("\r\n") for line in text)
+        return cls(text.encode("utf-8", "replace"))
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    # Yield (batch bytes, number of lines between 'start' and the batch) for consecutive line-aligned batches
+    def batches(self, chunk_bytes=PARSE_CHUNK_BYTES, start=0, end=None):
+        data = self.data
+        end = len(data) if end is None else end
+        whole = start == 0 and end == len(data)
+        line_offset = 0
+        while start < end:
+            stop = end
+            if start + chunk_bytes < end:
+                # Cut after the last complete line that fits in the batch, or after the first line if even that
+                # one does not fit
+                stop = (data.rfind(b"\n", start, start + chunk_bytes) + 1
+                        or data.find(b"\n", start + chunk_bytes, end) + 1 or end)
+            chunk = data[start:stop]
+            yield chunk, line_offset
+            line_offset += chunk.count(b"\n")
+            self._release(start, stop)
+            start = stop
+        if whole and self.line_count is None:
+            # A last line without a line break still counts
+            self.line_count = line_offset + (len(data) > 0 and data[-1:] != b"\n")
+
+    # Yield the G-code one byte line at a time, reading it batch by batch
+    def lines(self, chunk_bytes=PARSE_CHUNK_BYTES):
+        for chunk, _ in self.batches(chunk_bytes):
+            yield from chunk.splitlines()
+
+    # Iterating over a source yields text lines, like the list of lines the processor used to hold
+    def __iter__(self):
+        for line in self.lines():
+            yield line.decode("utf-8", "replace")
+
+    # The first 'size' bytes, trimmed to whole lines
+    def head(self, size):
+        if size >= len(self.data):
+            return self.data[:]
+        return self.data[:self.data.rfind(b"\n", 0, size) + 1]
+
+    # The last 'size' bytes, trimmed to whole lines
+    def tail(self, size):
+        if size >= len(self.data):
+            return self.data[:]
+        return self.data[self.data.find(b"\n", len(self.data) - size) + 1:]
+
+    # Let the OS drop mapped pages that a streaming pass has finished with
+    def _release(self, start, stop):
+        if isinstance(self.data, mmap.mmap) and hasattr(mmap, "MADV_DONTNEED"):
+            start -= start % mmap.PAGESIZE
+            stop -= stop % mmap.PAGESIZE
+            if stop > start:
+                self.data.madvise(mmap.MADV_DONTNEED, start, stop - start)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+
+# Parallel parsing
+# A large file is split into byte ranges that start at a layer change where one is close by, and each range is
+# parsed in a worker process. Workers tokenize their ranges at the same time; a worker then waits for the one
+# before it to hand over the modal state and line count at the boundary, resolves its records and hands its own
+# end state on. Tokenizing is where the time goes; resolving is a few vectorized passes, so the hand-over chain
+# costs little. Only the 29-byte toolpath rows come back to the parent, never the 72-byte records. Since
+# resolve_records does not depend on where a chunk starts, the result is bit-identical to the serial parser.
+
+# Lines that start a new layer in common slicer output
+_LAYER_MARKERS = (b"\n;LAYER", b"\n; CHANGE_LAYER", b"\nG1 Z", b"\nG0 Z")
+# How far past a split point to look for a layer change before settling for the next line break
+_SPLIT_SEARCH_BYTES = 1 << 20
+
+# In a worker process: one (receiving end, sending end) pipe per boundary between ranges; pipe k carries the
+# modal state and line count from range k to range k + 1
+_range_links = None
+
+
+# Split G-code bytes into about 'parts' (start, end) ranges that begin at layer changes or, failing that, lines
+def split_at_layers(data, parts):
+    boundaries = [0]
+    for part in range(1, parts):
+        target = len(data) * part // parts
+        if target <= boundaries[-1]:
+            continue
+        found = [data.find(marker, target, target + _SPLIT_SEARCH_BYTES) for marker in _LAYER_MARKERS]
+        found = [position for position in found if position >= 0]
+        position = min(found) if found else data.find(b"\n", target)
+        if position < 0:
+            break
+        if boundaries[-1] < position + 1 < len(data):
+            boundaries.append(position + 1)
+    boundaries.append(len(data))
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _init_range_worker(links):
+    global _range_links
+    _range_links = links
+
+
+# Parse range 'number' of a G-code file; runs in a worker process
+# Returns the range's toolpath rows and the modal state after it. A range that fails hands over None instead of
+# a state, so the ranges after it fail too rather than wait for ever.
+def _parse_range(path, number, start, end, chunk_bytes, arc_tolerance):
+    outgoing = _range_links[number][1] if number < len(_range_links) else None
+    try:
+        source = GcodeSource.from_file(path)
+        parts = []
+        lines = 0
+        for chunk, line_offset in source.batches(chunk_bytes, start, end):
+            records = tokenize_gcode(chunk)
+            records['line'] += line_offset
+            parts.append(records)
+            lines = line_offset + chunk.count(b"\n")
+        source.close()
+        records = np.concatenate(parts) if parts else np.empty(0, dtype=_RECORD_DTYPE)
+
+        handover = _range_links[number - 1][0].recv() if number else (ModalState(), 0)
+        if handover is None:
+            raise RuntimeError("an earlier range of the file failed to parse")
+        state, line_offset = handover
+        toolpath, state = resolve_records(records, state, line_offset, arc_tolerance)
+    except BaseException:
+        if outgoing is not None:
+            outgoing.send(None)
+        raise
+    if outgoing is not None:
+        outgoing.send((state, line_offset + lines))
+    return toolpath, state
+
+
+# Parse a G-code file into a toolpath array using several worker processes
+# The file is split into 'parts' ranges, by default a few per worker so every worker stays busy when some layers
+# are denser than others
+def parse_toolpath_parallel(path, workers, chunk_bytes=PARSE_CHUNK_BYTES, arc_tolerance=ARC_TOLERANCE, parts=None):
+    source = GcodeSource.from_file(path)
+    ranges = split_at_layers(source.data, parts or workers * 4)
+    source.close()
+
+    links = [multiprocessing.Pipe(duplex=False) for _ in ranges[1:]]
+    try:
+        # Pools start jobs in the order they were submitted, so the range a worker waits for is always running
+        # or done
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_range_worker, initargs=(links,)) as pool:
+            futures = [pool.submit(_parse_range, path, number, start, end, chunk_bytes, arc_tolerance)
+                       for number, (start, end) in enumerate(ranges)]
+            toolpaths = [future.result()[0] for future in futures]
+    finally:
+        for receiving, sending in links:
+            receiving.close()
+            sending.close()
+    return np.concatenate(toolpaths) if toolpaths else np.empty(0, dtype=TOOLPATH_DTYPE)
+
+
+# Follow mode
+# A G-code file that is still being written (by a slicer, or while it is streamed to the printer) is parsed as
+# it grows. The follower keeps the byte offset it has read up to, the modal state after the last complete line
+# and the number of lines parsed, so each update tokenizes only the newly appended bytes; a trailing partial
+# line is held back until its line break arrives. Moves are appended to a buffer that doubles its capacity
+# when full, so an update costs time proportional to the new data rather than to the size of the file.
+
+# Array that grows by doubling its capacity, so appending n rows costs O(n) amortized
+# 'array' is a view of the filled rows; it stays valid after the buffer grows, but no longer sees later rows
+class GrowableArray:
+    def __init__(self, dtype, shape=(), capacity=1024):
+        self._data = np.empty((capacity,) + tuple(shape), dtype=dtype)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def array(self):
+        return self._data[:self.size]
+
+    def extend(self, rows):
+        needed = self.size + len(rows)
+        if needed > len(self._data):
+            grown = np.empty((max(needed, 2 * len(self._data)),) + self._data.shape[1:], dtype=self._data.dtype)
+            grown[:self.size] = self._data[:self.size]
+            self._data = grown
+        self._data[self.size:needed] = rows
+        self.size = needed
+
+    # Drop the rows from 'size' on; the capacity is kept for the rows that replace them
+    def truncate(self, size):
+        self.size = min(size, self.size)
+
+
+# Where a follower is in the G-code it follows
+class FollowState:
+    def __init__(self, path=None, arc_tolerance=ARC_TOLERANCE):
+        # File being followed; None when the G-code is fed from a pipe or socket
+        self.path = path
+        self.arc_tolerance = arc_tolerance
+        # Bytes of the file read so far
+        self.offset = 0
+        # (device, inode) of the file when it was last read, to notice it being replaced
+        self.identity = None
+        # Bytes after the last line break read so far; parsed once the line is complete
+        self.pending = b""
+        # Complete lines parsed so far, and the modal state after them
+        self.line_offset = 0
+        self.state = ModalState()
+        # Every move parsed so far
+        self.toolpath = GrowableArray(TOOLPATH_DTYPE)
+
+
+# Slicer summary scanner
+# Slicers write their summary comments in a header block (BambuStudio) or a trailer block (Slic3r, PrusaSlicer),
+# so the scanner only reads this many bytes from each end of the file and never walks the body
+METADATA_HEAD_BYTES = 512 * 1024
+METADATA_TAIL_BYTES = 512 * 1024
+
+
+# Every summary field collected by GcodeProcessor.scan_metadata; None when the file does not provide it
+@dataclass
+class GcodeMetadata:
+    layer_count: Optional[int] = None
+    max_z_height: Optional[float] = None
+    filament_length: Optional[float] = None   # mm
+    filament_weight: Optional[float] = None   # g
+    nozzle_temperature: Optional[float] = None
+    bed_temperature: Optional[float] = None
+    model_name: Optional[str] = None
+    print_time: Optional[str] = None
+    # Extent of the print: the slicer's header bounds when it writes them (Cura's ;MINX: and friends), otherwise
+    # the extruding moves of the parsed toolpath (see GcodeProcessor.scan_extent)
+    x_min: Optional[float] = None
+    x_max: Optional[float] = None
+    y_min: Optional[float] = None
+    y_max: Optional[float] = None
+
+
+# Summary fields found in slicer comments: (GcodeMetadata field, does the line hold it, read the value from the line)
+# The first line that holds a readable value wins
+_METADATA_FIELDS = [
+    ("layer_count", lambda line: "total layer number:" in line,
+     lambda line: int(line.split(":")[1].strip())),
+    ("max_z_height", lambda line: "max_z_height:" in line,
+     lambda line: float(line.split(":")[1].strip())),
+    ("filament_length", lambda line: "total filament length [mm] :" in line,
+     lambda line: float(line.split(":")[1].strip())),
+    ("filament_weight", lambda line: "total filament weight [g] :" in line,
+     lambda line: float(line.split(":")[1].strip())),
+    ("nozzle_temperature", lambda line: "; nozzle_temperature =" in line,
+     lambda line: float(line.split("nozzle_temperature =")[1].strip())),
+    ("bed_temperature", lambda line: line.startswith("M190 S"),
+     lambda line: float(line.split("S")[1].split(";")[0].strip())),
+    ("print_time", lambda line: "total estimated time:" in line,
+     lambda line: line.split(":")[1].strip()),
+    ("x_min", lambda line: line.startswith(";MINX:"), lambda line: float(line.split(":")[1].strip())),
+    ("x_max", lambda line: line.startswith(";MAXX:"), lambda line: float(line.split(":")[1].strip())),
+    ("y_min", lambda line: line.startswith(";MINY:"), lambda line: float(line.split(":")[1].strip())),
+    ("y_max", lambda line: line.startswith(";MAXY:"), lambda line: float(line.split(":")[1].strip())),
+]
+
+
+# Fill the comment-based fields of a GcodeMetadata from the given lines in a single pass
+def scan_metadata_lines(lines, metadata):
+    pending = list(_METADATA_FIELDS)
+    for line in lines:
+        for entry in pending:
+            name, holds, read = entry
+            if holds(line):
+                try:
+                    setattr(metadata, name, read(line))
+                except (IndexError, ValueError):
+                    continue  # Skip lines with incorrect formatting
+                pending.remove(entry)
+                break
+        if not pending:
+            break
+    return metadata
+
+
+# Read the comment-based summary fields of a GcodeSource from its first and last few hundred KB
+def scan_source_metadata(source, head_bytes=METADATA_HEAD_BYTES, tail_bytes=METADATA_TAIL_BYTES):
+    if source.size <= head_bytes + tail_bytes:
+        lines = source.head(source.size).decode("utf-8", "replace").splitlines()
+    else:
+        lines = (source.head(head_bytes).decode("utf-8", "replace").splitlines()
+                 + source.tail(tail_bytes).decode("utf-8", "replace").splitlines())
+    metadata = scan_metadata_lines(lines, GcodeMetadata())
+    # BambuStudio writes the model name on the second line of the file
+    if len(lines) > 1 and "BambuStudio" in lines[1]:
+        metadata.model_name = lines[1].strip("; ").strip()
+    return metadata
+
+
+# Toolpath simplification
+# Optional stage between parsing and meshing that removes vertices which add triangles but no shape:
+# travel and retract moves that lay down no filament, and vertices inside runs of nearly collinear extrusions.
+# The result is still a toolpath array; a row whose move is not MOVE_EXTRUDE only marks where the next
+# extrusion starts, so it should be meshed with export_to_stl(..., travel_moves=False).
+
+# Default tolerances: largest change of direction at a removed vertex, and largest distance any removed
+# vertex may end up from the merged segment that replaces it
+SIMPLIFY_ANGLE_TOLERANCE = 2.0     # degrees
+SIMPLIFY_DISTANCE_TOLERANCE = 0.02  # mm
+# Upper bound on merge passes; each pass removes about half of every run of removable vertices
+_SIMPLIFY_MAX_PASSES = 32
+
+
+# Simplify a toolpath array and return the simplified copy
+# All layers are processed at once, but vertices are only merged between segments on the same layer
+def simplify_toolpath(toolpath, angle_tolerance=SIMPLIFY_ANGLE_TOLERANCE,
+                      distance_tolerance=SIMPLIFY_DISTANCE_TOLERANCE, drop_travel=True):
+    extruding = toolpath['move'] == MOVE_EXTRUDE
+    if drop_travel:
+        # Keep extruding rows and the row each extrusion starts from
+        keep = extruding.copy()
+        keep[:-1] |= extruding[1:]
+        toolpath = toolpath[keep]
+    else:
+        toolpath = toolpath.copy()
+
+    # Largest distance between an original vertex and the segment that now ends at each row
+    error = np.zeros(len(toolpath))
+    cos_tolerance = np.cos(np.radians(angle_tolerance))
+    for _ in range(_SIMPLIFY_MAX_PASSES):
+        if len(toolpath) < 3:
+            break
+        points = np.stack((toolpath['x'], toolpath['y'], toolpath['z']), axis=1).astype(np.float64)
+        a, v, b = points[:-2], points[1:-1], points[2:]
+        move, feed = toolpath['move'], toolpath['f']
+
+        # A middle vertex can go when both of its segments extrude at the same feedrate on the same layer
+        candidate = ((move[1:-1] == MOVE_EXTRUDE) & (move[2:] == MOVE_EXTRUDE)
+                     & (feed[1:-1] == feed[2:]) & (a[:, 2] == v[:, 2]) & (v[:, 2] == b[:, 2]))
+        incoming, outgoing = v - a, b - v
+        lengths = np.linalg.norm(incoming, axis=1) * np.linalg.norm(outgoing, axis=1)
+        cos_turn = np.einsum('ij,ij->i', incoming, outgoing) / np.where(lengths > 0, lengths, 1)
+        candidate &= (lengths > 0) & (cos_turn >= cos_tolerance)
+        # Distance from the vertex to the chord that would replace its two segments
+        chord = b - a
+        chord_length = np.linalg.norm(chord, axis=1)
+        offset = np.linalg.norm(np.cross(incoming, chord), axis=1) / np.where(chord_length > 0, chord_length, 1)
+        merged_error = np.maximum(error[1:-1], error[2:]) + offset
+        candidate &= merged_error <= distance_tolerance
+
+        # Remove every other vertex of each run of candidates so no two removed vertices are neighbours
+        run_index = np.arange(len(candidate))
+        run_start = np.where(candidate & ~np.concatenate(([False], candidate[:-1])), run_index, 0)
+        np.maximum.accumulate(run_start, out=run_start)
+        remove = candidate & ((run_index - run_start) % 2 == 0)
+        if not remove.any():
+            break
+        removed = np.flatnonzero(remove) + 1
+        error[removed + 1] = merged_error[remove]
+        # The merged segment feeds the filament of both segments it replaces
+        toolpath['de'][removed + 1] += toolpath['de'][removed]
+        keep = np.ones(len(toolpath), dtype=bool)
+        keep[removed] = False
+        toolpath, error = toolpath[keep], error[keep]
+    return toolpath
+
+
+# Binary STL writer
+# Every segment of the toolpath becomes a small solid with four corners and six triangles. Corners, triangles
+# and normals are computed for a whole chunk of segments at once and written straight to a binary STL file:
+# an 80-byte header, a triangle count, then 50-byte triangle records.
+
+# One binary STL triangle record: facet normal, three vertices, attribute byte count
+STL_RECORD_DTYPE = np.dtype([
+    ('normal', '<f4', (3,)),
+    ('vectors', '<f4', (3, 3)),
+    ('attr', '<u2'),
+])
+# Segments meshed per chunk; the record buffer is allocated once for this many segments
+STL_CHUNK_SEGMENTS = 1 << 16
+# Triangles of each segment's solid, as indices into its four corners
+_SEGMENT_FACES = np.array([
+    [0, 1, 2], [0, 2, 3],  # Bottom face triangles
+    [0, 3, 2], [0, 2, 1],  # Side face triangles
+    [0, 1, 2], [0, 2, 3],  # Top face triangles
+])
+_STL_HEADER = b"Binary STL written by GCodeToSTL".ljust(80, b" ")
+
+
+# Positions of a toolpath (array or ColumnarToolpath), a list of (x, y, z) tuples or an (N, 3) array, as an (N, 3)
+# float array
+def _path_points(paths):
+    if _is_toolpath(paths):
+        return np.stack((paths['x'], paths['y'], paths['z']), axis=1)
+    return np.asarray(paths, dtype=np.float64).reshape(-1, 3)
+
+
+# Fill the first 6 * len(starts) records of 'records' with the triangles of the segments' solids
+def _fill_segment_records(records, starts, ends, width, height):
+    starts = starts.astype(np.float64)
+    ends = ends.astype(np.float64)
+    # Offset the corners across the path and lift the top edge by one layer height
+    low = np.array([width, 0.0, 0.0])
+    high = np.array([width, 0.0, height])
+    corners = np.stack((starts - low, ends - low, ends + high, starts + high), axis=1)
+
+    count = len(starts) * len(_SEGMENT_FACES)
+    records['vectors'][:count] = corners[:, _SEGMENT_FACES].reshape(-1, 3, 3)
+    _fill_normals(records, count)
+    return count
+
+
+# Set the facet normals and attribute bytes of the first 'count' records from their vertices
+def _fill_normals(records, count):
+    triangles = records['vectors'][:count]
+    # Unit facet normals; degenerate triangles get a zero normal
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    np.divide(normals, lengths, out=normals, where=lengths > 0)
+    normals[lengths[:, 0] == 0] = 0
+    records['normal'][:count] = normals
+    records['attr'][:count] = 0
+
+
+# Watertight export
+# export_to_stl gives every segment its own open solid, so neighbouring beads overlap and the mesh is far from
+# manifold. voxel_surface instead samples the volume of every extruded bead on a regular grid and extracts the
+# boundary of their union with marching cubes, which gives one closed, consistently oriented surface.
+#   - A bead is the set of points within extrusion_width / 2 of its segment in XY, between the segment's Z and
+#     one extrusion_height below it (by default the print's layer height, see _layer_height). Each grid sample
+#     stores its clearance (how far inside the nearest bead it lies, clipped to one voxel and quantized to
+#     int8); beads that touch exactly fuse.
+#   - The grid is built and meshed one slab of block_size sample planes at a time, and a slab only allocates
+#     the block_size x block_size tiles its beads reach, so memory depends on the footprint of one slab and
+#     never on the height of the build or on empty space. Long segments are cut into pieces first so every
+#     piece only visits the samples near it.
+#   - The marching cubes case table is generated below rather than typed in. On a face with two diagonally
+#     opposite inside corners the corners are always kept apart; both cubes sharing the face make the same
+#     choice, so the surface has no cracks and every edge is shared by exactly two triangles.
+#   - Marching cubes gives a couple of triangles per voxel of surface, so each slab's mesh is then simplified
+#     (see _simplify_surface): edges are collapsed wherever that moves the surface no more than voxel_tolerance
+#     voxels, keeping it closed and manifold. Flat tops and walls along X or Y shrink to a few triangles, but
+#     diagonal and curved beads keep most of their voxel-sized steps. On the bundled samples this leaves a
+#     third to a half of the triangles (kv: 47 676 to 21 926, sphere: 1 314 040 to 765 860), still more than
+#     the cuboids of export_to_stl (7 686 and 115 710), and it takes ten to twenty times as long as the
+#     marching cubes.
+#   - voxel_size should not exceed the layer height: with fewer sample planes than layers, a layer can fall
+#     between two planes and vanish from the surface. The default suits the usual 0.2 mm layers; a coarser
+#     grid is only smaller for prints with thicker layers.
+
+# Default grid spacing, in mm, and sample planes (and tile width) per slab
+VOXEL_SIZE = 0.2
+VOXEL_BLOCK_SIZE = 16
+# Largest distance, in voxels, that merging triangles may move the surface; merge passes per slab, and the
+# share of a slab's triangles below which a pass's merges end the merging
+VOXEL_TOLERANCE = 0.25
+_VOXEL_SIMPLIFY_PASSES = 64
+_VOXEL_SIMPLIFY_STOP = 0.002
+# Clearance stored for samples no bead reaches; inside is clearance >= 0
+_VOXEL_EMPTY = -127
+# Beads cut into pieces at once, and samples rasterized per batch, while filling a slab
+_VOXEL_BATCH_BEADS = 1 << 14
+_VOXEL_BATCH_SAMPLES = 1 << 18
+# Cubes meshed per batch
+_VOXEL_BATCH_CUBES = 1 << 16
+
+# Cube corner c sits at offset (c & 1, c >> 1 & 1, c >> 2 & 1); edges join corners that differ in one bit
+_CUBE_CORNERS = np.array([(c & 1, c >> 1 & 1, c >> 2 & 1) for c in range(8)])
+_CUBE_EDGES = np.array([(a, a | 1 << axis) for axis in range(3) for a in range(8) if not a >> axis & 1])
+
+
+# Triangles of every marching cubes case, as edge indices, and the number of triangles in each case
+def _marching_cubes_table():
+    edge_of = {tuple(pair): number for number, pair in enumerate(_CUBE_EDGES.tolist())}
+    # Faces each edge lies on, as (axis, side)
+    edge_faces = [{(axis, a >> axis & 1) for axis in range(3) if a >> axis & 1 == b >> axis & 1}
+                  for a, b in _CUBE_EDGES.tolist()]
+    # Corners of each face in counter-clockwise order seen from outside the cube
+    faces = []
+    for axis in range(3):
+        u, w = 1 << (axis + 1) % 3, 1 << (axis + 2) % 3
+        for side in (0, 1):
+            base = side << axis
+            cycle = [base, base | u, base | u | w, base | w]
+            faces.append(cycle if side else cycle[::-1])
+
+    cases = []
+    for mask in range(256):
+        # On each face, every run of inside corners gives one piece of surface, from the edge where the walk
+        # around the face enters the run to the edge where it leaves; the pieces join up into closed loops
+        following = {}
+        for cycle in faces:
+            inside = [bool(mask >> corner & 1) for corner in cycle]
+            for i in range(4):
+                if inside[i] or not inside[(i + 1) % 4]:
+                    continue
+                j = (i + 1) % 4
+                while inside[(j + 1) % 4]:
+                    j = (j + 1) % 4
+                entry = edge_of[tuple(sorted((cycle[i], cycle[(i + 1) % 4])))]
+                following[entry] = edge_of[tuple(sorted((cycle[j], cycle[(j + 1) % 4])))]
+        triangles = []
+        while following:
+            loop = [min(following)]
+            edge = following.pop(loop[0])
+            while edge != loop[0]:
+                loop.append(edge)
+                edge = following.pop(edge)
+            # Fan triangulation from a corner of the loop whose diagonals all cross the cube's interior; a
+            # diagonal lying in a face could also be drawn by the neighbouring cube, pinching the surface there
+            while any(edge_faces[loop[0]] & edge_faces[other] for other in loop[2:-1]):
+                loop = loop[1:] + loop[:1]
+            # Normals point from inside to outside
+            triangles += [(loop[0], loop[k], loop[k + 1]) for k in range(1, len(loop) - 1)]
+        cases.append(triangles)
+
+    table = np.zeros((256, max(map(len, cases)), 3), dtype=np.intp)
+    for mask, triangles in enumerate(cases):
+        table[mask, :len(triangles)] = np.reshape(triangles, (-1, 3))
+    return table, np.array([len(triangles) for triangles in cases])
+
+
+_MC_TRIANGLES, _MC_COUNTS = _marching_cubes_table()
+
+
+# Most common spacing between the heights beads are laid at, weighting each height by its number of beads so
+# the first layer and stray heights do not count for much; spiral (vase mode) prints have no such spacing and
+# need an explicit extrusion_height
+def _layer_height(top):
+    heights, counts = np.unique(top, return_counts=True)
+    if len(heights) < 2:
+        return float(heights[0]) if len(heights) and heights[0] > 0 else 0.2
+    steps = np.repeat(np.diff(heights), counts[1:])
+    return float(np.median(steps))
+
+
+# Merge the triangles of one slab's surface where that moves it by at most 'tolerance' (in sample units)
+# 'points' are welded vertices, 'faces' index them, and 'frozen' marks vertices that must stay where they are
+# Returns the remaining faces (indices into 'points')
+def _simplify_surface(points, faces, frozen, tolerance):
+    count = len(points)
+    # Error quadric of every vertex: the sum of the squared distances to the planes of its original triangles,
+    # as the coefficients of the products of x, y, z and 1 that 'monomials' holds for every vertex
+    row, column = np.triu_indices(4)
+    homogeneous = np.concatenate((points, np.ones((count, 1))), axis=1)
+    monomials = homogeneous[:, row] * homogeneous[:, column]
+    corners = points[faces]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    np.divide(normals, lengths, out=normals, where=lengths > 0)
+    planes = np.concatenate((normals, -np.einsum('ij,ij->i', normals, corners[:, 0])[:, None]), axis=1)
+    products = planes[:, row] * planes[:, column] * np.where(row == column, 1, 2)
+    quadrics = np.stack([np.bincount(faces.reshape(-1), np.repeat(products[:, k], 3), minlength=count)
+                         for k in range(len(row))], axis=1)
+    limit = tolerance * tolerance
+    # Vertices that may have a collapse this pass: at first every one, then only those next to a collapse or
+    # whose collapse had to wait
+    active = ~frozen
+
+    for step in range(_VOXEL_SIMPLIFY_PASSES):
+        # Directed edges (tail, head); on a closed surface every edge appears once in each direction
+        tail, head = faces.reshape(-1), faces[:, [1, 2, 0]].reshape(-1)
+        order = np.argsort(tail)
+        tail_sorted, neighbours = tail[order], head[order]
+        ring_start = np.searchsorted(tail_sorted, np.arange(count + 1))
+        face_of = order // 3  # Faces around each vertex, in the same order as its neighbours
+        edge_keys = np.sort(tail.astype(np.int64) * count + head)
+
+        # Candidate collapses: vertex v moves onto its neighbour u that is nearest the planes of both, if no
+        # further than 'tolerance' from them
+        movable = np.flatnonzero(active[tail])
+        v, u = tail[movable], head[movable]
+        cost = np.einsum('ij,ij->i', quadrics[v] + quadrics[u], monomials[u])
+        ok = np.flatnonzero(cost <= limit)
+        if not len(ok):
+            break
+        best = ok[np.lexsort((cost[ok], v[ok]))]
+        best = best[np.concatenate(([True], v[best][1:] != v[best][:-1]))]
+        v, u = v[best], u[best]
+
+        # Expand every candidate over the ring of v: neighbour w and face f
+        degree = ring_start[v + 1] - ring_start[v]
+        candidate = np.repeat(np.arange(len(v)), degree)
+        slot = np.arange(len(candidate)) - np.repeat(np.cumsum(degree) - degree, degree) + ring_start[v][candidate]
+        w, f = neighbours[slot], face_of[slot]
+        # The edge may only be collapsed if u and v have just the two neighbours in common that lie on its faces
+        keys = u[candidate].astype(np.int64) * count + w
+        found = edge_keys[np.minimum(np.searchsorted(edge_keys, keys), len(edge_keys) - 1)] == keys
+        linked = np.bincount(candidate, found, minlength=len(v)) == 2
+        # No face around v may flip over or collapse to a sliver once v is at u
+        corners = points[faces]
+        normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+        old = normals[f]
+        moved = faces[f]
+        vanishing = np.any(moved == u[candidate, None], axis=1)
+        moved = points[np.where(moved == v[candidate, None], u[candidate, None], moved)]
+        new = np.cross(moved[:, 1] - moved[:, 0], moved[:, 2] - moved[:, 0])
+        old_length, new_length = np.linalg.norm(old, axis=1), np.linalg.norm(new, axis=1)
+        flat = np.einsum('ij,ij->i', old, new) >= 0.5 * old_length * new_length
+        good = vanishing | (flat & (new_length > 1e-6))
+        valid = linked & (np.bincount(candidate, ~good, minlength=len(v)) == 0)
+        v, u = v[valid], u[valid]
+        if not len(v):
+            break
+
+        # Collapses that touch none of the same faces go ahead together. Among those that do, the one with the
+        # lowest priority (a hash of v) wins each round and the ones sharing a face with it wait for the next pass
+        priority = (v.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15) + np.uint64(step)) >> np.uint64(40)
+        priority = priority.astype(np.int64) * len(v) + np.arange(len(v))
+        ends = np.concatenate((v, u))
+        degree = ring_start[ends + 1] - ring_start[ends]
+        owner = np.repeat(np.tile(np.arange(len(v)), 2), degree)
+        f = face_of[np.arange(len(owner)) - np.repeat(np.cumsum(degree) - degree - ring_start[ends], degree)]
+        chosen = np.zeros(len(v), dtype=bool)
+        waiting = np.ones(len(v), dtype=bool)
+        taken = np.zeros(len(faces), dtype=bool)
+        while waiting.any():
+            pending = waiting[owner]
+            lowest = np.full(len(faces), np.iinfo(np.int64).max)
+            np.minimum.at(lowest, f[pending], priority[owner[pending]])
+            wins = waiting & (np.bincount(owner, pending & (lowest[f] != priority[owner]), minlength=len(v)) == 0)
+            chosen |= wins
+            taken[f[wins[owner]]] = True
+            waiting &= ~wins & (np.bincount(owner, taken[f], minlength=len(v)) == 0)
+        deferred, v, u = v[~chosen], v[chosen], u[chosen]
+
+        remap = np.arange(count)
+        remap[v] = u
+        faces = remap[faces]
+        faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])]
+        quadrics[u] += quadrics[v]
+        moved = np.zeros(count, dtype=bool)
+        moved[u] = True
+        active[:] = False
+        active[faces[moved[faces].any(axis=1)]] = True
+        active[deferred] = True
+        active &= ~frozen
+        if len(v) < _VOXEL_SIMPLIFY_STOP * len(faces):
+            break
+    return faces
+
+
+# Closed triangle surface of the union of the extruded beads, yielded in (T, 3, 3) float32 batches
+# 'paths' is a toolpath array (only segments ending in an extruding move are beads) or an (N, 3) array or list
+# of positions (every segment is a bead)
+def voxel_surface(paths, voxel_size=VOXEL_SIZE, extrusion_width=0.45, extrusion_height=None,
+                  block_size=VOXEL_BLOCK_SIZE, voxel_tolerance=VOXEL_TOLERANCE):
+    if _is_toolpath(paths):
+        x, y, z = paths['x'], paths['y'], paths['z']
+        beads = np.flatnonzero(paths['move'][1:] == MOVE_EXTRUDE) + 1
+    else:
+        points = _path_points(paths)
+        x, y, z = points[:, 0], points[:, 1], points[:, 2]
+        beads = np.arange(1, len(points))
+    if not len(beads):
+        return
+    # Bead i runs from row beads[i] - 1 to row beads[i]; beads are visited in order of their top
+    top = np.maximum(z[beads - 1], z[beads]).astype(np.float64)
+    order = np.argsort(top, kind='stable')
+    beads, top = beads[order], top[order]
+    v, size, radius = float(voxel_size), block_size, extrusion_width / 2
+    height = extrusion_height or _layer_height(top)
+
+    # Grid origin with a margin of empty samples on every side, and the tile grid covering the build plate
+    reach = radius + 2 * v
+    origin = np.array([min(x[beads - 1].min(), x[beads].min()) - reach,
+                       min(y[beads - 1].min(), y[beads].min()) - reach, top[0] - height - 2 * v])
+    tiles_x = int((max(x[beads - 1].max(), x[beads].max()) + reach - origin[0]) / v) // size + 2
+    tiles_y = int((max(y[beads - 1].max(), y[beads].max()) + reach - origin[1]) / v) // size + 2
+    # Slot of every allocated tile in the slab's field, -1 for tiles without one
+    tile_slot = np.full(tiles_x * tiles_y, -1, dtype=np.intp)
+    # Pieces are at most this long, which keeps the samples visited per mm of bead lowest
+    piece_length = 2 * (radius + v)
+    # Offsets of each edge's corners in a flattened padded tile, and the edge's first corner and axis
+    stride = np.array([1, size + 1, (size + 1) ** 2])
+    edge_offset = _CUBE_CORNERS[_CUBE_EDGES] @ stride
+    edge_start = _CUBE_CORNERS[_CUBE_EDGES[:, 0]].astype(np.float64)
+    edge_axis = np.argmax(_CUBE_CORNERS[_CUBE_EDGES[:, 1]] - _CUBE_CORNERS[_CUBE_EDGES[:, 0]], axis=1)
+
+    # Pieces of some beads that reach the slab whose first sample plane is at plane_z: start and step in XY,
+    # top, first and last sample plane reached, and the lowest sample and size of the block of samples around it
+    def slab_pieces(rows, plane_z):
+        start_x, start_y, start_z = (column[rows - 1].astype(np.float64) for column in (x, y, z))
+        step_x, step_y, step_z = (column[rows] - start for column, start in zip((x, y, z), (start_x, start_y, start_z)))
+        pieces = np.maximum(np.ceil(np.hypot(step_x, step_y) / piece_length), 1).astype(np.intp)
+        bead = np.repeat(np.arange(len(rows)), pieces)
+        number = np.arange(len(bead)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        step_x, step_y, step_z = step_x[bead] / pieces[bead], step_y[bead] / pieces[bead], step_z[bead] / pieces[bead]
+        start_x, start_y = start_x[bead] + step_x * number, start_y[bead] + step_y * number
+        piece_top = start_z[bead] + step_z * number + np.maximum(step_z, 0)
+
+        plane_low = np.maximum(np.ceil((piece_top - height - v - plane_z) / v), 0).astype(np.intp)
+        plane_high = np.minimum(np.floor((piece_top + v - plane_z) / v), size).astype(np.intp)
+        reached = np.flatnonzero(plane_high >= plane_low)
+        start_x, start_y, step_x, step_y = start_x[reached], start_y[reached], step_x[reached], step_y[reached]
+        end_x, end_y = start_x + step_x, start_y + step_y
+        low_x = np.floor((np.minimum(start_x, end_x) - radius - v - origin[0]) / v).astype(np.intp)
+        low_y = np.floor((np.minimum(start_y, end_y) - radius - v - origin[1]) / v).astype(np.intp)
+        across = np.ceil((np.maximum(start_x, end_x) + radius + v - origin[0]) / v).astype(np.intp) - low_x + 1
+        along = np.ceil((np.maximum(start_y, end_y) + radius + v - origin[1]) / v).astype(np.intp) - low_y + 1
+        return (start_x, start_y, step_x, step_y, piece_top[reached], plane_low[reached], plane_high[reached],
+                low_x, low_y, across, along)
+
+    for slab in range(int((top[-1] + v - origin[2]) / v) // size + 1):
+        # Sample planes first, ..., first + size; the top one is shared with the next slab
+        first = slab * size
+        plane_z = origin[2] + first * v
+        low, high = np.searchsorted(top, [plane_z - v, plane_z + size * v + height + v])
+        # Both passes below go through the slab's beads a batch at a time, so a slab crowded with beads (many
+        # copies of a part printed on top of each other) needs no more memory than any other
+        batches = [beads[start:start + _VOXEL_BATCH_BEADS] for start in range(low, high, _VOXEL_BATCH_BEADS)]
+
+        # Allocate every tile a piece's block of samples overlaps
+        keys = [np.empty(0, dtype=np.intp)]
+        for rows in batches:
+            low_x, low_y, across, along = slab_pieces(rows, plane_z)[7:]
+            tile_x, tile_y = low_x // size, low_y // size
+            tiles_across = (low_x + across - 1) // size - tile_x + 1
+            tile_counts = tiles_across * ((low_y + along - 1) // size - tile_y + 1)
+            owner = np.repeat(np.arange(len(tile_counts)), tile_counts)
+            local = np.arange(len(owner)) - np.repeat(np.cumsum(tile_counts) - tile_counts, tile_counts)
+            keys.append(np.unique((tile_x[owner] + local % tiles_across[owner]) * tiles_y
+                                  + tile_y[owner] + local // tiles_across[owner]))
+        keys = np.unique(np.concatenate(keys))
+        if not len(keys):
+            continue
+        tile_slot[keys] = np.arange(len(keys))
+        # field[tile, plane, y, x]: clearance of every sample of the slab
+        field = np.full((len(keys), size + 1, size, size), _VOXEL_EMPTY, dtype=np.int8)
+        flat = field.reshape(-1)
+
+        # Rasterize the pieces in batches of about _VOXEL_BATCH_SAMPLES samples
+        for rows in batches:
+            (start_x, start_y, step_x, step_y, piece_top, plane_low, plane_high,
+             low_x, low_y, across, along) = slab_pieces(rows, plane_z)
+            sample_counts = across * along
+            bounds = np.searchsorted(np.cumsum(sample_counts), np.arange(0, sample_counts.sum(), _VOXEL_BATCH_SAMPLES),
+                                     side='right')
+            for batch_start, batch_end in zip(bounds, np.append(bounds[1:], len(sample_counts))):
+                counts = sample_counts[batch_start:batch_end]
+                piece = np.repeat(np.arange(batch_start, batch_end), counts)
+                local = np.arange(len(piece)) - np.repeat(np.cumsum(counts) - counts, counts)
+                sample_x = low_x[piece] + local % across[piece]
+                sample_y = low_y[piece] + local // across[piece]
+
+                # Clearance in XY: bead radius minus the distance to the piece
+                offset_x = origin[0] + sample_x * v - start_x[piece]
+                offset_y = origin[1] + sample_y * v - start_y[piece]
+                d_x, d_y = step_x[piece], step_y[piece]
+                length2 = d_x * d_x + d_y * d_y
+                t = np.clip((offset_x * d_x + offset_y * d_y) / np.where(length2 > 0, length2, 1), 0, 1)
+                flat_clearance = radius - np.hypot(offset_x - d_x * t, offset_y - d_y * t)
+                near = np.flatnonzero(flat_clearance > -v)
+                piece, sample_x, sample_y = piece[near], sample_x[near], sample_y[near]
+                flat_clearance = flat_clearance[near]
+
+                # Clearance in Z on every plane the piece reaches, combined with the XY clearance
+                planes = plane_high[piece] - plane_low[piece] + 1
+                sample = np.repeat(np.arange(len(piece)), planes)
+                plane = np.arange(len(sample)) - np.repeat(np.cumsum(planes) - planes - plane_low[piece], planes)
+                depth = height / 2 - np.abs(plane_z + plane * v - (piece_top[piece] - height / 2)[sample])
+                clearance = np.minimum(flat_clearance[sample], depth)
+                value = np.round(np.clip(clearance / v, -1, 1) * 127).astype(np.int8)
+                sample_x, sample_y = sample_x[sample], sample_y[sample]
+                tile = tile_slot[(sample_x // size) * tiles_y + sample_y // size]
+                index = ((tile * (size + 1) + plane) * size + sample_y % size) * size + sample_x % size
+                np.maximum.at(flat, index, value)
+
+        # Pad every tile with the first row and column of its +X, +Y and +X+Y neighbours
+        padded = np.full((len(keys), size + 1, size + 1, size + 1), _VOXEL_EMPTY, dtype=np.int8)
+        padded[:, :, :size, :size] = field
+        for shift, target, source in ((tiles_y, np.s_[:, :size, size], np.s_[:, :, 0]),
+                                      (1, np.s_[:, size, :size], np.s_[:, 0, :]),
+                                      (tiles_y + 1, np.s_[:, size, size], np.s_[:, 0, 0])):
+            neighbour = tile_slot[keys + shift]
+            found = np.flatnonzero(neighbour >= 0)
+            padded[(found,) + target] = field[(neighbour[found],) + source]
+        tile_slot[keys] = -1
+        del field, flat
+
+        # Marching cubes: the case of every cube from which of its corners are inside
+        inside = padded >= 0
+        case = np.zeros((len(keys), size, size, size), dtype=np.uint8)
+        for corner, (dx, dy, dz) in enumerate(_CUBE_CORNERS):
+            case |= inside[:, dz:dz + size, dy:dy + size, dx:dx + size].astype(np.uint8) << corner
+        del inside
+        values = padded.reshape(-1)
+        cubes = np.flatnonzero(_MC_COUNTS[case.reshape(-1)])
+        surface, surface_edges = [], []
+        for batch in range(0, len(cubes), _VOXEL_BATCH_CUBES):
+            tile, k, j, i = np.unravel_index(cubes[batch:batch + _VOXEL_BATCH_CUBES], case.shape)
+            cube_case = case[tile, k, j, i]
+            counts = _MC_COUNTS[cube_case]
+            cube = np.repeat(np.arange(len(tile)), counts)
+            slot = np.arange(len(cube)) - np.repeat(np.cumsum(counts) - counts, counts)
+            edges = _MC_TRIANGLES[cube_case[cube], slot]
+
+            # Each vertex lies on its edge where the clearance crosses zero
+            corner = (((tile * (size + 1) + k) * (size + 1) + j) * (size + 1) + i)[cube, None, None]
+            corner = corner + edge_offset[edges]
+            value_a = values[corner[..., 0]].astype(np.float64)
+            value_b = values[corner[..., 1]].astype(np.float64)
+            t = (value_a + 0.5) / (value_a - value_b)
+            # Sample coordinates of each cube's lowest corner, then of every vertex
+            base = np.stack(((keys[tile] // tiles_y) * size + i, (keys[tile] % tiles_y) * size + j, first + k), axis=1)
+            vertices = base[cube, None] + edge_start[edges]
+            if voxel_tolerance:
+                # The grid edge every vertex lies on: its first corner, counted from the slab's, and its axis
+                ends = vertices.astype(np.intp)
+                surface_edges.append(((ends[..., 2] - first) * (tiles_y * size + 1) + ends[..., 1])
+                                     * (tiles_x * size + 1) * 3 + ends[..., 0] * 3 + edge_axis[edges])
+            vertices.reshape(-1, 3)[np.arange(t.size), edge_axis[edges].reshape(-1)] += t.reshape(-1)
+            surface.append(vertices)
+        if not surface:
+            continue
+        triangles = np.concatenate(surface)
+        del surface
+
+        if voxel_tolerance:
+            # Neighbouring cubes put the vertex on a shared grid edge at the same place, so welding the vertices
+            # of the same edge joins the triangles into one mesh
+            _, first_use, faces = np.unique(np.concatenate(surface_edges).reshape(-1), return_index=True,
+                                            return_inverse=True)
+            points, faces = triangles.reshape(-1, 3)[first_use], faces.reshape(-1, 3)
+            # Vertices on the first and last sample plane are shared with the neighbouring slabs, and the ones
+            # next to them keep the triangles along the slab's open edges in place
+            frozen = (points[:, 2] == first) | (points[:, 2] == first + size)
+            frozen[faces[np.any(frozen[faces], axis=1)]] = True
+            triangles = points[_simplify_surface(points, faces, frozen, voxel_tolerance)]
+        triangles *= v
+        triangles += origin
+        yield triangles.astype(np.float32)
+
+
+# Layer index for the 3D viewer
+# Segments are sorted once by the height of their highest end, with an offset table marking where each
+# layer starts. Everything at or below a Z height is then a prefix of the sorted segments, found with one
+# binary search, and showing or hiding layers only moves the end of that prefix.
+class LayerIndex:
+    def __init__(self, segments, values):
+        # segments: (N, 2, 3) start and end points; values: one colouring value per segment
+        top = segments[:, :, 2].max(axis=1)
+        order = np.argsort(top, kind='stable')
+        self.segments = segments[order]
+        self.values = values[order]
+        # Height of each layer and the offset of its first segment; layer k is segments[offsets[k]:offsets[k + 1]]
+        self.layer_z, first = np.unique(top[order], return_index=True)
+        self.offsets = np.append(first, len(top))
+        # Growth buffers behind the arrays once the index has been extended (see replace_tail)
+        self._buffers = None
+
+    def __len__(self):
+        return len(self.segments)
+
+    # Number of layers whose height is at or below the given height
+    def layers_below(self, z):
+        return int(np.searchsorted(self.layer_z, z, side='right'))
+
+    # Number of segments whose highest end is at or below the given height
+    def count_below(self, z):
+        return int(self.offsets[self.layers_below(z)])
+
+    # A coarser copy of the index with about half the segments in every layer
+    # Runs of connected segments (perimeters, infill zig-zags) are thinned by joining neighbouring pairs, which
+    # keeps the outline and both ends of every run; segments with no connected neighbour are stride-sampled
+    def decimate(self):
+        segments, values = self.segments, self.values
+        count = len(segments)
+        layer = np.repeat(np.arange(len(self.layer_z)), np.diff(self.offsets))
+        # joined[i]: segment i continues into segment i + 1 on the same layer
+        joined = np.zeros(count, dtype=bool)
+        joined[:-1] = np.all(segments[:-1, 1] == segments[1:, 0], axis=1) & (layer[:-1] == layer[1:])
+
+        # Position of each segment within its run of joined segments
+        position = np.arange(count)
+        run_start = np.where(np.concatenate(([True], ~joined[:-1])), position, 0)
+        np.maximum.accumulate(run_start, out=run_start)
+        position -= run_start
+
+        # Pairs start at even positions; the second segment of each pair is folded into the first
+        head = joined & (position % 2 == 0)
+        folded = np.concatenate(([False], head[:-1]))
+        # Every other isolated segment of each layer is kept
+        isolated = ~joined & (position == 0)
+        seen = np.cumsum(isolated)
+        rank = seen - np.concatenate(([0], seen))[self.offsets[:-1]][layer]
+        keep = ~folded & (~isolated | (rank % 2 == 1))
+
+        coarse = LayerIndex.__new__(LayerIndex)
+        coarse.segments = segments.copy()
+        coarse.values = values.copy()
+        pair_heads = np.flatnonzero(head)
+        coarse.segments[pair_heads, 1] = segments[pair_heads + 1, 1]
+        coarse.values[pair_heads] = (values[pair_heads] + values[pair_heads + 1]) / 2
+        coarse.segments = coarse.segments[keep]
+        coarse.values = coarse.values[keep]
+        coarse.layer_z = self.layer_z
+        coarse._buffers = None
+        coarse.offsets = np.concatenate(([0], np.cumsum(np.bincount(layer[keep], minlength=len(self.layer_z)))))
+        return coarse
+
+    # Levels of detail from this full-resolution index down to one with at most max_segments segments,
+    # halving the segment count at each level
+    def pyramid(self, max_segments):
+        levels = [self]
+        _deepen_pyramid(levels, max_segments)
+        return levels
+
+    # The layers from 'layer' up, as an index of views into this one
+    def tail(self, layer):
+        start = self.offsets[layer]
+        view = LayerIndex.__new__(LayerIndex)
+        view.segments = self.segments[start:]
+        view.values = self.values[start:]
+        view.layer_z = self.layer_z[layer:]
+        view.offsets = self.offsets[layer:] - start
+        view._buffers = None
+        return view
+
+    # Replace the layers from 'layer' up with every layer of 'other', which must all be higher than layer - 1
+    # Costs time proportional to the replaced and added segments, not to the size of the index
+    def replace_tail(self, layer, other):
+        if self._buffers is None:
+            self._buffers = []
+            for column in (self.segments, self.values, self.layer_z, self.offsets):
+                buffer = GrowableArray(column.dtype, column.shape[1:], max(2 * len(column), 1024))
+                buffer.extend(column)
+                self._buffers.append(buffer)
+        segments, values, layer_z, offsets = self._buffers
+        start = int(self.offsets[layer])
+        segments.truncate(start)
+        segments.extend(other.segments)
+        values.truncate(start)
+        values.extend(other.values)
+        layer_z.truncate(layer)
+        layer_z.extend(other.layer_z)
+        offsets.truncate(layer)
+        offsets.extend(other.offsets + start)
+        self.segments, self.values = segments.array, values.array
+        self.layer_z, self.offsets = layer_z.array, offsets.array
+
+    # Add segments as if the index had been built with them, and return the lowest layer that changed
+    # Only the layers at or above the lowest new segment are sorted again, so while a print grows upwards an
+    # update costs time proportional to the new segments and the few already in the top layer
+    def extend(self, segments, values):
+        if not len(segments):
+            return len(self.layer_z)
+        layer = int(np.searchsorted(self.layer_z, segments[:, :, 2].max(axis=1).min()))
+        tail = self.tail(layer)
+        # A stable sort of the old tail followed by the new segments keeps ties in file order, as a rebuild would
+        self.replace_tail(layer, LayerIndex(np.concatenate((tail.segments, segments)),
+                                            np.concatenate((tail.values, values))))
+        return layer
+
+
+# Add coarser levels to a pyramid until its coarsest level has at most max_segments segments
+def _deepen_pyramid(levels, max_segments):
+    while len(levels[-1]) > max_segments:
+        coarse = levels[-1].decimate()
+        if len(coarse) > 0.9 * len(levels[-1]):
+            break  # Nothing left that can be thinned
+        levels.append(coarse)
+
+
+# Add segments to a pyramid built by LayerIndex.pyramid, updating every level in place
+# Decimation never looks across layers, so each coarser level only re-decimates the layers that changed
+def extend_pyramid(levels, segments, values, max_segments):
+    layer = levels[0].extend(segments, values)
+    for number in range(1, len(levels)):
+        levels[number].replace_tail(layer, levels[number - 1].tail(layer).decimate())
+    if max_segments:
+        _deepen_pyramid(levels, max_segments)
+
+
+# Largest number of segments the interactive preview draws at once
+PREVIEW_MAX_SEGMENTS = 50000
+
+
+# Line segments as an (N, 2, 3) array, from an array or the list of (start, end) pairs of generate_lines_from_paths
+def _segment_array(lines):
+    return np.asarray(lines, dtype=np.float64).reshape(-1, 2, 3)
+
+
+# Segments between consecutive moves of a toolpath array, as an (N - 1, 2, 3) array
+def _toolpath_segments(toolpath):
+    points = np.stack((toolpath['x'], toolpath['y'], toolpath['z']), axis=1).astype(np.float64)
+    return np.stack((points[:-1], points[1:]), axis=1)
+
+
+# Colouring value of each segment: the mean E of its two ends
+def _segment_e_values(e_values, count):
+    e_values = np.asarray(e_values, dtype=np.float64)
+    values = e_values[:count].copy()
+    paired = min(count, len(e_values) - 1)
+    values[:paired] = (e_values[:paired] + e_values[1:paired + 1]) / 2
+    return values
+
+
+# Spatial index
+# QA queries (what is printed at Z = 12.4, which segments lie in this XY region, which segment is nearest to a
+# defect) answered without scanning the whole toolpath. Segments are grouped into layers by the height of their
+# highest end, as in LayerIndex, and registered in the cells of one uniform XY grid that they pass through.
+# Every non-empty (layer, cell) pair is a key in a sorted table pointing at its run of segment numbers, so a
+# query only visits the layers and cells it overlaps. Everything is kept in flat arrays that the cache can save.
+
+# Segments per layer in an average grid cell when the cell size is picked automatically
+SPATIAL_CELL_SEGMENTS = 16
+# Most cells along either side of the grid
+_SPATIAL_MAX_CELLS = 4096
+# Segments registered in the grid per batch while the index is built
+_SPATIAL_BATCH_SEGMENTS = 1 << 16
+
+
+class SegmentIndex:
+    def __init__(self, toolpath, moves=(MOVE_EXTRUDE,), cell_size=None):
+        # toolpath: a TOOLPATH_DTYPE array; moves: the MOVE_* kinds whose segments are indexed
+        # Segment k runs from toolpath row rows[k] - 1 to row rows[k]; queries return these end rows
+        self.toolpath = toolpath
+        self.moves = tuple(sorted(moves))
+        self.rows = np.flatnonzero(np.isin(toolpath['move'][1:], self.moves)) + 1
+        count = len(self.rows)
+        start, end = self._ends(np.arange(count))
+        self.bounds = np.stack((np.minimum(start, end).min(axis=0), np.maximum(start, end).max(axis=0))) \
+            if count else np.zeros((2, 3))
+
+        # Layers: layer k is segments layer_order[layer_offsets[k]:layer_offsets[k + 1]], all topping out at
+        # layer_z[k]; layer_floor[k] is the lowest end of any segment in layer k or above
+        top = np.maximum(start[:, 2], end[:, 2])
+        self.layer_z, layer = np.unique(top, return_inverse=True)
+        layer = layer.reshape(-1)
+        self.layer_order = np.argsort(layer, kind='stable')
+        self.layer_offsets = np.concatenate(([0], np.cumsum(np.bincount(layer, minlength=len(self.layer_z)))))
+        floor = np.minimum(start[:, 2], end[:, 2])[self.layer_order]
+        floor = np.minimum.reduceat(floor, self.layer_offsets[:-1]) if count else floor
+        self.layer_floor = np.minimum.accumulate(floor[::-1])[::-1]
+
+        # Grid: cells of cell_size mm from the lowest X/Y corner of the bounds
+        extent = self.bounds[1, :2] - self.bounds[0, :2]
+        if cell_size is None:
+            # About SPATIAL_CELL_SEGMENTS segments per cell and layer, but no smaller than a typical segment
+            length = np.hypot(*(end - start)[:, :2].T)
+            length = length[length > 0]
+            per_layer = count / max(len(self.layer_z), 1)
+            cell_size = max(float(np.median(length)) if len(length) else 1.0,
+                            float(np.sqrt(np.prod(extent) * SPATIAL_CELL_SEGMENTS / max(per_layer, 1))))
+        self.cell_size = max(float(cell_size), float(extent.max()) / _SPATIAL_MAX_CELLS, 1e-3)
+        self.shape = (extent // self.cell_size).astype(np.int64) + 1
+        self.cell_count = int(self.shape[0] * self.shape[1])
+
+        # Key of every (layer, cell) pair a segment passes through, with the segment's number
+        keys, numbers = [], []
+        for first in range(0, count, _SPATIAL_BATCH_SEGMENTS):
+            batch = np.arange(first, min(first + _SPATIAL_BATCH_SEGMENTS, count))
+            cell_keys, owner = self._cell_keys(start[batch], end[batch], layer[batch])
+            pairs = np.sort(cell_keys * len(batch) + owner)
+            pairs = pairs[np.concatenate(([True], pairs[1:] != pairs[:-1]))]
+            keys.append(pairs // len(batch))
+            numbers.append(pairs % len(batch) + first)
+        keys = np.concatenate(keys) if keys else np.empty(0, dtype=np.int64)
+        numbers = np.concatenate(numbers) if numbers else np.empty(0, dtype=np.int64)
+        # Batches hold increasing segment numbers, so a stable sort keeps each cell's segments in file order
+        order = np.argsort(keys, kind='stable')
+        self.cell_keys, first = np.unique(keys[order], return_index=True)
+        self.cell_offsets = np.append(first, len(order))
+        self.entries = numbers[order].astype(np.min_scalar_type(max(count - 1, 0)))
+
+    def __len__(self):
+        return len(self.rows)
+
+    # Start and end points of the given segments as two (n, 3) float64 arrays
+    def _ends(self, segments):
+        rows = self.rows[segments]
+        columns = [self.toolpath[axis] for axis in 'xyz']
+        return (np.stack([column[rows - 1] for column in columns], axis=1).astype(np.float64),
+                np.stack([column[rows] for column in columns], axis=1).astype(np.float64))
+
+    # Keys of the cells touched by each segment and the segment's position in the batch, as a (2, 4 * pieces)
+    # array. Segments are cut into pieces no longer than a cell, so each piece touches at most 2 x 2 cells and
+    # a long diagonal is registered only in the cells along it, not in every cell of its bounding box.
+    def _cell_keys(self, start, end, layer):
+        direction = end[:, :2] - start[:, :2]
+        pieces = np.maximum(np.ceil(np.hypot(*direction.T) / self.cell_size), 1).astype(np.int64)
+        owner = np.repeat(np.arange(len(pieces)), pieces)
+        step = (np.arange(len(owner)) - np.repeat(np.cumsum(pieces) - pieces, pieces))[:, None]
+        a = start[owner, :2] + direction[owner] * (step / pieces[owner, None])
+        b = start[owner, :2] + direction[owner] * ((step + 1) / pieces[owner, None])
+        low = self._cells(np.minimum(a, b))
+        high = self._cells(np.maximum(a, b))
+        base = layer[owner] * self.cell_count
+        keys = [base + y[:, 1] * self.shape[0] + x[:, 0] for x in (low, high) for y in (low, high)]
+        return np.stack((np.concatenate(keys), np.tile(owner, 4)))
+
+    # Grid cell (column, row) holding each X/Y point, clamped to the grid
+    def _cells(self, points):
+        cells = np.floor((points - self.bounds[0, :2]) / self.cell_size).astype(np.int64)
+        return np.clip(cells, 0, self.shape - 1)
+
+    # Range of layers that can hold a segment reaching into [z_min, z_max]
+    def _layer_range(self, z_min, z_max):
+        return (int(np.searchsorted(self.layer_z, z_min, side='left')),
+                int(np.searchsorted(self.layer_floor, z_max, side='right')))
+
+    # Segments registered in any grid cell overlapping the box, in file order; a superset of those crossing it
+    def _candidates(self, low, high):
+        first, last = self._layer_range(low[2], high[2])
+        if first >= last or np.any(high[:2] < self.bounds[0, :2]) or np.any(low[:2] > self.bounds[1, :2]):
+            return np.empty(0, dtype=np.int64)
+        (x0, y0), (x1, y1) = self._cells(low[:2]), self._cells(high[:2])
+        cells = (np.arange(y0, y1 + 1)[:, None] * self.shape[0] + np.arange(x0, x1 + 1)).ravel()
+        if (last - first) * len(cells) < len(self.cell_keys):
+            keys = (np.arange(first, last)[:, None] * self.cell_count + cells).ravel()
+            slots = np.searchsorted(self.cell_keys, keys)
+            found = slots < len(self.cell_keys)
+            found[found] = self.cell_keys[slots[found]] == keys[found]
+            slots = slots[found]
+        else:
+            # Boxes covering most of the index are cheaper to find by filtering the key table itself
+            layer, cell = np.divmod(self.cell_keys, self.cell_count)
+            column, row = cell % self.shape[0], cell // self.shape[0]
+            slots = np.flatnonzero((layer >= first) & (layer < last) & (column >= x0) & (column <= x1) &
+                                   (row >= y0) & (row <= y1))
+        starts, stops = self.cell_offsets[slots], self.cell_offsets[slots + 1]
+        lengths = stops - starts
+        positions = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        return np.unique(self.entries[positions]).astype(np.int64)
+
+    # Which of the given segments cross the box from low to high (slab test on each axis)
+    def _crosses(self, segments, low, high):
+        start, end = self._ends(segments)
+        direction = end - start
+        enter, leave = np.zeros(len(segments)), np.ones(len(segments))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for axis in range(3):
+                origin, step = start[:, axis], direction[:, axis]
+                a, b = (low[axis] - origin) / step, (high[axis] - origin) / step
+                # A segment parallel to the slab is either inside it for its whole length or never
+                inside = (origin >= low[axis]) & (origin <= high[axis])
+                flat = step == 0
+                enter = np.maximum(enter, np.where(flat, np.where(inside, -np.inf, np.inf), np.minimum(a, b)))
+                leave = np.minimum(leave, np.where(flat, np.where(inside, np.inf, -np.inf), np.maximum(a, b)))
+        return enter <= leave
+
+    # Toolpath rows ending a segment that crosses the box; Z limits default to the whole height
+    def region(self, x_min, y_min, x_max, y_max, z_min=-np.inf, z_max=np.inf):
+        low = np.array([x_min, y_min, z_min], dtype=np.float64)
+        high = np.array([x_max, y_max, z_max], dtype=np.float64)
+        segments = self._candidates(low, high)
+        return self.rows[segments[self._crosses(segments, low, high)]]
+
+    # Toolpath rows ending a segment that reaches height z, give or take tolerance mm
+    # Segments of a layer printed at Z = 12.4 are found with z_slice(12.4); a sloped segment is found at every
+    # height it passes through
+    def z_slice(self, z, tolerance=1e-3):
+        first, last = self._layer_range(z - tolerance, z + tolerance)
+        segments = np.sort(self.layer_order[self.layer_offsets[first]:self.layer_offsets[max(first, last)]])
+        start, end = self._ends(segments)
+        keep = (np.minimum(start[:, 2], end[:, 2]) <= z + tolerance) & \
+            (np.maximum(start[:, 2], end[:, 2]) >= z - tolerance)
+        return self.rows[segments[keep]]
+
+    # (row, distance) of the segment nearest to the point, or None when none is within max_distance mm
+    # The search looks in a box around the point that doubles in size until the nearest segment found in it is
+    # no farther than the box's half-width, so nothing outside the box can be nearer
+    def nearest(self, x, y, z, max_distance=np.inf):
+        if not len(self):
+            return None
+        point = np.array([x, y, z], dtype=np.float64)
+        # Half-width at which the box holds the whole index
+        limit = min(float(np.abs(self.bounds - point).max()), max_distance)
+        radius = min(self.cell_size / 4, limit)
+        while True:
+            segments = self._candidates(point - radius, point + radius)
+            if len(segments):
+                start, end = self._ends(segments)
+                direction = end - start
+                length = np.einsum('ij,ij->i', direction, direction)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    t = np.clip(np.einsum('ij,ij->i', point - start, direction) / length, 0, 1)
+                t[length == 0] = 0
+                distance = np.linalg.norm(start + t[:, None] * direction - point, axis=1)
+                best = int(np.argmin(distance))
+                if distance[best] <= radius:
+                    return int(self.rows[segments[best]]), float(distance[best])
+            if radius >= limit:
+                return None
+            radius = min(2 * radius, limit)
+
+    # Whether the index was built for these moves and cell size (None accepts any cell size)
+    def matches(self, moves, cell_size=None):
+        return self.moves == tuple(sorted(moves)) and (cell_size is None or cell_size == self.cell_size)
+
+    # The index as a dict of arrays for np.savez; from_arrays rebuilds it over the same toolpath
+    def to_arrays(self):
+        return {"moves": np.array(self.moves, dtype=np.uint8), "rows": self.rows, "bounds": self.bounds,
+                "layer_z": self.layer_z, "layer_order": self.layer_order, "layer_offsets": self.layer_offsets,
+                "layer_floor": self.layer_floor, "cell_size": np.array(self.cell_size), "shape": self.shape,
+                "cell_keys": self.cell_keys, "cell_offsets": self.cell_offsets, "entries": self.entries,
+                "toolpath_rows": np.array(len(self.toolpath))}
+
+    @classmethod
+    def from_arrays(cls, toolpath, arrays):
+        index = cls.__new__(cls)
+        index.toolpath = toolpath
+        index.moves = tuple(int(move) for move in arrays["moves"])
+        index.cell_size = float(arrays["cell_size"])
+        for name in ("rows", "bounds", "layer_z", "layer_order", "layer_offsets", "layer_floor", "shape",
+                     "cell_keys", "cell_offsets", "entries"):
+            setattr(index, name, arrays[name])
+        index.cell_count = int(index.shape[0] * index.shape[1])
+        return index
+
+
+# Toolpath analytics
+# Per-segment length, feedrate, volumetric flow and extrusion per mm, per-layer times and a print-time
+# estimate, all computed from the toolpath columns instead of slicer comments, so they are there for any slicer.
+# Segment k runs from toolpath row k to row k + 1, like the lines the viewer draws.
+
+# Filament diameter in mm, for volumetric flow
+FILAMENT_DIAMETER = 1.75
+# Machine model for the print-time estimate: one acceleration for every move (mm/s²) and Marlin's junction
+# deviation (mm), which sets how fast the nozzle may take a corner
+PRINT_ACCELERATION = 1000.0
+JUNCTION_DEVIATION = 0.013
+# Feedrate (mm/min) of moves before the first F word, as in Marlin
+_UNSET_FEEDRATE = 1500.0
+
+# Colouring channels of the viewer, with the colour bar label of each
+CHANNEL_LABELS = {
+    "e": "Filament fed (mm)",
+    "feedrate": "Feedrate (mm/s)",
+    "speed": "Average speed (mm/s)",
+    "flow": "Volumetric flow (mm³/s)",
+    "e_per_mm": "Extrusion per mm (mm/mm)",
+    "length": "Segment length (mm)",
+    "layer_time": "Layer time (s)",
+}
+
+
+# Results of analyze_toolpath; 'channels' maps each CHANNEL_LABELS name to one value per segment
+@dataclass
+class ToolpathAnalytics:
+    channels: dict
+    time: np.ndarray         # Seconds spent on each segment
+    layer: np.ndarray        # Layer number of each segment
+    layer_z: np.ndarray      # Height of each layer
+    layer_time: np.ndarray   # Seconds spent on each layer
+    print_time: float        # Seconds for the whole toolpath
+    filament_length: float   # mm of filament fed
+
+
+# Movement and filament fed over each segment, as (N - 1, 3) and (N - 1,) float64 arrays
+def _segment_deltas(toolpath):
+    points = np.stack((toolpath['x'], toolpath['y'], toolpath['z']), axis=1).astype(np.float64)
+    return np.diff(points, axis=0), toolpath['de'][1:].astype(np.float64)
+
+
+# Channels that only depend on each segment's own two rows, as float64 arrays
+def _local_channels(toolpath, delta, extruded, filament_diameter):
+    length = np.sqrt(np.einsum('ij,ij->i', delta, delta))
+    feedrate = toolpath['f'][1:].astype(np.float64)
+    feedrate = np.where(feedrate > 0, feedrate, _UNSET_FEEDRATE) / 60
+    e_per_mm = np.divide(extruded, length, out=np.zeros_like(length), where=length > 0)
+    # Commanded flow: filament cross-section times filament fed per second at the programmed feedrate
+    flow = np.pi * (filament_diameter / 2) ** 2 * np.maximum(e_per_mm, 0) * feedrate
+    return {"e": _segment_e_values(toolpath['e'], len(length)), "feedrate": feedrate, "flow": flow,
+            "e_per_mm": e_per_mm, "length": length}
+
+
+# Channels that only depend on each segment's own two rows, so they can be computed for any slice of a toolpath
+# (follow mode colours new moves with these); the time-based ones come from analyze_toolpath
+def segment_channels(toolpath, filament_diameter=FILAMENT_DIAMETER):
+    delta, extruded = _segment_deltas(toolpath)
+    channels = _local_channels(toolpath, delta, extruded, filament_diameter)
+    return {name: values.astype(np.float32) for name, values in channels.items()}
+
+
+# Format seconds the way slicers write their time estimates
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}h {seconds % 3600 // 60}m {seconds % 60}s"
+
+
+# Every analytics channel plus per-layer times and a print-time estimate for a toolpath array
+# Time follows a trapezoidal speed profile per move: the nozzle accelerates from its entry speed towards the
+# programmed feedrate and decelerates to its exit speed. Junction speeds are capped by both moves' feedrates and
+# by the junction deviation limit for the corner, and the print starts and ends at rest. The usual forward and
+# backward planner passes, w[j] = min(cap[j], w[j - 1] + 2 a d[j - 1]) on squared speeds, are running minima
+# of cap - reach once the reachable speed is written as a cumulative sum, so they are solved without a loop.
+# Rows that neither move the head nor feed filament (a lone F word, a repeated position) take no time and are
+# left out of the planner, so the moves on either side of them are joined as one corner instead of a stop.
+# Channels are kept as float32 like the viewer uses them; times stay float64.
+def analyze_toolpath(toolpath, acceleration=PRINT_ACCELERATION, junction_deviation=JUNCTION_DEVIATION,
+                     filament_diameter=FILAMENT_DIAMETER):
+    delta, extruded = _segment_deltas(toolpath)
+    channels = _local_channels(toolpath, delta, extruded, filament_diameter)
+    length, speed = channels["length"], channels["feedrate"]
+    for name in ("e", "flow", "e_per_mm"):
+        channels[name] = channels[name].astype(np.float32)
+    count = len(length)
+
+    # Moves without X/Y/Z motion (retractions) take their filament length at their feedrate
+    distance = np.where(length > 0, length, np.abs(extruded))
+    del extruded
+    # The planner only sees the moves that do something
+    planned = np.flatnonzero(distance > 0)
+    moves = len(planned)
+    delta, planned_length = delta[planned], length[planned]
+    planned_distance, planned_speed = distance[planned], speed[planned]
+    # Squared speed allowed at each junction, including the start and end of the print
+    np.divide(delta, planned_length[:, None], out=delta, where=planned_length[:, None] > 0)
+    # Cosine of the angle between the reversed incoming direction and the outgoing one: -1 going straight on
+    corner = -np.einsum('ij,ij->i', delta[:-1], delta[1:])
+    del delta
+    # Sine of half that angle, then the junction deviation speed limit for it
+    np.sqrt(np.clip(0.5 * (1 - corner), 0, 1, out=corner), out=corner)
+    with np.errstate(divide='ignore'):
+        corner = acceleration * junction_deviation * corner / (1 - corner)
+    corner[(planned_length[:-1] == 0) | (planned_length[1:] == 0)] = 0  # Retractions stop the head
+    cap = np.zeros(moves + 1)
+    cap[1:-1] = np.minimum(np.minimum(planned_speed[:-1], planned_speed[1:]) ** 2, corner)
+    del corner, planned_length
+
+    # Forward pass (acceleration limit), then backward pass (deceleration limit)
+    reach = np.concatenate(([0.0], np.cumsum(2 * acceleration * planned_distance)))
+    entry = reach + np.minimum.accumulate(cap - reach)
+    np.subtract(reach[-1], reach, out=reach)  # Now what is left to the end of the print
+    entry = reach + np.minimum.accumulate((entry - reach)[::-1])[::-1]
+    del reach, cap
+    np.maximum(entry, 0, out=entry)
+
+    # Accelerate to the peak speed, cruise at it if the move is long enough, then decelerate
+    squares = entry[:-1] + entry[1:]
+    peak = np.minimum(np.sqrt(acceleration * planned_distance + squares / 2), planned_speed)
+    cruise = np.maximum(planned_distance - (2 * peak ** 2 - squares) / (2 * acceleration), 0)
+    del squares
+    np.sqrt(entry, out=entry)
+    time = np.zeros(count)
+    time[planned] = (2 * peak - entry[:-1] - entry[1:]) / acceleration + cruise / planned_speed
+    del peak, cruise, entry, planned_distance, planned_speed, planned
+
+    # Every segment counts towards the layer of the next extruding segment, so the layer change and travel before
+    # a layer are part of it; segments after the last extrusion count towards the last layer
+    extruding = np.flatnonzero(toolpath['move'][1:] == MOVE_EXTRUDE)
+    if len(extruding):
+        height = toolpath['z'][1:][extruding]
+        layer_z = np.unique(height)
+        following = np.minimum(np.searchsorted(extruding, np.arange(count)), len(extruding) - 1)
+        layer = np.searchsorted(layer_z, height[following])
+        del following
+        layer_time = np.bincount(layer, weights=time, minlength=len(layer_z))
+    else:
+        layer_z, layer, layer_time = np.empty(0, dtype=np.float32), np.zeros(count, dtype=np.intp), np.zeros(1)
+
+    channels["length"], channels["feedrate"] = length.astype(np.float32), speed.astype(np.float32)
+    np.divide(distance, time, out=distance, where=time > 0)
+    distance[time <= 0] = 0
+    channels["speed"] = distance.astype(np.float32)
+    channels["layer_time"] = layer_time.astype(np.float32)[layer]
+    return ToolpathAnalytics(channels, time, layer, layer_z, layer_time[:len(layer_z)], float(time.sum()),
+                             float(toolpath['e'][-1]) if len(toolpath) else 0.0)
+
+
+# On-disk toolpath cache
+# Parsed toolpaths and metadata are stored under a key made of the G-code's content hash and the parser
+# version, so reopening a file skips parsing entirely and any parser change invalidates old entries.
+# Toolpaths are saved as .npy files and memory-mapped on load, which makes a hit cost about the same for a
+# 20M-line file as for a small one; compress=True trades that for smaller .npz files.
+# Hashing a file reads all of it. trust_mtime=True skips that for files whose path, size and modification
+# time match a file hashed before; this is a heuristic, since a file rewritten with the same size within the
+# file system's timestamp resolution (or with its mtime restored) would get the old file's toolpath.
+
+# Bump whenever the parser's output changes
+PARSER_VERSION = 3
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "gcode_to_stl")
+CACHE_MAX_BYTES = 1 << 30
+# Bytes hashed per call when computing a content hash
+_HASH_CHUNK_BYTES = 16 << 20
+# Files that make up one entry: info, toolpath (plain or compressed) and the optional SegmentIndex
+_CACHE_SUFFIXES = (".json", ".npy", ".npz", ".index.npz")
+# Data files left without their .json (a process killed mid-store) are removed once they are this old
+_CACHE_ORPHAN_SECONDS = 3600
+
+
+class ToolpathCache:
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=CACHE_MAX_BYTES, compress=False,
+                 trust_mtime=False):
+        self.directory = directory
+        # Least recently used entries are evicted once the cache grows past this size
+        self.max_bytes = max_bytes
+        self.compress = compress
+        # Reuse the hash of a file whose path, size and modification time are unchanged (see above)
+        self.trust_mtime = trust_mtime
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    # Cache key of a GcodeSource: content hash plus parser version
+    # With trust_mtime, hashes of files are remembered by path, size and modification time so unchanged files
+    # are not rehashed
+    def key(self, source):
+        stat = None
+        if self.trust_mtime and source.path is not None:
+            stat = os.stat(source.path)
+            known = self._read_json("sources.json", {}).get(os.path.abspath(source.path))
+            if known and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+                return f"{known[2]}-v{PARSER_VERSION}"
+
+        digest = hashlib.blake2b(digest_size=20)
+        with memoryview(source.data) as view:
+            for start in range(0, len(view), _HASH_CHUNK_BYTES):
+                digest.update(view[start:start + _HASH_CHUNK_BYTES])
+        digest = digest.hexdigest()
+
+        if stat is not None:
+            sources = self._read_json("sources.json", {})
+            sources[os.path.abspath(source.path)] = [stat.st_size, stat.st_mtime_ns, digest]
+            self._write_json("sources.json", sources)
+        return f"{digest}-v{PARSER_VERSION}"
+
+    # Return (toolpath, metadata) stored under the key, or None
+    def load(self, key):
+        info = self._read_json(f"{key}.json", None)
+        path = self._toolpath_path(key, info)
+        if info is None or path is None:
+            self.misses += 1
+            return None
+        if path.endswith(".npz"):
+            with np.load(path) as archive:
+                toolpath = archive["toolpath"]
+        else:
+            toolpath = np.load(path, mmap_mode="r")
+        # Touch the entry so eviction sees it as recently used
+        os.utime(os.path.join(self.directory, f"{key}.json"))
+        self.hits += 1
+        return toolpath, GcodeMetadata(**info["metadata"])
+
+    # Store a toolpath and its metadata under the key, then evict old entries if the cache is too big
+    def store(self, key, toolpath, metadata):
+        base = os.path.join(self.directory, key)
+        temporary = f"{base}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            if self.compress:
+                np.savez_compressed(file, toolpath=toolpath)
+            else:
+                np.save(file, toolpath)
+        os.replace(temporary, base + (".npz" if self.compress else ".npy"))
+        self._write_json(f"{key}.json", {"parser_version": PARSER_VERSION, "compressed": self.compress,
+                                         "metadata": asdict(metadata)})
+        self._evict(keep=key)
+
+    # Store a SegmentIndex built over the toolpath stored under the key; it is evicted together with the entry
+    def store_index(self, key, index):
+        path = os.path.join(self.directory, key + ".index.npz")
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            np.savez(file, **index.to_arrays())
+        os.replace(temporary, path)
+        self._evict(keep=key)
+
+    # The SegmentIndex stored under the key, over the given (cached) toolpath, or None
+    def load_index(self, key, toolpath):
+        try:
+            with np.load(os.path.join(self.directory, key + ".index.npz")) as archive:
+                arrays = {name: archive[name] for name in archive.files}
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        if int(arrays["toolpath_rows"]) != len(toolpath):
+            return None
+        return SegmentIndex.from_arrays(toolpath, arrays)
+
+    # Hit and miss counters plus the current size of the cache and the number of orphaned data files
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries()),
+                "bytes": sum(size for _, _, size in self._entries()), "orphans": len(self._orphans())}
+
+    # Remove stale orphaned data files, then least recently used entries until the cache fits in max_bytes
+    def _evict(self, keep=None):
+        # Younger orphans may belong to a store still in progress in another process
+        for name, modified in self._orphans():
+            if time.time() - modified > _CACHE_ORPHAN_SECONDS:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        for key, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            for suffix in _CACHE_SUFFIXES:
+                try:
+                    os.remove(os.path.join(self.directory, key + suffix))
+                except FileNotFoundError:
+                    pass
+            total -= size
+
+    # (key, last use time, size in bytes) of every entry
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json") or name == "sources.json":
+                continue
+            key = name[:-len(".json")]
+            try:
+                used = os.path.getmtime(os.path.join(self.directory, name))
+                size = sum(os.path.getsize(os.path.join(self.directory, key + suffix))
+                           for suffix in _CACHE_SUFFIXES
+                           if os.path.exists(os.path.join(self.directory, key + suffix)))
+            except FileNotFoundError:
+                continue  # Evicted by another process
+            entries.append((key, used, size))
+        return entries
+
+    # (file name, modification time) of every data file whose entry has no .json
+    def _orphans(self):
+        names = set(os.listdir(self.directory))
+        orphans = []
+        for name in names:
+            # Longest suffix first, so that an index file is not taken for a compressed toolpath
+            suffix = next((suffix for suffix in (".index.npz", ".npz", ".npy") if name.endswith(suffix)), None)
+            if suffix is None or name[:-len(suffix)] + ".json" in names:
+                continue
+            try:
+                orphans.append((name, os.path.getmtime(os.path.join(self.directory, name))))
+            except FileNotFoundError:
+                continue
+        return orphans
+
+    def _toolpath_path(self, key, info):
+        if info is None:
+            return None
+        path = os.path.join(self.directory, key + (".npz" if info.get("compressed") else ".npy"))
+        return path if os.path.exists(path) else None
+
+    def _read_json(self, name, default):
+        try:
+            with open(os.path.join(self.directory, name)) as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return default
+
+    # Write through a temporary file so readers in other processes never see half a file
+    def _write_json(self, name, value):
+        path = os.path.join(self.directory, name)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(value, file)
+        os.replace(temporary, path)
+
+
+# Columnar toolpath files
+# A parsed toolpath saved column by column, so that loading it maps the file and every column is a NumPy view
+# of the mapping: nothing is parsed or copied, and pages are only read when a column is used. Layout, all
+# little-endian:
+#   bytes 0-7     magic b"GCTPATH\0"
+#   bytes 8-11    format version (uint32)
+#   bytes 12-15   length H of the header (uint32)
+#   bytes 16-     header: H bytes of UTF-8 JSON with "rows", "layers", "columns" ({name: [dtype, offset]}),
+#                 "parser_version" and "metadata" (the GcodeMetadata fields, or null)
+#   then each column at the offset the header gives, aligned to 64 bytes:
+#     x, y, z, e, de, f  float32  position (mm), cumulative filament fed (mm), filament fed by the move (mm),
+#                                 feedrate (mm/min)
+#     line            uint32    1-based line number in the source G-code
+#     move            uint8     MOVE_* kind
+#     layer_z         float32   height of each layer
+#     layer_offsets   uint64    first row of each layer, then the row count
+# Layers are runs of rows in file order: every row belongs to the layer of the next extruding move, so the
+# layer change and travel before a layer are part of it. A file printing objects one after another has
+# several runs at the same height. At 29 bytes per move, a file is about as big as the toolpath array.
+
+TOOLPATH_SUFFIX = ".gctp"
+_TOOLPATH_MAGIC = b"GCTPATH\0"
+_TOOLPATH_VERSION = 1
+_TOOLPATH_ALIGN = 64
+# Rows copied per write when a column is not contiguous in memory
+_TOOLPATH_WRITE_ROWS = 1 << 20
+
+
+# A toolpath held as separate columns, usually views of a mapped toolpath file (see load_toolpath)
+# It reads like a TOOLPATH_DTYPE array where the rest of the converter uses one: toolpath['x'] is a column,
+# len() is the number of moves, and toolpath[rows] with a slice gives views while masks and index arrays copy.
+class ColumnarToolpath:
+    dtype = TOOLPATH_DTYPE
+
+    def __init__(self, columns, layer_z=None, layer_offsets=None, metadata=None, buffer=None):
+        self.columns = columns              # {TOOLPATH_DTYPE field name: 1-D array}
+        self.layer_z = layer_z              # Height of each layer, or None for a slice
+        self.layer_offsets = layer_offsets  # Layer k is rows layer_offsets[k]:layer_offsets[k + 1]
+        self.metadata = metadata            # GcodeMetadata saved with the toolpath, or None
+        self._buffer = buffer               # The mapping the columns are views of
+
+    def __len__(self):
+        return len(self.columns['x'])
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.columns[key]
+        return ColumnarToolpath({name: column[key] for name, column in self.columns.items()})
+
+    def copy(self):
+        return ColumnarToolpath({name: column.copy() for name, column in self.columns.items()},
+                                self.layer_z, self.layer_offsets, self.metadata)
+
+    # Rows of layer k, as views
+    def layer(self, k):
+        return self[int(self.layer_offsets[k]):int(self.layer_offsets[k + 1])]
+
+    # Consecutive slices of at most 'rows' moves, as views; export_to_stl meshes these one by one
+    def batches(self, rows=STL_CHUNK_SEGMENTS * 16):
+        for first in range(0, len(self), rows):
+            yield self[first:first + rows]
+
+    # A TOOLPATH_DTYPE array with the same rows (a copy)
+    def to_array(self):
+        toolpath = np.empty(len(self), dtype=TOOLPATH_DTYPE)
+        for name, column in self.columns.items():
+            toolpath[name] = column
+        return toolpath
+
+
+# Whether 'paths' is a toolpath (a TOOLPATH_DTYPE array or a ColumnarToolpath) rather than a list of positions
+def _is_toolpath(paths):
+    return isinstance(paths, ColumnarToolpath) or (isinstance(paths, np.ndarray) and paths.dtype.names is not None)
+
+
+# Layer heights and offsets of a toolpath's layers as runs of rows in file order (see the layout above)
+def toolpath_layers(toolpath):
+    extruding = np.flatnonzero(toolpath['move'] == MOVE_EXTRUDE)
+    if not len(extruding):
+        return np.empty(0, dtype=np.float32), np.zeros(1, dtype=np.uint64)
+    height = toolpath['z'][extruding]
+    following = np.minimum(np.searchsorted(extruding, np.arange(len(toolpath))), len(extruding) - 1)
+    row_z = height[following]
+    starts = np.concatenate(([0], np.flatnonzero(row_z[1:] != row_z[:-1]) + 1))
+    return row_z[starts].astype(np.float32), np.append(starts, len(toolpath)).astype(np.uint64)
+
+
+# Write a toolpath (TOOLPATH_DTYPE array or ColumnarToolpath) and optional GcodeMetadata as a toolpath file
+# Returns the number of bytes written
+def save_toolpath(path, toolpath, metadata=None):
+    layer_z, layer_offsets = toolpath_layers(toolpath)
+    columns = [(name, toolpath[name], TOOLPATH_DTYPE[name].newbyteorder('<')) for name in TOOLPATH_DTYPE.names]
+    columns += [("layer_z", layer_z, np.dtype('<f4')), ("layer_offsets", layer_offsets, np.dtype('<u8'))]
+
+    # Column offsets depend on the header's length, and the header holds the offsets: lay the columns out
+    # after a header of the final length, which is found in a few rounds because offsets only ever grow
+    header_length = 0
+    while True:
+        offset = -(-(16 + header_length) // _TOOLPATH_ALIGN) * _TOOLPATH_ALIGN
+        layout = {}
+        for name, column, dtype in columns:
+            layout[name] = [dtype.str, offset]
+            offset = -(-(offset + len(column) * dtype.itemsize) // _TOOLPATH_ALIGN) * _TOOLPATH_ALIGN
+        header = json.dumps({"rows": len(toolpath), "layers": len(layer_z), "columns": layout,
+                             "parser_version": PARSER_VERSION,
+                             "metadata": asdict(metadata) if metadata is not None else None}).encode()
+        if len(header) <= header_length:
+            break
+        header_length = len(header)
+    header = header.ljust(header_length)
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(_TOOLPATH_MAGIC + np.array([_TOOLPATH_VERSION, header_length], dtype='<u4').tobytes() + header)
+        for name, column, dtype in columns:
+            file.write(b"\0" * (layout[name][1] - file.tell()))
+            for first in range(0, len(column), _TOOLPATH_WRITE_ROWS):
+                np.ascontiguousarray(column[first:first + _TOOLPATH_WRITE_ROWS], dtype=dtype).tofile(file)
+        file.write(b"\0" * (offset - file.tell()))
+    os.replace(temporary, path)
+    return offset
+
+
+# Map a toolpath file and return it as a ColumnarToolpath whose columns are read-only views of the mapping
+def load_toolpath(path):
+    with open(path, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[:8] != _TOOLPATH_MAGIC:
+        raise ValueError(f"{path} is not a toolpath file")
+    version, header_length = (int(value) for value in np.frombuffer(buffer, dtype='<u4', count=2, offset=8))
+    if version != _TOOLPATH_VERSION:
+        raise ValueError(f"{path} has toolpath file version {version}; this converter reads version "
+                         f"{_TOOLPATH_VERSION}")
+    header = json.loads(buffer[16:16 + header_length])
+    # Columns written by another parser version may be missing or mean something else, like a toolpath cache
+    # entry of another version; unlike a cache entry, the file cannot be parsed again without its G-code
+    if header.get("parser_version") != PARSER_VERSION:
+        raise ValueError(f"{path} was written by parser version {header.get('parser_version')}; this converter "
+                         f"is version {PARSER_VERSION}. Convert the G-code again to get a current toolpath file")
+    counts = {"layer_z": header["layers"], "layer_offsets": header["layers"] + 1}
+    columns = {name: np.frombuffer(buffer, dtype=dtype, count=counts.get(name, header["rows"]), offset=offset)
+               for name, (dtype, offset) in header["columns"].items()}
+    layer_z, layer_offsets = columns.pop("layer_z"), columns.pop("layer_offsets")
+    metadata = GcodeMetadata(**header["metadata"]) if header["metadata"] is not None else None
+    return ColumnarToolpath(columns, layer_z, layer_offsets, metadata, buffer)
+
+
+# Instrumentation
+# Opt-in per-stage measurements. Give a GcodeProcessor a Profiler and every stage it runs records wall time,
+# CPU time, peak traced allocation and item counts (lines, moves, triangles, ...) into the profiler's report.
+# Stages called from other stages (parse_toolpath from parse_extrusion_paths, cache lookups from parse_toolpath)
+# are recorded as children. Without a profiler, stages enter a shared no-op context and nothing is measured.
+
+# Measurements of one run of one stage
+@dataclass
+class StageRecord:
+    name: str
+    start: float  # Seconds since the profiler was created
+    depth: int    # 0 for stages called directly, 1 for stages they call, and so on
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    peak_memory_bytes: Optional[int] = None  # Largest traced allocation above what was allocated at the start
+    counts: dict = field(default_factory=dict)
+    profile: Optional[str] = None  # cProfile listing, for the stage chosen with Profiler(profile_stage=...)
+
+    # Record item counts, e.g. stage.count(moves=len(toolpath))
+    def count(self, **counts):
+        self.counts.update(counts)
+
+
+# Stand-in for a stage when profiling is off
+class _DisabledStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def count(self, **counts):
+        pass
+
+
+_DISABLED_STAGE = _DisabledStage()
+
+
+# Chrome trace events ("X" complete events, in microseconds) for a report in its to_dict() form
+# Open the saved file in chrome://tracing or https://ui.perfetto.dev
+def chrome_trace_events(report, pid=0, process_name=None):
+    events = []
+    if process_name:
+        events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": process_name}})
+    origin = report["started_at"] * 1e6
+    for stage in report["stages"]:
+        args = dict(stage["counts"], cpu_seconds=stage["cpu_seconds"])
+        if stage["peak_memory_bytes"] is not None:
+            args["peak_memory_bytes"] = stage["peak_memory_bytes"]
+        events.append({"name": stage["name"], "cat": "stage", "ph": "X", "pid": pid, "tid": 0,
+                       "ts": round(origin + stage["start"] * 1e6, 1), "dur": round(stage["wall_seconds"] * 1e6, 1),
+                       "args": args})
+    return events
+
+
+# Every stage a Profiler recorded, in the order the stages started
+class ProfileReport:
+    def __init__(self):
+        self.started_at = time.time()  # Wall-clock time the stage start offsets count from
+        self.stages = []
+
+    # Calls, total wall/CPU seconds, largest peak allocation and summed counts per stage name
+    def totals(self):
+        totals = {}
+        for stage in sorted(self.stages, key=lambda stage: stage.start):
+            total = totals.setdefault(stage.name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+                                                   "peak_memory_bytes": None, "counts": {}})
+            total["calls"] += 1
+            total["wall_seconds"] += stage.wall_seconds
+            total["cpu_seconds"] += stage.cpu_seconds
+            if stage.peak_memory_bytes is not None:
+                total["peak_memory_bytes"] = max(total["peak_memory_bytes"] or 0, stage.peak_memory_bytes)
+            for name, value in stage.counts.items():
+                total["counts"][name] = total["counts"].get(name, 0) + value
+        return totals
+
+    def to_dict(self):
+        return {"started_at": self.started_at,
+                "stages": [asdict(stage) for stage in sorted(self.stages, key=lambda stage: stage.start)],
+                "totals": self.totals()}
+
+    def save_json(self, path):
+        with open(path, "w") as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+    def save_chrome_trace(self, path):
+        with open(path, "w") as file:
+            json.dump({"traceEvents": chrome_trace_events(self.to_dict(), os.getpid()),
+                       "displayTimeUnit": "ms"}, file)
+
+    # One line per stage, indented under the stage that called it
+    def __str__(self):
+        rows = [f"{'stage':<34}{'wall s':>10}{'cpu s':>10}{'peak MB':>10}  counts"]
+        for stage in sorted(self.stages, key=lambda stage: stage.start):
+            peak = f"{stage.peak_memory_bytes / 1e6:.1f}" if stage.peak_memory_bytes is not None else "-"
+            counts = ", ".join(f"{name}={value}" for name, value in stage.counts.items())
+            rows.append(f"{'  ' * stage.depth + stage.name:<34}{stage.wall_seconds:>10.4f}"
+                        f"{stage.cpu_seconds:>10.4f}{peak:>10}  {counts}")
+        return "\n".join(rows)
+
+
+# Measures stages into a ProfileReport
+# memory=True traces allocations with tracemalloc, which slows allocation-heavy stages down; the peak it reports
+# covers Python and NumPy allocations but not pages of memory-mapped files.
+# profile_stage names one stage to run under cProfile; its listing is kept on the stage's record, and the raw
+# statistics are also written to profile_path when one is given (for pstats or snakeviz).
+class Profiler:
+    def __init__(self, memory=True, profile_stage=None, profile_path=None, profile_lines=30):
+        self.memory = memory
+        self.profile_stage = profile_stage
+        self.profile_path = profile_path
+        self.profile_lines = profile_lines
+        self.report = ProfileReport()
+        self._origin = time.perf_counter()
+        self._open = []  # [record, allocated at start, highest peak seen] for every stage that is running
+        self._owns_tracing = False
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        record = StageRecord(name, time.perf_counter() - self._origin, len(self._open))
+        frame = [record, 0, 0]
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._owns_tracing = True
+            current, peak = tracemalloc.get_traced_memory()
+            # tracemalloc has one peak; hand what was reached so far to the enclosing stage and start over
+            if self._open:
+                self._open[-1][2] = max(self._open[-1][2], peak)
+            tracemalloc.reset_peak()
+            frame[1:] = current, current
+        self._open.append(frame)
+
+        profile = cProfile.Profile() if name == self.profile_stage else None
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+            record.wall_seconds = time.perf_counter() - wall
+            record.cpu_seconds = time.process_time() - cpu
+            self._open.pop()
+            if self.memory:
+                peak = max(frame[2], tracemalloc.get_traced_memory()[1])
+                record.peak_memory_bytes = peak - frame[1]
+                if self._open:
+                    self._open[-1][2] = max(self._open[-1][2], peak)
+                tracemalloc.reset_peak()
+                if not self._open and self._owns_tracing:
+                    tracemalloc.stop()
+                    self._owns_tracing = False
+            if profile is not None:
+                listing = io.StringIO()
+                pstats.Stats(profile, stream=listing).sort_stats("cumulative").print_stats(self.profile_lines)
+                record.profile = listing.getvalue()
+                if self.profile_path:
+                    profile.dump_stats(self.profile_path)
+            self.report.stages.append(record)
+
 
 # Define a class to handle G-code processing and operations
 class GcodeProcessor:
-    def __init__(self):
+    def __init__(self, cache=None, profiler=None):
         # Initialize an empty string to hold the G-code data
         self.gcode = ""
+        # Optional ToolpathCache used by parse_toolpath and spatial_index
+        self.cache = cache
+        # Optional Profiler that measures every stage; its report is in self.profiler.report
+        self.profiler = profiler
+        # Columnar toolpath array filled in by parse_toolpath
+        self.toolpath = None
+        # Summary fields filled in by scan_metadata
+        self.metadata = None
+        # FollowState of the G-code being followed, set by start_follow
+        self.follower = None
+        # Cache key of the parsed toolpath, set by parse_toolpath when a cache is attached
+        self.cache_key = None
+        # SegmentIndex over the toolpath, built by spatial_index
+        self.segment_index = None
+        # ToolpathAnalytics of the toolpath, computed by analyze_toolpath, and what they were computed from
+        self.analytics = None
+        self._analyzed = None
 
     # Method to read G-code input from a file
     def input_from_file(self):
         # Prompt the user to enter the path to a .gcode file
-        file_path = input("Enter the path to your .gcode file: ")
+        file_path = input(f"Enter the path to your .gcode (or {TOOLPATH_SUFFIX}) file: ")
        
+        # A toolpath saved earlier (see save_toolpath) is mapped instead of parsed
+        if os.path.exists(file_path) and file_path.endswith(TOOLPATH_SUFFIX):
+            try:
+                self.load_toolpath(file_path)
+                print("Toolpath file successfully read.")
+            except ValueError as error:
+                print(error)
+                self.gcode = None
         # Check if the entered path exists and ends with '.gcode' to ensure it's a valid G-code file
-        if os.path.exists(file_path) and file_path.endswith('.gcode'):
-            # Open the file in read mode and load all lines into the gcode attribute
-            with open(file_path, 'r') as file:
-                self.gcode = file.readlines()
+        elif os.path.exists(file_path) and file_path.endswith('.gcode'):
+            # Memory-map the file; stages read it in batches instead of loading all lines
+            self.gcode = GcodeSource.from_file(file_path)
+            self.toolpath = None
+            self.metadata = None
             print("G-code file successfully read.")  # Confirm successful file reading
         else:
             # If file path is invalid, notify the user and set gcode to None
@@ -34,76 +2367,96 @@ class GcodeProcessor:
             self.gcode = None
 
 
+    # Context for one stage: measured when a profiler is attached, a no-op otherwise
+    def _stage(self, name):
+        return self.profiler.stage(name) if self.profiler is not None else _DISABLED_STAGE
+
+    # The loaded G-code as a GcodeSource (older callers may still assign a list of lines or a string)
+    def _source(self):
+        if not isinstance(self.gcode, GcodeSource):
+            self.gcode = GcodeSource.from_text(self.gcode)
+        return self.gcode
+
+    # Collect every summary field in one pass and cache the result on the processor
+    # Fields come from the header and trailer blocks only, so the body is never parsed here; the X/Y extent is
+    # only filled in when the slicer wrote bounds or the toolpath was already parsed (see scan_extent)
+    def scan_metadata(self, head_bytes=METADATA_HEAD_BYTES, tail_bytes=METADATA_TAIL_BYTES, refresh=False):
+        if self.metadata is not None and not refresh:
+            return self.metadata
+        with self._stage("scan_metadata") as stage:
+            self.metadata = self._collect_metadata(head_bytes, tail_bytes)
+            stage.count(fields=sum(value is not None for value in asdict(self.metadata).values()))
+        return self.metadata
+
+    # Summary fields with the X/Y extent filled in, parsing the toolpath only when the slicer wrote no bounds
+    def scan_extent(self):
+        metadata = self.scan_metadata()
+        if metadata.x_min is None or metadata.y_min is None:
+            if self.toolpath is None:
+                # Parsing restores or computes the metadata too when a cache is attached
+                self.parse_toolpath()
+            metadata = self.scan_metadata()
+            self._fill_extent(metadata)
+        return metadata
+
+    def _collect_metadata(self, head_bytes=METADATA_HEAD_BYTES, tail_bytes=METADATA_TAIL_BYTES):
+        metadata = scan_source_metadata(self._source(), head_bytes, tail_bytes)
+        if self.toolpath is not None:
+            self._fill_extent(metadata)
+        return metadata
+
+    # Extent of the extruding moves, unless the slicer's bounds are already there
+    def _fill_extent(self, metadata):
+        if metadata.x_min is not None and metadata.y_min is not None:
+            return
+        extruding = self.toolpath[self.toolpath['move'] == MOVE_EXTRUDE]
+        if len(extruding):
+            metadata.x_min = float(extruding['x'].min())
+            metadata.x_max = float(extruding['x'].max())
+            metadata.y_min = float(extruding['y'].min())
+            metadata.y_max = float(extruding['y'].max())
+
     # String Search functions
-    # Search for the number of layers        
-    # Define a method to calculate the maximum height of the layers from G-code
+    # Each one reports a field of the cached scan_metadata result
+    # Define a method to report the maximum height of the layers from G-code
     def sum_layer_heights(self):
-        # Initialize maximum height to zero
-        max_height = 0.0
-
-        # Iterate through each line in the G-code
-        for line in self.gcode:
-            # Check if the line contains "max_z_height:" indicating the max height information
-            if "max_z_height:" in line:
-                try:
-                    # Extract the max height value after the colon, strip any extra spaces, and convert to float
-                    max_height = float(line.split(":")[1].strip())
-                    print(f"\nMaximum Z Height: {max_height} mm")  # Output the max height found
-                    return max_height  # Return the max height once found
-                except (IndexError, ValueError):
-                    # Skip this line if there’s an error in splitting or converting to float
-                    continue
+        max_height = self.scan_metadata().max_z_height
+        if max_height is not None:
+            print(f"\nMaximum Z Height: {max_height} mm")  # Output the max height found
+            return max_height
 
         # If no max height information is found, print a message and return the default max_height (0.0)
         print("\nMaximum Z height information not found.")
-        return max_height
-    # Rest of String Search Functions follow similar format, important pieces commented
+        return 0.0
+    # Rest of String Search Functions follow similar format
    
     # Search for the length of filmaent used
+    # Without a slicer comment, the filament fed by the moves is reported instead (see analyze_toolpath)
     def sum_filament_length(self):
-        total_filament_length = 0.0
-        for line in self.gcode:
-            if "total filament length [mm] :" in line:
-                try:
-                    total_filament_length = float(line.split(":")[1].strip())
-                    print(f"\nTotal Filament Length: {total_filament_length} mm")
-                    return total_filament_length
-                except (IndexError, ValueError):
-                    continue
-        print("\nTotal filament length information not found.")
+        total_filament_length = self.scan_metadata().filament_length
+        if total_filament_length is not None:
+            print(f"\nTotal Filament Length: {total_filament_length} mm")
+            return total_filament_length
+        total_filament_length = round(self.analyze_toolpath().filament_length, 2)
+        print(f"\nTotal Filament Length (from the moves): {total_filament_length} mm")
         return total_filament_length
    
     # Search for the weight of filament used
     def sum_filament_weight(self):
-        total_filament_weight = 0.0
-        for line in self.gcode:
-            if "total filament weight [g] :" in line:
-                try:
-                    total_filament_weight = float(line.split(":")[1].strip())
-                    print(f"\nTotal Filament Weight: {total_filament_weight} g")
-                    return total_filament_weight
-                except (IndexError, ValueError):
-                    continue
+        total_filament_weight = self.scan_metadata().filament_weight
+        if total_filament_weight is not None:
+            print(f"\nTotal Filament Weight: {total_filament_weight} g")
+            return total_filament_weight
         print("\nTotal filament weight information not found.")
-        return total_filament_weight
+        return 0.0
    
     # Find the x width of the object
     def find_x_min_max_difference(self):
-        x_min, x_max = float('inf'), float('-inf')
-        for line in self.gcode:
-            if line.startswith("G1") and " E" in line:
-                parts = line.split()
-                x_value = None
-                for part in parts:
-                    if part.startswith("X"):
-                        try:
-                            x_value = float(part[1:])  # Convert the X value to a float
-                        except ValueError:
-                            continue
-           
-                if x_value is not None:
-                    x_min = min(x_min, x_value)
-                    x_max = max(x_max, x_value)
+        metadata = self.scan_extent()
+        if metadata.x_min is None:
+            x_min, x_max = float('inf'), float('-inf')
+        else:
+            x_min, x_max = metadata.x_min, metadata.x_max
 
         x_difference = x_max - x_min if x_max != float('-inf') else 0
         print(f"\nMinimum X: {round(x_min, 2)}, Maximum X: {round(x_max, 2)}, X Difference: {round(x_difference, 2)}")
@@ -111,21 +2464,11 @@ class GcodeProcessor:
    
     # Find the y width of the object
     def find_y_min_max_difference(self):
-        y_min, y_max = float('inf'), float('-inf')
-        for line in self.gcode:
-            if line.startswith("G1") and " E" in line:
-                parts = line.split()
-                y_value = None
-                for part in parts:
-                    if part.startswith("Y"):
-                        try:
-                            y_value = float(part[1:])  # Convert the Y value to a float
-                        except ValueError:
-                            continue
-           
-                if y_value is not None:
-                    y_min = min(y_min, y_value)
-                    y_max = max(y_max, y_value)
+        metadata = self.scan_extent()
+        if metadata.y_min is None:
+            y_min, y_max = float('inf'), float('-inf')
+        else:
+            y_min, y_max = metadata.y_min, metadata.y_max
 
         y_difference = y_max - y_min if y_max != float('-inf') else 0
         print(f"\nMinimum Y: {round(y_min, 2)}, Maximum Y: {round(y_max, 2)}, Y Difference: {round(y_difference, 2)}")
@@ -133,58 +2476,41 @@ class GcodeProcessor:
    
     # Find the nozzle temperature
     def find_nozzle_temperature(self):
-        nozzle_temp = None
-        for line in self.gcode:
-            if "; nozzle_temperature =" in line:
-                try:
-                    nozzle_temp = float(line.split("nozzle_temperature =")[1].strip())
-                    print(f"\nNozzle Temperature: {nozzle_temp} \u00B0C")
-                    return nozzle_temp
-                except (IndexError, ValueError):
-                    continue  # Skip lines with incorrect formatting
-        if nozzle_temp is None:
+        nozzle_temp = self.scan_metadata().nozzle_temperature
+        if nozzle_temp is not None:
+            print(f"\nNozzle Temperature: {nozzle_temp} \u00B0C")
+        else:
             print("\nNo nozzle temperature information found.")
         return nozzle_temp
    
     # Find the bed temperature
     def find_bed_temperature(self):
-        bed_temp = None
-        for line in self.gcode:
-            if line.startswith("M190 S"):
-                try:
-                    bed_temp = float(line.split("S")[1].split(";")[0].strip())
-                    print(f"\nBed Temperature: {bed_temp} \u00B0C")
-                    return bed_temp
-                except (IndexError, ValueError):
-                    continue  # Skip lines with incorrect formatting
-        if bed_temp is None:
+        bed_temp = self.scan_metadata().bed_temperature
+        if bed_temp is not None:
+            print(f"\nBed Temperature: {bed_temp} \u00B0C")
+        else:
             print("\nNo bed temperature information found.")
         return bed_temp
    
     # Find the model name
     def find_model_name(self):
-        if len(self.gcode) > 1:
-            model_line = self.gcode[1]
-            if "BambuStudio" in model_line:
-                model_name = model_line.strip("; ").strip()  # Remove leading '; ' and extra whitespace
-                print(f"\nModel Name: {model_name}")
-                return model_name
+        model_name = self.scan_metadata().model_name
+        if model_name is not None:
+            print(f"\nModel Name: {model_name}")
+            return model_name
         print("\nModel name information not found.")
         return None
    
     # Find the print time
+    # Without a slicer comment, the time is estimated from the moves instead (see analyze_toolpath)
     def find_print_time(self):
-        print_time = None
-        for line in self.gcode:
-            if "total estimated time:" in line:
-                try:
-                    print_time = line.split(":")[1].strip()  # Capture the part after 'total estimated time:'
-                    print(f"\nEstimated Print Time: {print_time}")
-                    return print_time
-                except (IndexError, ValueError):
-                    continue
-        print("\nEstimated print time information not found.")
-        return None
+        print_time = self.scan_metadata().print_time
+        if print_time is not None:
+            print(f"\nEstimated Print Time: {print_time}")
+            return print_time
+        print_time = format_duration(self.analyze_toolpath().print_time)
+        print(f"\nEstimated Print Time (from the moves): {print_time}")
+        return print_time
    
     # Using the width and hieght functions find the center in the platform
     def find_build_center(self):
@@ -200,16 +2526,19 @@ class GcodeProcessor:
     # For copy and paste straight into the terminal
     def input_from_stdin(self):
         print("Paste your G-code below. Press Enter twice when you're done.")
-        gcode = ""
+        # Collect the lines and join them once at the end
+        lines = []
         while True:
             try:
                 line = input()
                 if line == "":
                     break
-                gcode += line + "\n"
+                lines.append(line)
             except EOFError:
                 break
-        self.gcode = gcode.splitlines()
+        self.gcode = GcodeSource.from_text(lines)
+        self.toolpath = None
+        self.metadata = None
         print("G-code successfully received.")
 
     # Giving the user options for how to upload the G-Code File
@@ -217,7 +2546,7 @@ class GcodeProcessor:
     # Option 2: Copy & Paste G-code    
     def choose_input_method(self):
         print("Choose how you would like to upload your G-code:")
-        print("1. Enter file path to a .gcode file")
+        print(f"1. Enter file path to a .gcode file (or a {TOOLPATH_SUFFIX} toolpath file)")
         print("2. Copy-paste raw G-code into the terminal")
         method = input("Enter 1 or 2: ")
        
@@ -229,131 +2558,327 @@ class GcodeProcessor:
             print("Invalid option. Please choose 1 or 2.")
             self.choose_input_method()
 
+    # Stream the loaded G-code through the columnar parser (see parse_toolpath_chunk)
+    # Yields one toolpath array per line-aligned batch, with the modal state carried from one batch to the next
+    def iter_toolpath(self, chunk_bytes=PARSE_CHUNK_BYTES, arc_tolerance=ARC_TOLERANCE):
+        state = ModalState()
+        for chunk, line_offset in self._source().batches(chunk_bytes):
+            toolpath, state = parse_toolpath_chunk(chunk, state, line_offset, arc_tolerance)
+            yield toolpath
+
+    # Parse every move into a single columnar toolpath array and keep it on the processor
+    # With a cache attached, a cached toolpath and metadata are reused, and fresh results are stored
+    # With workers > 1, a G-code file is parsed in that many processes (see parse_toolpath_parallel), but never
+    # in more than there are CPUs: extra processes only add start-up and hand-off time
+    # arc_tolerance is the largest distance in mm between a G2/G3 arc and the chords it is split into
+    def parse_toolpath(self, chunk_bytes=PARSE_CHUNK_BYTES, workers=None, arc_tolerance=ARC_TOLERANCE):
+        with self._stage("parse_toolpath") as stage:
+            source = self._source()
+            stage.count(bytes=source.size)
+            key = self.cache_key = None
+            if self.cache is not None:
+                with self._stage("cache_load") as lookup:
+                    key = self.cache.key(source)
+                    if arc_tolerance != ARC_TOLERANCE:
+                        key += f"-arc{arc_tolerance:g}"
+                    cached = self.cache.load(key)
+                    lookup.count(hits=int(cached is not None))
+                self.cache_key = key
+                if cached is not None:
+                    self.toolpath, self.metadata = cached
+                    stage.count(moves=len(self.toolpath))
+                    return self.toolpath
+
+            workers = min(workers or 1, os.cpu_count() or 1)
+            if workers > 1 and source.path is not None:
+                self.toolpath = parse_toolpath_parallel(source.path, workers, chunk_bytes, arc_tolerance)
+            else:
+                batches = list(self.iter_toolpath(chunk_bytes, arc_tolerance))
+                self.toolpath = np.concatenate(batches) if batches else np.empty(0, dtype=TOOLPATH_DTYPE)
+            stage.count(moves=len(self.toolpath))
+            if source.line_count is not None:
+                stage.count(lines=source.line_count)
+
+            if key is not None:
+                self.metadata = self._collect_metadata()
+                with self._stage("cache_store"):
+                    self.cache.store(key, self.toolpath, self.metadata)
+        return self.toolpath
+
+    # Spatial index over the segments of the given moves, for bounding box, Z-slice, region and nearest-segment
+    # queries (see SegmentIndex). It is built once per toolpath; with a cache attached it is saved next to the
+    # cached toolpath and loaded from there on later runs.
+    def spatial_index(self, moves=(MOVE_EXTRUDE,), cell_size=None):
+        toolpath = self.toolpath if self.toolpath is not None else self.parse_toolpath()
+        index = self.segment_index
+        if index is not None and index.toolpath is toolpath and index.matches(moves, cell_size):
+            return index
+        with self._stage("spatial_index") as stage:
+            index = None
+            if self.cache_key is not None:
+                index = self.cache.load_index(self.cache_key, toolpath)
+                if index is not None and not index.matches(moves, cell_size):
+                    index = None
+                stage.count(hits=int(index is not None))
+            if index is None:
+                index = SegmentIndex(toolpath, moves, cell_size)
+                if self.cache_key is not None:
+                    self.cache.store_index(self.cache_key, index)
+            stage.count(segments=len(index))
+        self.segment_index = index
+        return index
+
+    # Analytics of the toolpath (see analyze_toolpath), kept until the toolpath or the machine model changes
+    def analyze_toolpath(self, acceleration=PRINT_ACCELERATION, junction_deviation=JUNCTION_DEVIATION,
+                         filament_diameter=FILAMENT_DIAMETER):
+        toolpath = self.toolpath if self.toolpath is not None else self.parse_toolpath()
+        settings = (acceleration, junction_deviation, filament_diameter)
+        if self._analyzed is None or self._analyzed[0] is not toolpath or self._analyzed[1] != settings:
+            with self._stage("analyze_toolpath") as stage:
+                self.analytics = analyze_toolpath(toolpath, *settings)
+                stage.count(segments=len(self.analytics.time), layers=len(self.analytics.layer_z))
+            self._analyzed = (toolpath, settings)
+        return self.analytics
+
+    # Save the toolpath and its metadata as a toolpath file (see save_toolpath), parsing first if needed
+    def save_toolpath(self, path):
+        metadata = self.scan_extent()
+        if self.toolpath is None:
+            self.parse_toolpath()
+        with self._stage("save_toolpath") as stage:
+            size = save_toolpath(path, self.toolpath, metadata)
+            stage.count(moves=len(self.toolpath), bytes=size)
+        return size
+
+    # Use a toolpath file (see load_toolpath) as the toolpath, with the metadata saved in it; nothing is parsed
+    # and the columns are views of the mapped file
+    def load_toolpath(self, path):
+        with self._stage("load_toolpath") as stage:
+            self.gcode = ""
+            self.toolpath = load_toolpath(path)
+            self.metadata = self.toolpath.metadata
+            self.cache_key = None
+            stage.count(moves=len(self.toolpath), bytes=os.path.getsize(path))
+        return self.toolpath
+
+    # Follow a G-code file that may still be growing (see FollowState); the toolpath starts out empty and
+    # poll_follow adds what has been written since the previous call. With no path, the loaded file is followed.
+    def start_follow(self, path=None, arc_tolerance=ARC_TOLERANCE):
+        if path is None:
+            path = self._source().path
+            if path is None:
+                raise ValueError("Follow mode needs a G-code file; use feed_follow for streamed G-code")
+        self.follower = FollowState(path, arc_tolerance)
+        self.toolpath = self.follower.toolpath.array
+        self.cache_key = None
+        self.metadata = None
+        return self.follower
+
+    # Parse bytes appended to the followed G-code and return the moves they added
+    # G-code arriving through a pipe or socket is followed by setting processor.follower = FollowState() and
+    # feeding it the bytes as they arrive. With final=True, a last line without a line break is parsed too.
+    def feed_follow(self, data, final=False):
+        follower = self.follower
+        start = len(follower.toolpath)
+        with self._stage("follow_update") as stage:
+            data = follower.pending + bytes(data)
+            end = len(data) if final else data.rfind(b"\n") + 1
+            follower.pending = data[end:]
+            if end:
+                chunk = data[:end]
+                moves, follower.state = parse_toolpath_chunk(chunk, follower.state, follower.line_offset,
+                                                             follower.arc_tolerance)
+                follower.line_offset += chunk.count(b"\n")
+                follower.toolpath.extend(moves)
+                self.toolpath = follower.toolpath.array
+                self.metadata = None
+            stage.count(bytes=end, moves=len(follower.toolpath) - start)
+        return self.toolpath[start:]
+
+    # Read what has been appended to the followed file since the last poll and parse it (see feed_follow)
+    # A file that shrank or was replaced, as when a slicer exports it again, is followed again from the start;
+    # callers can tell because the moves returned then start at row 0 of the toolpath
+    def poll_follow(self, final=False):
+        follower = self.follower
+        try:
+            status = os.stat(follower.path)
+        except FileNotFoundError:
+            return self.toolpath[len(self.toolpath):]  # Not created yet, or being replaced right now
+        identity = (status.st_dev, status.st_ino)
+        if follower.identity is not None and (identity != follower.identity or status.st_size < follower.offset):
+            print(f"{follower.path} was replaced; following it again from the start.")
+            follower = self.start_follow(follower.path, follower.arc_tolerance)
+        follower.identity = identity
+        if status.st_size == follower.offset and not final:
+            return self.toolpath[len(self.toolpath):]
+
+        with open(follower.path, "rb") as file:
+            file.seek(follower.offset)
+            data = file.read(status.st_size - follower.offset)
+        follower.offset += len(data)
+        # Remap the file so that scan_metadata sees the header and trailer written so far
+        if isinstance(self.gcode, GcodeSource):
+            self.gcode.close()
+        self.gcode = GcodeSource.from_file(follower.path)
+        return self.feed_follow(data, final)
+
+    # Simplify the parsed toolpath before meshing (see simplify_toolpath) and report how much it shrank
+    def simplify_toolpath(self, angle_tolerance=SIMPLIFY_ANGLE_TOLERANCE,
+                          distance_tolerance=SIMPLIFY_DISTANCE_TOLERANCE, drop_travel=True):
+        toolpath = self.toolpath if self.toolpath is not None else self.parse_toolpath()
+        with self._stage("simplify_toolpath") as stage:
+            simplified = simplify_toolpath(toolpath, angle_tolerance, distance_tolerance, drop_travel)
+            stage.count(moves=len(toolpath), kept=len(simplified))
+        before = max(len(toolpath) - 1, 0)
+        if drop_travel:
+            after = int(np.count_nonzero(simplified['move'][1:] == MOVE_EXTRUDE))
+        else:
+            after = max(len(simplified) - 1, 0)
+        print(f"\nSimplified toolpath: {before} -> {after} segments, "
+              f"{before * len(_SEGMENT_FACES)} -> {after * len(_SEGMENT_FACES)} triangles")
+        return simplified
+
     # Define a method to parse extrusion paths from G-code
-    def parse_extrusion_paths(self):
-        # Initialize an empty list to store parsed paths (positions)
-        paths = []
-        # Initialize an empty list to store corresponding extrusion values
-        e_values = []
-        # Set the starting position to the origin (X=0, Y=0, Z=0)
-        current_position = [0, 0, 0]
-        # Store the last known Z and E (extruder) values to handle lines without Z or E updates
-        last_z = 0
-        last_e = 0
-
-
-        # Iterate over each line in the G-code file
-        for line in self.gcode:
-            # Check if the line is a "G1" command, which represents a linear move in G-code
-            if line.startswith("G1"):
-                # Search for X, Y, Z, and E values in the current G-code line
-                x_match = re.search(r'X([-+]?\d*\.\d+|\d+)', line)
-                y_match = re.search(r'Y([-+]?\d*\.\d+|\d+)', line)
-                z_match = re.search(r'Z([-+]?\d*\.\d+|\d+)', line)
-                e_match = re.search(r'E([-+]?\d*\.\d+|\d+)', line)
-
-                # If an X coordinate is found, update the current X position
-                if x_match:
-                    current_position[0] = float(x_match.group(1))
-                # If a Y coordinate is found, update the current Y position
-                if y_match:
-                    current_position[1] = float(y_match.group(1))
-                # If a Z coordinate is found, update the current Z position and set it as the last Z position
-                if z_match:
-                    current_position[2] = float(z_match.group(1))
-                    last_z = current_position[2]
-                else:
-                    # If no Z value is found in this line, keep the Z value from the last command
-                    current_position[2] = last_z
-
-                # If an E (extruder) value is found, update the current E value
-                if e_match:
-                    e_value = float(e_match.group(1))
-                    last_e = e_value
-                else:
-                    # If no E value is found, retain the last E value
-                    e_value = last_e
-               
-                # Append the current position as a tuple to the paths list
-                paths.append(tuple(current_position))
-                # Append the current E value to the e_values list
-                e_values.append(e_value)
+    # Compatibility shim over parse_toolpath: returns the list of (x, y, z) positions and the list of E values
+    # 'workers' is passed on to parse_toolpath when the G-code has not been parsed yet
+    def parse_extrusion_paths(self, workers=None):
+        with self._stage("parse_extrusion_paths") as stage:
+            toolpath = self.toolpath if self.toolpath is not None else self.parse_toolpath(workers=workers)
+            # One position tuple per move (arcs contribute one per chord), with axes a line does not give carried over
+            paths = list(map(tuple, np.stack((toolpath['x'], toolpath['y'], toolpath['z']), axis=1).tolist()))
+            e_values = toolpath['e'].tolist()
+            stage.count(positions=len(paths))
 
         # Return the lists of positions and extruder values
         return paths, e_values
 
 
     def generate_lines_from_paths(self, paths):
-        # Initialize an empty list to store line segments
-        lines = []
+        with self._stage("generate_lines_from_paths") as stage:
+            # Initialize an empty list to store line segments
+            lines = []
        
-        # Iterate over the list of points in 'paths' starting from the second point
-        for i in range(1, len(paths)):
-            # Define the starting point of the line segment (previous path point)
-            start = np.array(paths[i - 1])
+            # Iterate over the list of points in 'paths' starting from the second point
+            for i in range(1, len(paths)):
+                # Define the starting point of the line segment (previous path point)
+                start = np.array(paths[i - 1])
            
-            # Define the ending point of the line segment (current path point)
-            end = np.array(paths[i])
+                # Define the ending point of the line segment (current path point)
+                end = np.array(paths[i])
            
-            # Add the line segment (start, end) as a tuple to the list 'lines'
-            lines.append((start, end))
+                # Add the line segment (start, end) as a tuple to the list 'lines'
+                lines.append((start, end))
        
+            stage.count(segments=len(lines))
+
         # Return the list of line segments connecting the path points
         return lines
 
 
-    def plot_3d_paths(self, lines, e_values):
+    # Interactive 3D preview with a Z-height slider
+    # At most max_segments segments are drawn: layers below the top full_resolution_layers visible layers
+    # come from the finest level of detail that fits (pass max_segments=None to always draw everything)
+    # With follow_interval set, the file being followed (see start_follow) is polled every follow_interval
+    # seconds and new moves are added to the layer index and the view; the slider stays on the top layer
+    # if it was there
+    # channels maps CHANNEL_LABELS names to one value per segment (see analyze_toolpath); with more than one,
+    # buttons next to the plot pick the one the segments are coloured by. Without channels, segments are
+    # coloured by E. In follow mode only the channels of segment_channels can be updated as moves arrive.
+    # 'lines' may also be a toolpath array or ColumnarToolpath, whose consecutive moves are joined; e_values
+    # then defaults to its E column
+    def plot_3d_paths(self, lines, e_values=None, max_segments=PREVIEW_MAX_SEGMENTS, full_resolution_layers=1,
+                      follow_interval=None, channels=None):
+        if _is_toolpath(lines):
+            e_values = lines['e'] if e_values is None else e_values
+            lines = _toolpath_segments(lines)
+        segments = _segment_array(lines)
+        if not len(segments) and not follow_interval:
+            print("\nNo paths to plot.")
+            return
+        if channels is None:
+            channels = {"e": _segment_e_values(e_values, len(segments))}
+        names = list(channels)
+        # Sort the segments into layers once, and build coarser copies when there are too many to draw
+        # Every channel is a column of the index's values, so switching channels keeps the layers and levels
+        values = np.stack([np.asarray(channels[name], dtype=np.float32)[:len(segments)] for name in names], axis=1)
+        index = LayerIndex(segments, values)
+        levels = index.pyramid(max_segments) if max_segments else [index]
+
         fig = plt.figure()
         ax = fig.add_subplot(111, projection='3d')
 
-        # Set up color map for extrusion paths
-        norm = plt.Normalize(vmin=min(e_values), vmax=max(e_values))
+        # Set up color map for extrusion paths; the collection maps the values of the drawn segments to colours
+        # ranges holds the lowest and highest value of every channel; the norm follows the chosen one
+        # With nothing to draw yet (follow mode on an empty file) every channel starts out as 0 to 1
+        if len(values):
+            ranges = np.stack((values.min(axis=0), values.max(axis=0)))
+        else:
+            ranges = np.array([[0.0], [1.0]]).repeat(len(names), axis=1)
+        channel = [0]
+        norm = plt.Normalize(vmin=float(ranges[0, 0]), vmax=float(ranges[1, 0]))
         cmap = plt.get_cmap("coolwarm")
 
-        max_z = max([p[2] for line in lines for p in line])
-       
+        max_z = float(index.layer_z[-1]) if len(index) else 0.0
+
+        # A single collection draws every visible segment; update_plot fills it in
+        # (a followed file may have no moves yet, so the collection starts with one zero-length segment)
+        collection = Line3DCollection(np.zeros((1, 2, 3)), cmap=cmap, norm=norm)
+        collection.set_array(np.zeros(1))
+        ax.add_collection3d(collection)
+        colorbar = fig.colorbar(collection, ax=ax, shrink=0.6, pad=0.1)
+        colorbar.set_label(CHANNEL_LABELS.get(names[0], names[0]))
+
+        # Set the labels for each axis of the 3D plot
+        ax.set_xlabel('X')
+        ax.set_ylabel('Y')
+        ax.set_zlabel('Z')
+
+        # Center the plot on the paths with the same range on every axis, computed once for all slider positions
+        bounds = []
+
+        def set_limits(points):
+            if not len(points):
+                return
+            low, high = points.min(axis=0), points.max(axis=0)
+            if bounds:
+                low, high = np.minimum(low, bounds[0]), np.maximum(high, bounds[1])
+            bounds[:] = [low, high]
+            max_range = (high - low).max() / 2.0
+            mid_x, mid_y, mid_z = (low + high) * 0.5
+            ax.set_xlim3d([mid_x - max_range, mid_x + max_range])  # Set X-axis limits
+            ax.set_ylim3d([mid_y - max_range, mid_y + max_range])  # Set Y-axis limits
+            ax.set_zlim3d([mid_z - max_range, mid_z + max_range])  # Set Z-axis limits
+
+        set_limits(segments.reshape(-1, 3))
+
         # Create a slider for controlling the Z value
         ax_slider = plt.axes([0.25, 0.02, 0.65, 0.03], facecolor='lightgoldenrodyellow')
-        slider = Slider(ax_slider, 'Z-Height', 0, max_z, valinit=max_z)
+        slider = Slider(ax_slider, 'Z-Height', 0, max(max_z, 1.0) if follow_interval else max_z, valinit=max_z)
+        shown = [None]
 
         # Define the update function to handle slider changes
         def update_plot(val):
-            ax.cla()  # Clear the current plot
-
-            # Get the Z value from the slider
-            z_value = slider.val
-
-            # Plot paths that are "below" or equal to the current slider's Z value
-            for i, (start, end) in enumerate(lines):
-                # We want to show paths up until the selected Z value
-                if max(start[2], end[2]) <= z_value:  # Show paths where max Z is below the slider value
-                    e_value = (e_values[i] + e_values[i + 1]) / 2 if i + 1 < len(e_values) else e_values[i]
-                    color = cmap(norm(e_value))
-                    ax.plot([start[0], end[0]], [start[1], end[1]], [start[2], end[2]], color=color)
-
-            # Set the labels for each axis of the 3D plot
-            ax.set_xlabel('X')
-            ax.set_ylabel('Y')
-            ax.set_zlabel('Z')
-
-            # Calculate the maximum range of points in the 3D plot for uniform scaling
-            # 1. Compute the point-to-point range (ptp) for each axis
-            # 2. Create a list comprehension to find the maximum values across each dimension (X, Y, Z)
-            # 3. Divide by 2.0 to get half of the range, used for setting plot limits
-            max_range = np.ptp([max([p[i] for start, end in lines for p in (start, end)]) for i in range(3)]) / 2.0
-           
-            # Compute the midpoint of each axis range to center the plot
-            mid_x = (ax.get_xlim3d()[0] + ax.get_xlim3d()[1]) * 0.5  # X-axis midpoint
-            mid_y = (ax.get_ylim3d()[0] + ax.get_ylim3d()[1]) * 0.5  # Y-axis midpoint
-            mid_z = (ax.get_zlim3d()[0] + ax.get_zlim3d()[1]) * 0.5  # Z-axis midpoint
-           
-            # Set new limits on each axis, centering the plot at midpoints and using the maximum range
-            ax.set_xlim3d([mid_x - max_range, mid_x + max_range])  # Set X-axis limits
-            ax.set_ylim3d([mid_y - max_range, mid_y + max_range])  # Set Y-axis limits
-            ax.set_zlim3d([mid_z - max_range, mid_z + max_range])  # Set Z-axis limits
+            # Show the layers at or below the slider's Z value: a prefix of the sorted segments of any level
+            layers = index.layers_below(slider.val)
+            if layers == shown[0]:
+                return  # No layer was shown or hidden
+            shown[0] = layers
 
-            # Redraw the figure to update the plot with the new limits and labels
-            plt.draw()
+            if index.offsets[layers] <= (max_segments or len(index)):
+                # Everything visible fits: prefix views of the full-resolution arrays, nothing is copied
+                collection.set_segments(index.segments[:index.offsets[layers]])
+                collection.set_array(index.values[:index.offsets[layers], channel[0]])
+            else:
+                # The top layers at full resolution, the ones below from the finest level that fits
+                split = max(layers - full_resolution_layers, 0)
+                top = slice(index.offsets[split], index.offsets[layers])
+                for level in levels:
+                    if level.offsets[split] + (top.stop - top.start) <= max_segments:
+                        break
+                below = level.offsets[split]
+                collection.set_segments(np.concatenate((level.segments[:below], index.segments[top])))
+                collection.set_array(np.concatenate((level.values[:below, channel[0]], index.values[top, channel[0]])))
+            fig.canvas.draw_idle()
 
         # Bind the slider to call the `update_plot` function whenever its value changes
         slider.on_changed(update_plot)
@@ -361,83 +2886,410 @@ class GcodeProcessor:
         # Initialize the plot by calling `update_plot` with the maximum Z value
         update_plot(max_z)
 
+        # Colour by another channel: the same segments, another column of values and another colour range
+        def choose_channel(label):
+            channel[0] = labels.index(label)
+            norm.vmin, norm.vmax = float(ranges[0, channel[0]]), float(ranges[1, channel[0]])
+            colorbar.set_label(label)
+            shown[0] = None
+            update_plot(slider.val)
+
+        labels = [CHANNEL_LABELS.get(name, name) for name in names]
+        if len(names) > 1:
+            fig.subplots_adjust(left=0.25)
+            ax_channels = plt.axes([0.01, 0.35, 0.22, 0.04 * len(names)])
+            channel_buttons = RadioButtons(ax_channels, labels)
+            channel_buttons.on_clicked(choose_channel)
+
+        # Follow mode: add the moves written since the last poll to every level of the index
+        def follow_update():
+            moves = self.poll_follow()
+            if not len(moves):
+                return
+            first = len(self.toolpath) - len(moves)
+            if first == 0 and len(index):
+                # The file was replaced: start over with an empty index
+                index.replace_tail(0, LayerIndex(np.empty((0, 2, 3)), np.empty((0, len(names)), dtype=np.float32)))
+                del levels[1:]
+                bounds.clear()
+            rows = self.toolpath[max(first - 1, 0):]
+            added = _toolpath_segments(rows)
+            if not len(added):
+                return
+            computed = segment_channels(rows)
+            values = np.stack([computed[name].astype(np.float32) for name in names], axis=1)
+            if max_segments:
+                extend_pyramid(levels, added, values, max_segments)
+            else:
+                index.extend(added, values)
+            if len(index) > len(added):
+                ranges[0] = np.minimum(ranges[0], values.min(axis=0))
+                ranges[1] = np.maximum(ranges[1], values.max(axis=0))
+            else:
+                ranges[:] = values.min(axis=0), values.max(axis=0)
+            norm.vmin, norm.vmax = float(ranges[0, channel[0]]), float(ranges[1, channel[0]])
+            set_limits(added.reshape(-1, 3))
+
+            # Keep following the top layer when the slider was on it
+            following = slider.val >= slider.valmax
+            slider.valmax = max(float(index.layer_z[-1]), 1.0)
+            ax_slider.set_xlim(slider.valmin, slider.valmax)
+            shown[0] = None  # Visible layers may have gained segments
+            if following:
+                slider.set_val(slider.valmax)
+            else:
+                update_plot(slider.val)
+
+        if follow_interval:
+            timer = fig.canvas.new_timer(interval=int(follow_interval * 1000))
+            timer.add_callback(follow_update)
+            timer.start()
+
         # Display the plot with the adjusted settings
         plt.show()
 
 
     # Count the number of layers in the G-code file
     def count_layers(self):
-        # Initialize layer count to zero
-        layer_count = 0
-        # Iterate through each line in the G-code
-        for line in self.gcode:
-            # Check if the line contains the phrase "total layer number:"
-            if "total layer number:" in line:
-                try:
-                    # Split the line at ":" and get the part after it, then convert to integer
-                    layer_count = int(line.split(":")[1].strip())
-                    # Print the total layer count found in the G-code
-                    print(f"\nTotal Layer Count: {layer_count}")
-                    # Return the found layer count
-                    return layer_count
-                except (IndexError, ValueError):
-                    # If there's an error in accessing or converting the layer count, skip to the next line
-                    continue
-        # If no layer count information is found, print a message
-        print("\nLayer count information not found.")
-        # Return 0 if the layer count was not found in the G-code
+        layer_count = self.scan_metadata().layer_count
+        if layer_count is not None:
+            # Print the total layer count found in the G-code
+            print(f"\nTotal Layer Count: {layer_count}")
+            return layer_count
+        # Without a slicer comment, count the heights the moves extrude at
+        layer_count = len(self.analyze_toolpath().layer_z)
+        print(f"\nTotal Layer Count (from the moves): {layer_count}")
         return layer_count
 
 
-    def export_to_stl(self, paths):
-        # Extrude the paths with a small width to create a solid object
-        vertices = []
-        faces = []
-       
-        extrusion_width = 0.2  # Width/thickness of each path segment
-        extrusion_height = 0.2  # Height of each layer
-       
-        for i in range(1, len(paths)):
-            start = np.array(paths[i - 1])
-            end = np.array(paths[i])
-
-            # Create a rectangular cross-section for each path segment
-            offset = np.array([extrusion_width, 0, 0])
-            top_start = start + offset + [0, 0, extrusion_height]
-            top_end = end + offset + [0, 0, extrusion_height]
-            bottom_start = start - offset
-            bottom_end = end - offset
-
-            # Define the 8 vertices of a cuboid segment
-            vertices.extend([bottom_start, bottom_end, top_end, top_start])
-
-            # Index of the first vertex of this cuboid
-            base_idx = len(vertices) - 4
-           
-            # Define faces for the cuboid
-            faces.append([base_idx, base_idx + 1, base_idx + 2])  # Bottom face triangle 1
-            faces.append([base_idx, base_idx + 2, base_idx + 3])  # Bottom face triangle 2
-            faces.append([base_idx, base_idx + 3, base_idx + 2])  # Side face triangle 1
-            faces.append([base_idx, base_idx + 2, base_idx + 1])  # Side face triangle 2
-            faces.append([base_idx, base_idx + 1, base_idx + 2])  # Top face triangle 1
-            faces.append([base_idx, base_idx + 2, base_idx + 3])  # Top face triangle 2
-
-        # Convert lists to numpy arrays
-        vertices = np.array(vertices)
-        faces = np.array(faces)
-
-        # Create the mesh
-        model = mesh.Mesh(np.zeros(len(faces), dtype=mesh.Mesh.dtype))
-        for i, face in enumerate(faces):
-            for j in range(3):
-                model.vectors[i][j] = vertices[face[j], :]
-
-        # Save the STL file
-        model.save('output_model.stl')
-        print("STL file has been saved as output_model.stl")
-
-def main():
-    processor = GcodeProcessor()
+    # Mesh the toolpath and write it as a binary STL file
+    # 'paths' may be a toolpath array, a ColumnarToolpath, a list of (x, y, z) tuples, or an iterable of toolpath
+    # batches such as iter_toolpath(), in which case the toolpath is meshed while it is being parsed
+    # With travel_moves=False only segments that end in an extruding move are meshed (toolpath arrays only)
+    # Returns the number of triangles written
+    def export_to_stl(self, paths, output_path='output_model.stl', extrusion_width=0.2, extrusion_height=0.2,
+                      travel_moves=True):
+        with self._stage("export_to_stl") as stage:
+            if isinstance(paths, ColumnarToolpath):
+                paths = paths.batches()  # Views of a mapped file are meshed a slice at a time
+            elif isinstance(paths, (list, np.ndarray)):
+                paths = [paths]
+
+            # Preallocated record buffer, reused for every chunk
+            records = np.zeros(STL_CHUNK_SEGMENTS * len(_SEGMENT_FACES), dtype=STL_RECORD_DTYPE)
+            triangle_count = 0
+            previous = None  # Last point of the previous batch, where the next batch's first segment starts
+            with open(output_path, 'wb') as file:
+                file.write(_STL_HEADER)
+                file.write(np.uint32(0).tobytes())  # Triangle count, filled in once everything is written
+
+                for batch in paths:
+                    points = _path_points(batch)
+                    if not len(points):
+                        continue
+                    # One segment ends at every point, except the very first point of the path
+                    if previous is None:
+                        starts, ends = points[:-1], points[1:]
+                    else:
+                        starts, ends = np.concatenate((previous, points[:-1])), points
+                    previous = points[-1:]
+                    if not travel_moves and _is_toolpath(batch):
+                        extruding = batch['move'][len(batch) - len(ends):] == MOVE_EXTRUDE
+                        starts, ends = starts[extruding], ends[extruding]
+
+                    for first in range(0, len(ends), STL_CHUNK_SEGMENTS):
+                        last = min(first + STL_CHUNK_SEGMENTS, len(ends))
+                        count = _fill_segment_records(records, starts[first:last], ends[first:last],
+                                                      extrusion_width, extrusion_height)
+                        records[:count].tofile(file)
+                        triangle_count += count
+
+                file.seek(len(_STL_HEADER))
+                file.write(np.uint32(triangle_count).tobytes())
+            stage.count(triangles=triangle_count,
+                        bytes=len(_STL_HEADER) + 4 + triangle_count * STL_RECORD_DTYPE.itemsize)
+
+        print(f"STL file has been saved as {output_path}")
+        return triangle_count
+
+    # Mesh the toolpath as one closed surface (see voxel_surface) and write it as a binary STL file
+    # Smaller voxel_size follows the beads more closely at the cost of time and triangles; voxel_tolerance is how
+    # far, in voxels, merging triangles may move the surface (0 keeps every marching cubes triangle)
+    # Returns the number of triangles written
+    def export_watertight_stl(self, paths, output_path='output_model.stl', voxel_size=VOXEL_SIZE,
+                              extrusion_width=0.45, extrusion_height=None, voxel_tolerance=VOXEL_TOLERANCE):
+        with self._stage("export_watertight_stl") as stage:
+            triangle_count = 0
+            with open(output_path, 'wb') as file:
+                file.write(_STL_HEADER)
+                file.write(np.uint32(0).tobytes())  # Triangle count, filled in once everything is written
+                for triangles in voxel_surface(paths, voxel_size, extrusion_width, extrusion_height,
+                                               voxel_tolerance=voxel_tolerance):
+                    records = np.empty(len(triangles), dtype=STL_RECORD_DTYPE)
+                    records['vectors'] = triangles
+                    _fill_normals(records, len(records))
+                    records.tofile(file)
+                    triangle_count += len(records)
+                file.seek(len(_STL_HEADER))
+                file.write(np.uint32(triangle_count).tobytes())
+            stage.count(triangles=triangle_count,
+                        bytes=len(_STL_HEADER) + 4 + triangle_count * STL_RECORD_DTYPE.itemsize)
+
+        print(f"Watertight STL file has been saved as {output_path}")
+        return triangle_count
+
+# Batch conversion
+# Headless entry point for pipelines: every input file goes through metadata scan and STL export in a pool
+# of worker processes, and each file gets an STL and a JSON summary in the output directory.
+
+# Convert one G-code file; runs in a worker process and returns the file's summary
+# With profile=True the summary also holds the file's ProfileReport (see Profiler)
+# With watertight=True the STL is one closed surface (see voxel_surface) and extrusion_width is the bead width
+# A toolpath file (see save_toolpath) is converted without parsing; with toolpath_path set, the parsed toolpath
+# is saved there as one
+# 'workers' is the number of processes the file itself is parsed with (see GcodeProcessor.parse_toolpath)
+def convert_file(path, stl_path, summary_path, extrusion_width=0.2, extrusion_height=0.2,
+                 simplify=False, cache_dir=None, profile=False, profile_stage=None,
+                 watertight=False, voxel_size=VOXEL_SIZE, toolpath_path=None, workers=None,
+                 voxel_tolerance=VOXEL_TOLERANCE):
+    started = time.perf_counter()
+    summary = {"input": path, "stl": stl_path}
+    profiler = Profiler(profile_stage=profile_stage) if profile else None
+    try:
+        summary["bytes"] = os.path.getsize(path)
+        processor = GcodeProcessor(cache=ToolpathCache(cache_dir) if cache_dir else None, profiler=profiler)
+        if path.endswith(TOOLPATH_SUFFIX):
+            processor.load_toolpath(path)
+        else:
+            processor.gcode = GcodeSource.from_file(path)
+        # The processor's reporting methods print; keep worker output out of the batch log
+        with contextlib.redirect_stdout(io.StringIO()):
+            metadata = processor.scan_extent()
+            if processor.toolpath is None:
+                processor.parse_toolpath(workers=workers)
+            toolpath = processor.toolpath
+            if toolpath_path:
+                processor.save_toolpath(toolpath_path)
+            if watertight:
+                triangles = processor.export_watertight_stl(toolpath, stl_path, voxel_size, extrusion_width,
+                                                            extrusion_height, voxel_tolerance)
+            else:
+                if simplify:
+                    toolpath = simplify_toolpath(toolpath)
+                triangles = processor.export_to_stl(toolpath, stl_path, extrusion_width, extrusion_height,
+                                                    travel_moves=not simplify)
+        summary.update(moves=len(processor.toolpath), triangles=triangles, metadata=asdict(metadata))
+        if toolpath_path:
+            summary["toolpath"] = toolpath_path
+        if isinstance(processor.gcode, GcodeSource):
+            processor.gcode.close()
+    except Exception as error:
+        summary["error"] = f"{type(error).__name__}: {error}"
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    if profiler is not None:
+        summary["profile"] = profiler.report.to_dict()
+    with open(summary_path, "w") as file:
+        json.dump(summary, file, indent=2)
+    return summary
+
+
+# Expand files, directories (searched recursively for .gcode files) and glob patterns into a sorted file list
+def expand_inputs(inputs):
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.update(glob.glob(os.path.join(item, "**", "*.gcode"), recursive=True))
+        elif glob.has_magic(item):
+            paths.update(match for match in glob.glob(item, recursive=True) if os.path.isfile(match))
+        else:
+            paths.add(item)
+    return sorted(paths)
+
+
+# Convert many G-code files in parallel and report throughput; returns the number of failed files
+# With profile=True every file's summary holds its stage measurements, and trace_path (if given) receives one
+# Chrome trace with a row per file
+# With save_toolpaths=True each parsed toolpath is also saved next to its STL as a toolpath file
+# 'workers' is the size of the pool of files converted at once, 'parse_workers' the number of processes each
+# file is parsed with; their product should not exceed the CPU count
+def run_batch(inputs, output_dir, workers=None, extrusion_width=0.2, extrusion_height=0.2,
+              simplify=False, cache_dir=None, profile=False, profile_stage=None, trace_path=None,
+              watertight=False, voxel_size=VOXEL_SIZE, save_toolpaths=False, parse_workers=None,
+              voxel_tolerance=VOXEL_TOLERANCE):
+    paths = expand_inputs(inputs)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Output names come from the input names; repeated names get a numbered suffix
+    jobs = []
+    used = set()
+    for path in paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        name, number = stem, 1
+        while name in used:
+            number += 1
+            name = f"{stem}-{number}"
+        used.add(name)
+        stl_path = os.path.join(output_dir, name + ".stl")
+        jobs.append((path, stl_path, os.path.join(output_dir, name + ".json"),
+                     os.path.splitext(stl_path)[0] + TOOLPATH_SUFFIX if save_toolpaths else None))
+    options = dict(extrusion_width=extrusion_width, extrusion_height=extrusion_height, simplify=simplify,
+                   cache_dir=cache_dir, profile=profile, profile_stage=profile_stage, watertight=watertight,
+                   voxel_size=voxel_size, workers=parse_workers, voxel_tolerance=voxel_tolerance)
+
+    started = time.perf_counter()
+    summaries = []
+
+    def record(summary):
+        summaries.append(summary)
+        status = summary.get("error") or f"{summary['triangles']} triangles in {summary['seconds']} s"
+        print(f"{summary['input']}: {status}")
+
+    # A worker that dies (out of memory, or a crash on a bad file) breaks the whole pool, and every job that had
+    # not finished fails with it. Pools start jobs in order, so the one that crashed is among the first lost
+    # jobs: run those alone until one dies by itself, record only that one as failed, and give the rest of the
+    # lost jobs to a fresh pool. Every round finishes at least one job, so a batch always runs to the end.
+    pending = jobs
+    while pending:
+        lost = _run_pool(pending, workers, options, record)
+        pending = []
+        for position, job in enumerate(lost):
+            if _run_pool([job], 1, options, record):
+                path, _, summary_path, _ = job
+                summary = {"input": path, "error": "BrokenProcessPool: the worker process died converting this file"}
+                with open(summary_path, "w") as file:
+                    json.dump(summary, file, indent=2)
+                record(summary)
+                pending = lost[position + 1:]
+                break
+    elapsed = time.perf_counter() - started
+
+    failed = [summary for summary in summaries if "error" in summary]
+    total_bytes = sum(summary.get("bytes", 0) for summary in summaries)
+    report = {
+        "files": len(summaries),
+        "failed": len(failed),
+        "seconds": round(elapsed, 3),
+        "files_per_second": round(len(summaries) / elapsed, 2) if elapsed else None,
+        "mb_per_second": round(total_bytes / 1e6 / elapsed, 2) if elapsed else None,
+    }
+    summaries.sort(key=lambda summary: summary["input"])
+    with open(os.path.join(output_dir, "batch_summary.json"), "w") as file:
+        json.dump(dict(report, results=summaries), file, indent=2)
+    if trace_path:
+        events = []
+        for number, summary in enumerate(summaries):
+            if "profile" in summary:
+                events += chrome_trace_events(summary["profile"], number, os.path.basename(summary["input"]))
+        with open(trace_path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+    print(f"\nConverted {len(summaries) - len(failed)} of {len(summaries)} files in {elapsed:.2f} s "
+          f"({report['files_per_second']} files/s, {report['mb_per_second']} MB/s)")
+    return len(failed)
+
+
+# Convert the jobs in a fresh pool of worker processes, passing each file's summary to 'record' as it arrives
+# Returns the jobs, in order, that were lost because a worker process died and took the pool down with it
+def _run_pool(jobs, workers, options, record):
+    lost = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(convert_file, path, stl_path, summary_path, toolpath_path=toolpath_path,
+                               **options): number
+                   for number, (path, stl_path, summary_path, toolpath_path) in enumerate(jobs)}
+        for future in as_completed(futures):
+            try:
+                summary = future.result()
+            except BrokenProcessPool:
+                lost.append(futures[future])
+                continue
+            except Exception as error:
+                # The job could not be sent to or returned from its worker; record it and carry on
+                summary = {"input": jobs[futures[future]][0], "error": f"{type(error).__name__}: {error}"}
+            record(summary)
+    return [jobs[number] for number in sorted(lost)]
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert G-code to STL. With no inputs, runs the interactive converter.")
+    parser.add_argument("inputs", nargs="*",
+                        help=f"G-code (or {TOOLPATH_SUFFIX} toolpath) files, directories or glob patterns to convert "
+                             "in batch")
+    parser.add_argument("-o", "--output-dir", default="stl_output", help="where STL and JSON summaries are written")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="files converted at once in batch mode (default: CPU count)")
+    parser.add_argument("--parse-workers", type=int, default=None,
+                        help="processes each G-code file is parsed with (default 1; at most the CPU count)")
+    parser.add_argument("--extrusion-width", type=float, default=None,
+                        help="half-width of each segment's solid (default 0.2), or with --watertight the bead "
+                             "width (default 0.45)")
+    parser.add_argument("--extrusion-height", type=float, default=None,
+                        help="height of each segment's solid (default 0.2), or with --watertight the bead height "
+                             "(default: the print's layer height)")
+    parser.add_argument("--simplify", action="store_true", help="drop travel moves and merge collinear segments")
+    parser.add_argument("--watertight", action="store_true",
+                        help="export one closed surface around the extruded beads instead of a solid per segment")
+    parser.add_argument("--voxel-size", type=float, default=VOXEL_SIZE,
+                        help="grid spacing in mm for --watertight; smaller is finer but slower, and larger than "
+                             "the layer height can lose layers")
+    parser.add_argument("--voxel-tolerance", type=float, default=VOXEL_TOLERANCE,
+                        help=f"how far, in voxels, --watertight may move the surface to merge triangles (default "
+                             f"{VOXEL_TOLERANCE}; 0 keeps every triangle, which is faster but gives a larger STL)")
+    parser.add_argument("--save-toolpath", action="store_true",
+                        help=f"also save each parsed toolpath as a {TOOLPATH_SUFFIX} file, which converts again "
+                             "without parsing")
+    parser.add_argument("--cache-dir", default=None,
+                        help=f"toolpath cache directory (default: {DEFAULT_CACHE_DIR}); batch runs only use a cache "
+                             "when this is given")
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the toolpath cache")
+    parser.add_argument("--profile", metavar="REPORT.json",
+                        help="measure every stage and save the report (batch mode: into each file's summary)")
+    parser.add_argument("--trace", metavar="TRACE.json", help="save the stage measurements as a Chrome trace")
+    parser.add_argument("--profile-stage", metavar="STAGE",
+                        help="run this stage (e.g. parse_toolpath) under cProfile and keep its listing in the report")
+    parser.add_argument("--follow", metavar="FILE.gcode",
+                        help="preview a G-code file while it is being written, adding new moves as they appear")
+    parser.add_argument("--follow-interval", type=float, default=1.0, help="seconds between checks in --follow mode")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    profile = bool(args.profile or args.trace or args.profile_stage)
+    # Each export has its own defaults for the bead size
+    if args.extrusion_width is None:
+        args.extrusion_width = 0.45 if args.watertight else 0.2
+    if args.extrusion_height is None and not args.watertight:
+        args.extrusion_height = 0.2
+    if args.inputs:
+        # Batch mode: no prompts, no plot window and no cache unless --cache-dir is given; the exit status is
+        # non-zero when any file failed
+        failed = run_batch(args.inputs, args.output_dir, args.workers, args.extrusion_width, args.extrusion_height,
+                           args.simplify, None if args.no_cache else args.cache_dir,
+                           profile, args.profile_stage, args.trace, args.watertight, args.voxel_size,
+                           args.save_toolpath, args.parse_workers, args.voxel_tolerance)
+        return 1 if failed else 0
+
+    # Raw cProfile statistics go next to the report
+    profiler = None
+    if profile:
+        profiler = Profiler(profile_stage=args.profile_stage,
+                            profile_path=args.profile and os.path.splitext(args.profile)[0] + ".prof")
+
+    if args.follow:
+        # Follow mode: parse what has been written so far, then keep adding to the preview as the file grows
+        processor = GcodeProcessor(profiler=profiler)
+        processor.start_follow(args.follow)
+        processor.poll_follow()
+        toolpath = processor.toolpath
+        processor.plot_3d_paths(_toolpath_segments(toolpath), toolpath['e'], follow_interval=args.follow_interval,
+                                channels=segment_channels(toolpath))
+        _report_profile(profiler, args)
+        return
+
+    # Reopening a file that was processed before reuses its cached toolpath and metadata
+    processor = GcodeProcessor(cache=None if args.no_cache else ToolpathCache(args.cache_dir or DEFAULT_CACHE_DIR),
+                               profiler=profiler)
     processor.choose_input_method()
    
     if processor.gcode is None:
@@ -457,15 +3309,33 @@ def main():
     processor.find_print_time()
     processor.find_build_center()  
 
-    # Run the parsing
-    paths, e_values = processor.parse_extrusion_paths()
-    lines = processor.generate_lines_from_paths(paths)
+    # Run the parsing; the viewer and the exporters take the columnar toolpath (or the mapped toolpath file) as is
+    toolpath = processor.toolpath if processor.toolpath is not None else processor.parse_toolpath(
+        workers=args.parse_workers)
    
-    # Plot the extrusion paths
-    processor.plot_3d_paths(lines, e_values)
+    # Plot the extrusion paths, with speed, flow and layer time colourings computed from the moves
+    processor.plot_3d_paths(toolpath, channels=processor.analyze_toolpath().channels)
    
     # Export the paths to an STL file
-    processor.export_to_stl(paths)
+    if args.watertight:
+        processor.export_watertight_stl(toolpath, voxel_size=args.voxel_size,
+                                        extrusion_width=args.extrusion_width,
+                                        extrusion_height=args.extrusion_height,
+                                        voxel_tolerance=args.voxel_tolerance)
+    else:
+        processor.export_to_stl(toolpath, extrusion_width=args.extrusion_width, extrusion_height=args.extrusion_height)
+
+    _report_profile(profiler, args)
+
+
+# Print the stage measurements of an interactive run and save them where the command line asked
+def _report_profile(profiler, args):
+    if profiler is not None:
+        print(f"\n{profiler.report}")
+        if args.profile:
+            profiler.report.save_json(args.profile)
+        if args.trace:
+            profiler.report.save_chrome_trace(args.trace)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,584 @@
+# Benchmark suite for GCodeToSTL
+# Generates deterministic synthetic G-code in Slic3r or BambuStudio style, times every stage of the
+# converter separately, and saves the results as JSON so runs can be compared for regressions.
+#
+# Examples:
+#   python benchmark.py --lines 10000 100000 1000000 -o results.json
+#   python benchmark.py --lines 5000000 --stages ingest metadata parse_toolpath export_to_stl --no-memory
+#   python benchmark.py --gcode sphere.gcode --compare results.json
+#   python benchmark.py --lines 1000000 --stages parse_toolpath parse_toolpath_parallel -j 1 2 4 --repeat 3
+
+import os  # For file sizes and paths
+import io  # For silencing the processor's reports while a stage is timed
+import sys  # For the exit status and interpreter version
+import gc  # For collecting garbage between stages so one stage's leftovers do not skew the next
+import json  # For saving and loading results
+import math  # For the shapes of the synthetic model
+import time  # For wall-clock and CPU timing
+import platform  # For recording the machine the results came from
+import tempfile  # For the default location of generated G-code and STL files
+import argparse  # For the command-line interface
+import contextlib  # For redirecting stdout
+import tracemalloc  # For the peak memory of each stage
+from datetime import datetime, timezone  # For timestamping results
+import numpy as np  # For generating coordinates
+import GCodeToSTL as converter  # The converter under test
+
+try:
+    import resource  # For the process-wide peak RSS (not available on Windows)
+except ImportError:
+    resource = None
+
+
+# Synthetic G-code generator
+# Every layer holds one or more islands: a few perimeter loops around a lobed outline whose radius swells and
+# shrinks with height, and a zigzag infill inside them. The same arguments always produce the same bytes.
+
+# Bumped whenever the generator's output changes, so files generated by an older version are not reused
+GENERATOR_VERSION = 1
+
+LAYER_HEIGHT = 0.2
+EXTRUSION_WIDTH = 0.45
+E_PER_MM = 0.0333  # Filament length per mm of extrusion for a 0.45 x 0.2 mm bead and 1.75 mm filament
+FILAMENT_DENSITY = 1.24  # g/cm^3 (PLA)
+RETRACT_LENGTH = 0.8
+TRAVEL_FEEDRATE = 7800.0
+PERIMETER_FEEDRATE = 1800.0
+INFILL_FEEDRATE = 3600.0
+ISLAND_RADIUS = 15.0
+ISLAND_SPACING = 45.0  # Distance between island centres when a layer holds more than one
+ISLANDS_PER_ROW = 4
+PLATE_CENTER = (100.0, 100.0)
+
+# Width of the header numbers that are only known once the body is written; they are padded and filled in last
+_HEADER_NUMBER_WIDTH = 16
+
+
+# Outline radius of an island at a given height; the slow swell gives every layer a different outline
+def _island_radius(z):
+    return ISLAND_RADIUS * (0.8 + 0.2 * math.cos(z / 7.0))
+
+
+# G-code lines of one island: perimeter loops from the outside in, then the infill
+# E starts at 'e' and the new E is returned with the lines
+# With arcs=True every perimeter segment is a G3 arc, like the output of a slicer with arc fitting
+def _island_lines(center, z, layer, e, perimeters, perimeter_segments, infill_density, lobes, arcs=False):
+    cx, cy = center
+    radius = _island_radius(z)
+    lines = []
+
+    # Unretract at the start of the island
+    e += RETRACT_LENGTH
+    unretract = f"G1 E{e:.5f} F2400.00000"
+
+    # Perimeters; the seam moves a little every layer like it does in real slicer output
+    angles = np.linspace(0.0, 2.0 * math.pi, perimeter_segments + 1) + layer * 0.37
+    outline = 1.0 + 0.08 * np.sin(lobes * angles)  # Lobes give the perimeter varying curvature
+    for loop in range(perimeters):
+        loop_radius = radius - loop * EXTRUSION_WIDTH
+        x = cx + loop_radius * outline * np.cos(angles)
+        y = cy + loop_radius * outline * np.sin(angles)
+        lines.append(f"G1 X{x[0]:.3f} Y{y[0]:.3f} F{TRAVEL_FEEDRATE:.3f}")
+        if loop == 0:
+            lines.append(unretract)
+            lines.append(f"G1 F{PERIMETER_FEEDRATE:.3f}")
+        steps = np.hypot(np.diff(x), np.diff(y))
+        e_values = e + np.cumsum(steps) * E_PER_MM
+        e = float(e_values[-1])
+        if arcs:
+            # Arc centres lie on each segment's perpendicular bisector, as close to the island centre as possible
+            dx, dy = np.diff(x), np.diff(y)
+            mid_x, mid_y = (x[:-1] + x[1:]) / 2, (y[:-1] + y[1:]) / 2
+            along = ((cx - mid_x) * -dy + (cy - mid_y) * dx) / (dx * dx + dy * dy)
+            i, j = mid_x - dy * along - x[:-1], mid_y + dx * along - y[:-1]
+            lines.extend(f"G3 X{px:.3f} Y{py:.3f} I{pi:.3f} J{pj:.3f} E{pe:.5f}"
+                         for px, py, pi, pj, pe in zip(x[1:].tolist(), y[1:].tolist(), i.tolist(), j.tolist(),
+                                                       e_values.tolist()))
+        else:
+            lines.extend(f"G1 X{px:.3f} Y{py:.3f} E{pe:.5f}"
+                         for px, py, pe in zip(x[1:].tolist(), y[1:].tolist(), e_values.tolist()))
+
+    # Zigzag infill inside the innermost perimeter, rotated by 90 degrees every layer
+    inner = radius * 0.92 - perimeters * EXTRUSION_WIDTH
+    if infill_density > 0 and inner > EXTRUSION_WIDTH:
+        spacing = EXTRUSION_WIDTH / infill_density
+        offsets = np.arange(-inner + spacing / 2, inner, spacing)
+        half = np.sqrt(np.maximum(inner * inner - offsets * offsets, 0.0))
+        # Each row runs from one side to the other, alternating direction
+        ends = np.stack((-half, half), axis=1)
+        ends[1::2] = ends[1::2, ::-1]
+        u = ends.ravel()
+        v = np.repeat(offsets, 2)
+        if layer % 2:
+            u, v = v, u
+        x, y = cx + u, cy + v
+        lines.append(f"G1 X{x[0]:.3f} Y{y[0]:.3f} F{TRAVEL_FEEDRATE:.3f}")
+        lines.append(f"G1 F{INFILL_FEEDRATE:.3f}")
+        steps = np.hypot(np.diff(x), np.diff(y))
+        e_values = e + np.cumsum(steps) * E_PER_MM
+        if len(e_values):
+            e = float(e_values[-1])
+        lines.extend(f"G1 X{px:.3f} Y{py:.3f} E{pe:.5f}"
+                     for px, py, pe in zip(x[1:].tolist(), y[1:].tolist(), e_values.tolist()))
+
+    # Retract before travelling to the next island
+    e -= RETRACT_LENGTH
+    lines.append(f"G1 E{e:.5f} F2400.00000")
+    return lines, e
+
+
+# Centre of the n-th island on a layer; islands fill the plate row by row
+def _island_center(index):
+    row, column = divmod(index, ISLANDS_PER_ROW)
+    return (PLATE_CENTER[0] + (column - (ISLANDS_PER_ROW - 1) / 2) * ISLAND_SPACING,
+            PLATE_CENTER[1] + row * ISLAND_SPACING)
+
+
+def _format_print_time(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}h {seconds % 3600 // 60}m {seconds % 60}s"
+
+
+def _header(flavor, layer_count, max_z, filament_length, filament_weight, print_time, nozzle, bed):
+    number = lambda value: f"{value:>{_HEADER_NUMBER_WIDTH}}"
+    if flavor == "bambu":
+        lines = ["; HEADER_BLOCK_START",
+                 "; BambuStudio 01.09.00.70",
+                 f"; model printing time: {number(print_time)}",
+                 f"; total estimated time: {number(print_time)}",
+                 f"; total layer number: {number(layer_count)}",
+                 f"; total filament length [mm] : {number(f'{filament_length:.2f}')}",
+                 f"; total filament volume [cm^3] : {number(f'{filament_length * 2.405e-3:.2f}')}",
+                 f"; total filament weight [g] : {number(f'{filament_weight:.2f}')}",
+                 f"; max_z_height: {number(f'{max_z:.2f}')}",
+                 "; HEADER_BLOCK_END",
+                 ""]
+    else:
+        lines = ["; generated by Slic3r 1.3.0 on 2024-11-10 at 11:47:19",
+                 "",
+                 f"; external perimeters extrusion width = {EXTRUSION_WIDTH:.2f}mm",
+                 f"; perimeters extrusion width = {EXTRUSION_WIDTH:.2f}mm",
+                 f"; infill extrusion width = {EXTRUSION_WIDTH:.2f}mm",
+                 ""]
+    lines += ["M107",
+              f"M190 S{bed} ; set bed temperature and wait for it to be reached",
+              f"M104 S{nozzle} ; set temperature",
+              "G28 ; home all axes",
+              "G1 Z5 F5000 ; lift nozzle",
+              f"M109 S{nozzle} ; set temperature and wait for it to be reached",
+              "G21 ; set units to millimeters",
+              "G90 ; use absolute coordinates",
+              "M82 ; use absolute distances for extrusion",
+              "G92 E0"]
+    return "\n".join(lines) + "\n"
+
+
+def _trailer(flavor, filament_length, filament_weight, print_time, nozzle, bed, config):
+    lines = ["M107",
+             "M104 S0 ; turn off temperature",
+             "M140 S0 ; turn off bed",
+             "G28 X0  ; home X axis",
+             "M84     ; disable motors",
+             ""]
+    if flavor == "bambu":
+        lines += ["; CONFIG_BLOCK_START"]
+    else:
+        lines += [f"; filament used = {filament_length:.1f}mm ({filament_length * 2.405e-3:.1f}cm3)",
+                  f"; total filament weight [g] : {filament_weight:.2f}",
+                  f"; estimated printing time (normal mode) = {print_time}",
+                  ""]
+    lines += [f"; bed_temperature = {bed}",
+              f"; nozzle_temperature = {nozzle}",
+              f"; layer_height = {LAYER_HEIGHT}",
+              f"; perimeters = {config['perimeters']}",
+              f"; fill_density = {round(config['infill_density'] * 100)}%",
+              "; fill_pattern = rectilinear",
+              f"; perimeter_speed = {PERIMETER_FEEDRATE / 60:g}",
+              f"; infill_speed = {INFILL_FEEDRATE / 60:g}",
+              f"; travel_speed = {TRAVEL_FEEDRATE / 60:g}",
+              f"; retract_length = {RETRACT_LENGTH}"]
+    if flavor == "bambu":
+        lines += ["; CONFIG_BLOCK_END"]
+    return "\n".join(lines) + "\n"
+
+
+# Lines one island takes at the given height, to size layers before generating them
+def _island_line_count(z, perimeters, perimeter_segments, infill_density):
+    inner = _island_radius(z) * 0.92 - perimeters * EXTRUSION_WIDTH
+    rows = int(2 * inner * infill_density / EXTRUSION_WIDTH) if infill_density > 0 and inner > 0 else 0
+    return perimeters * (perimeter_segments + 1) + 2 + (2 * rows + 1 if rows else 0) + 1
+
+
+# Write a synthetic G-code file with about 'lines' lines of layer body (plus a short header and trailer)
+# With layers=None every layer holds one island and the layer count follows from the line budget;
+# with a layer count, each layer gets an equal share of the lines and holds as many islands as that takes.
+# perimeter_segments sets how finely the curved perimeters are divided (more segments, shorter moves),
+# lobes how much their curvature varies, and infill_density (0 to 1) how close the infill rows are.
+# arcs=True writes the perimeters as G3 arcs instead of G1 segments.
+# flavor is "bambu" (BambuStudio comments, the default here and on the command line) or "slic3r".
+def generate_gcode(path, lines, layers=None, perimeter_segments=64, infill_density=0.2, perimeters=3,
+                   lobes=5, arcs=False, flavor="bambu", nozzle=210, bed=60):
+    if flavor not in ("slic3r", "bambu"):
+        raise ValueError(f"unknown flavor {flavor!r}")
+    if layers is None:
+        layers = max(1, round(lines / _island_line_count(LAYER_HEIGHT * 25, perimeters, perimeter_segments,
+                                                         infill_density)))
+    layer_marker = "; CHANGE_LAYER\n; Z_HEIGHT: {z:.3f}\n" if flavor == "bambu" else ";LAYER_CHANGE\n;Z:{z:.3f}\n"
+    config = {"perimeters": perimeters, "infill_density": infill_density}
+
+    filament_length = 0.0
+    written = 0
+    with open(path, "w", newline="\n") as file:
+        # Header numbers are written as padding and filled in once the body is known
+        header = _header(flavor, "", 0.0, 0.0, 0.0, "", nozzle, bed)
+        file.write(header)
+        for layer in range(layers):
+            z = LAYER_HEIGHT * (layer + 1)
+            budget = lines * (layer + 1) // layers - written  # Spreads the remainder over the layers
+            body = [f"G1 Z{z:.3f} F{TRAVEL_FEEDRATE:.3f}", "G92 E0"]
+            e = 0.0
+            island = 0
+            while len(body) < budget:
+                island_lines, e = _island_lines(_island_center(island), z, layer, e, perimeters,
+                                                perimeter_segments, infill_density, lobes, arcs)
+                body.extend(island_lines)
+                island += 1
+            body = body[:max(budget, 2)]
+            # E is reset every layer; the last island may be cut short, which the totals ignore
+            filament_length += e + RETRACT_LENGTH if island else 0.0
+            file.write(layer_marker.format(z=z) + "\n".join(body) + "\n")
+            written += len(body)
+
+        max_z = LAYER_HEIGHT * layers
+        filament_weight = filament_length * 2.405e-3 * FILAMENT_DENSITY  # 1.75 mm filament: 2.405 mm^2
+        print_time = _format_print_time(filament_length / E_PER_MM / (PERIMETER_FEEDRATE / 60) * 1.3)
+        file.write(_trailer(flavor, filament_length, filament_weight, print_time, nozzle, bed, config))
+
+        file.seek(0)
+        final = _header(flavor, layers, max_z, filament_length, filament_weight, print_time, nozzle, bed)
+        assert len(final) == len(header)
+        file.write(final)
+    return path
+
+
+# Benchmark stages
+# Each stage is timed on its own; what it needs from earlier stages is prepared outside the timed region.
+# 'items' is what the stage produces: lines read, summary fields found, moves, positions, segments or triangles.
+
+STAGES = ("ingest", "metadata", "parse_toolpath", "parse_toolpath_parallel", "parse_extrusion_paths",
+          "generate_lines_from_paths", "spatial_index", "analyze_toolpath", "load_toolpath", "export_to_stl",
+          "export_watertight_stl")
+# The watertight export is much slower than the others and only runs when asked for
+DEFAULT_STAGES = STAGES[:-1]
+
+
+class BenchmarkRun:
+    def __init__(self, path, stl_path, workers=None):
+        self.path = path
+        self.stl_path = stl_path
+        # Worker processes for parse_toolpath_parallel
+        self.workers = workers or os.cpu_count() or 1
+        self.toolpath_path = os.path.splitext(stl_path)[0] + converter.TOOLPATH_SUFFIX
+        self.source = None
+        self.toolpath = None
+        self.paths = None
+
+    def _open(self):
+        if self.source is None:
+            self.source = converter.GcodeSource.from_file(self.path)
+        return self.source
+
+    def _processor(self):
+        processor = converter.GcodeProcessor()
+        processor.gcode = self._open()
+        return processor
+
+    # Map the file and read every byte once in line-aligned batches
+    def ingest(self):
+        self.close()
+        source = self._open()
+        return sum(chunk.count(b"\n") for chunk, _ in source.batches())
+
+    # Comment-only summary scan of the header and trailer blocks
+    def metadata(self):
+        metadata = converter.scan_source_metadata(self._open())
+        return sum(value is not None for value in vars(metadata).values())
+
+    # Columnar parse of every move
+    def parse_toolpath(self):
+        self.toolpath = self._processor().parse_toolpath()
+        return len(self.toolpath)
+
+    # The same parse split over worker processes; compare with parse_toolpath for the scaling
+    def parse_toolpath_parallel(self):
+        return len(converter.parse_toolpath_parallel(self.path, self.workers))
+
+    # The list-based API the interactive flow uses; on a fresh processor, so it includes parse_toolpath
+    def parse_extrusion_paths(self):
+        self.paths, _ = self._processor().parse_extrusion_paths()
+        return len(self.paths)
+
+    def generate_lines_from_paths(self):
+        if self.paths is None:
+            self.paths, _ = self._processor().parse_extrusion_paths()
+        return len(converter.GcodeProcessor().generate_lines_from_paths(self.paths))
+
+    # SegmentIndex over the extruding segments of the toolpath array
+    def spatial_index(self):
+        if self.toolpath is None:
+            self.toolpath = self._processor().parse_toolpath()
+        return len(converter.SegmentIndex(self.toolpath))
+
+    # Per-segment analytics and the print-time estimate of the toolpath array
+    def analyze_toolpath(self):
+        if self.toolpath is None:
+            self.toolpath = self._processor().parse_toolpath()
+        return len(converter.analyze_toolpath(self.toolpath).time)
+
+    # Map a toolpath file saved from the parsed toolpath (saved outside the timed region)
+    def load_toolpath(self):
+        return len(converter.load_toolpath(self.toolpath_path))
+
+    # Streaming STL export of the toolpath array, as batch mode does it
+    def export_to_stl(self):
+        if self.toolpath is None:
+            self.toolpath = self._processor().parse_toolpath()
+        return converter.GcodeProcessor().export_to_stl(self.toolpath, self.stl_path)
+
+    # Closed-surface export of the toolpath at the default voxel size
+    def export_watertight_stl(self):
+        if self.toolpath is None:
+            self.toolpath = self._processor().parse_toolpath()
+        return converter.GcodeProcessor().export_watertight_stl(self.toolpath, self.stl_path)
+
+    # Prepare what a stage needs so that only the stage itself is measured
+    def prepare(self, stage):
+        if stage == "generate_lines_from_paths" and self.paths is None:
+            self.paths, _ = self._processor().parse_extrusion_paths()
+        if stage in ("spatial_index", "analyze_toolpath", "load_toolpath", "export_to_stl", "export_watertight_stl") \
+                and self.toolpath is None:
+            self.toolpath = self._processor().parse_toolpath()
+        if stage == "load_toolpath":
+            converter.save_toolpath(self.toolpath_path, self.toolpath)
+        # Positions are only kept for the stage after the one that made them
+        if stage not in ("parse_extrusion_paths", "generate_lines_from_paths"):
+            self.paths = None
+
+    def close(self):
+        if self.source is not None:
+            self.source.close()
+        self.source = None
+        self.toolpath = None
+        self.paths = None
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+
+
+def _run_stage(run, stage, trace_memory):
+    run.prepare(stage)
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    wall, cpu = time.perf_counter(), time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        items = getattr(run, stage)()
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return wall, cpu, items, peak
+
+
+# Time every selected stage of one G-code file
+# Timings are the best of 'repeat' runs. Peak memory comes from a separate run under tracemalloc, which slows
+# allocation-heavy stages down; it counts Python and NumPy allocations but not pages of the memory-mapped file.
+# parse_toolpath_parallel runs in worker processes, so its peak memory only counts the parent.
+# 'workers' is a worker count or a list of them; with several, parse_toolpath_parallel is timed once per count
+# and reported as parse_toolpath_parallel_j<count>, which shows how the parse scales.
+def benchmark_file(path, stages=DEFAULT_STAGES, repeat=1, trace_memory=True, work_dir=None, workers=None):
+    size = os.path.getsize(path)
+    stl_path = os.path.join(work_dir or tempfile.gettempdir(), "benchmark_output.stl")
+    counts = workers if isinstance(workers, (list, tuple)) else [workers]
+    run = BenchmarkRun(path, stl_path, counts[0])
+    # (result name, stage, worker count) of every measurement
+    measured = []
+    for stage in stages:
+        if stage == "parse_toolpath_parallel" and len(counts) > 1:
+            measured += [(f"{stage}_j{count}", stage, count) for count in counts]
+        else:
+            measured.append((stage, stage, counts[0]))
+    results = {name: {"seconds": None} for name, _, _ in measured}
+    try:
+        line_count = run.ingest()
+        for _ in range(repeat):
+            run.close()
+            for name, stage, count in measured:
+                run.workers = count or os.cpu_count() or 1
+                wall, cpu, items, _ = _run_stage(run, stage, False)
+                result = results[name]
+                if result["seconds"] is None or wall < result["seconds"]:
+                    result.update(seconds=round(wall, 6), cpu_seconds=round(cpu, 6), items=items)
+                result["rss_high_water_mb"] = _peak_rss_mb()
+        if trace_memory:
+            run.close()
+            for name, stage, count in measured:
+                run.workers = count or os.cpu_count() or 1
+                peak = _run_stage(run, stage, True)[3]
+                results[name]["peak_memory_mb"] = round(peak / (1 << 20), 2)
+    finally:
+        run.close()
+        for output in (stl_path, run.toolpath_path):
+            if os.path.exists(output):
+                os.remove(output)
+
+    for result in results.values():
+        seconds = max(result["seconds"], 1e-9)
+        result["lines_per_second"] = round(line_count / seconds)
+        result["mb_per_second"] = round(size / (1 << 20) / seconds, 2)
+        result["items_per_second"] = round(result["items"] / seconds)
+    return {"gcode": os.path.abspath(path), "bytes": size, "lines": line_count, "stages": results}
+
+
+def environment():
+    return {"python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "parser_version": converter.PARSER_VERSION,
+            "generator_version": GENERATOR_VERSION}
+
+
+# Comparing runs
+# Runs are matched by generator settings (or by file name for --gcode runs) and stages by name.
+# A stage regresses when it got slower, or used more memory, by more than the threshold.
+
+def _run_key(run):
+    return json.dumps(run.get("generator")) if run.get("generator") else os.path.basename(run["gcode"])
+
+
+def compare_results(previous, current, threshold=0.10):
+    earlier = {_run_key(run): run for run in previous["runs"]}
+    regressions = []
+    for run in current["runs"]:
+        baseline = earlier.get(_run_key(run))
+        if baseline is None:
+            print(f"\n{os.path.basename(run['gcode'])}: no matching run in the previous results")
+            continue
+        print(f"\n{os.path.basename(run['gcode'])} ({run['lines']} lines)")
+        print(f"{'stage':<28}{'before s':>12}{'after s':>12}{'ratio':>8}{'before MB':>12}{'after MB':>12}")
+        for stage, result in run["stages"].items():
+            before = baseline["stages"].get(stage)
+            if before is None or not before.get("seconds"):
+                continue
+            ratio = result["seconds"] / before["seconds"]
+            memory_before, memory_after = before.get("peak_memory_mb"), result.get("peak_memory_mb")
+            flags = []
+            if ratio > 1 + threshold:
+                flags.append("slower")
+            if memory_before and memory_after and memory_after > memory_before * (1 + threshold):
+                flags.append("more memory")
+            print(f"{stage:<28}{before['seconds']:>12.4f}{result['seconds']:>12.4f}{ratio:>8.2f}"
+                  f"{memory_before if memory_before is not None else '-':>12}"
+                  f"{memory_after if memory_after is not None else '-':>12}"
+                  f"{'  REGRESSION: ' + ', '.join(flags) if flags else ''}")
+            if flags:
+                regressions.append((run["gcode"], stage, flags))
+    return regressions
+
+
+def _print_run(run):
+    print(f"\n{os.path.basename(run['gcode'])}: {run['lines']} lines, {run['bytes'] / (1 << 20):.1f} MB")
+    print(f"{'stage':<28}{'seconds':>10}{'lines/s':>14}{'MB/s':>10}{'items':>12}{'peak MB':>10}")
+    for stage, result in run["stages"].items():
+        peak = result.get("peak_memory_mb")
+        print(f"{stage:<28}{result['seconds']:>10.4f}{result['lines_per_second']:>14}{result['mb_per_second']:>10}"
+              f"{result['items']:>12}{peak if peak is not None else '-':>10}")
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the G-code to STL converter stage by stage.")
+    parser.add_argument("--lines", type=int, nargs="+", default=[10000, 100000],
+                        help="sizes of the synthetic files to benchmark, in lines (10k to 50M)")
+    parser.add_argument("--gcode", nargs="+", help="benchmark these G-code files instead of synthetic ones")
+    parser.add_argument("--layers", type=int, default=None, help="layer count (default: follows from --lines)")
+    parser.add_argument("--perimeter-segments", type=int, default=64, help="segments per perimeter loop")
+    parser.add_argument("--perimeters", type=int, default=3)
+    parser.add_argument("--lobes", type=int, default=5, help="lobes of the perimeter outline")
+    parser.add_argument("--arcs", action="store_true", help="write perimeters as G3 arcs (arc fitting)")
+    parser.add_argument("--infill-density", type=float, default=0.2, help="0 to 1")
+    parser.add_argument("--flavor", choices=("slic3r", "bambu"), default="bambu",
+                        help="slicer whose comment style the synthetic files use")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(DEFAULT_STAGES),
+                        help="stages to run (generate_lines_from_paths is slow and memory-hungry above a few M lines; "
+                             "export_watertight_stl only runs when listed)")
+    parser.add_argument("-j", "--workers", type=int, nargs="+", default=None,
+                        help="worker processes for parse_toolpath_parallel (default: CPU count); with several "
+                             "counts the stage is timed once per count")
+    parser.add_argument("--repeat", type=int, default=1, help="report the best of this many runs")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "gcode_benchmark"),
+                        help="where synthetic G-code is generated and reused between runs")
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="results file")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="slowdown that counts as a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    os.makedirs(args.work_dir, exist_ok=True)
+    stages = [stage for stage in STAGES if stage in args.stages]
+
+    jobs = []
+    if args.gcode:
+        jobs = [(path, None) for path in args.gcode]
+    else:
+        for lines in args.lines:
+            settings = {"lines": lines, "layers": args.layers, "perimeter_segments": args.perimeter_segments,
+                        "infill_density": args.infill_density, "perimeters": args.perimeters,
+                        "lobes": args.lobes, "arcs": args.arcs, "flavor": args.flavor}
+            name = "synthetic_v{}_{}.gcode".format(GENERATOR_VERSION,
+                                                   "_".join(str(value) for value in settings.values()))
+            path = os.path.join(args.work_dir, name)
+            if not os.path.exists(path):
+                started = time.perf_counter()
+                generate_gcode(path + ".part", **settings)
+                os.replace(path + ".part", path)
+                print(f"Generated {path} in {time.perf_counter() - started:.1f} s")
+            jobs.append((path, settings))
+
+    results = {"created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+               "environment": environment(),
+               "settings": {"stages": stages, "repeat": args.repeat, "memory": not args.no_memory,
+                            "workers": args.workers or [os.cpu_count()]},
+               "runs": []}
+    for path, settings in jobs:
+        run = benchmark_file(path, stages, args.repeat, not args.no_memory, args.work_dir, args.workers)
+        run["generator"] = settings
+        results["runs"].append(run)
+        _print_run(run)
+
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            previous = json.load(file)
+        regressions = compare_results(previous, results, args.threshold)
+        print(f"\n{len(regressions)} regression(s)" if regressions else "\nNo regressions")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,12 @@
+# Make GCodeToSTL importable from the tests, and keep matplotlib from opening windows
+import os
+import sys
+
+import matplotlib
+
+matplotlib.use("Agg")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The sample G-code files at the root of the repository
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_FILES = ["cube.gcode", "kv.gcode", "sphere.gcode", "triangle.gcode"]
@@ -0,0 +1,26 @@
+# Tests for the toolpath analytics
+import numpy as np
+import pytest
+
+from GCodeToSTL import analyze_toolpath, parse_toolpath_chunk
+
+
+def test_extrusion_per_mm_with_a_large_filament_total():
+    # 120 m of filament already fed: the float32 total can only step in 0.008 mm
+    lines = [b"G92 E120000", b"G1 X0 Y0 Z0.2 F1800"]
+    lines += [b"G1 X%d E%.4f" % (step, 120000 + 0.0333 * step) for step in range(1, 200)]
+    toolpath, _ = parse_toolpath_chunk(b"\n".join(lines) + b"\n")
+    assert np.allclose(toolpath['de'][2:], 0.0333, rtol=1e-5)
+    e_per_mm = analyze_toolpath(toolpath).channels["e_per_mm"][1:]
+    assert np.allclose(e_per_mm, 0.0333, rtol=1e-5)
+
+
+def test_moves_that_do_nothing_do_not_stop_the_head():
+    straight = [b"G1 X0 Y0 Z0.2 F3000"] + [b"G1 X%d E%d" % (step, step) for step in range(1, 11)]
+    padded = [straight[0]]
+    for line in straight[1:]:
+        # A lone feedrate and a repeat of the position just reached
+        padded += [line, b"G1 F3000", line]
+    times = [analyze_toolpath(parse_toolpath_chunk(b"\n".join(lines) + b"\n")[0]).print_time
+             for lines in (straight, padded)]
+    assert times[1] == pytest.approx(times[0])
@@ -0,0 +1,50 @@
+# Tests for headless batch conversion
+import json
+import multiprocessing
+import os
+import shutil
+
+import pytest
+
+import GCodeToSTL
+from conftest import REPO_ROOT, SAMPLE_FILES
+
+_convert_file = GCodeToSTL.convert_file
+
+
+# convert_file, except that the worker process dies outright on kv.gcode
+def _crashing_convert_file(path, *args, **kwargs):
+    if os.path.basename(path) == "kv.gcode":
+        os._exit(1)
+    return _convert_file(path, *args, **kwargs)
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    directory = tmp_path / "gcode"
+    directory.mkdir()
+    for name in SAMPLE_FILES:
+        shutil.copy(os.path.join(REPO_ROOT, name), directory)
+    return str(directory)
+
+
+def test_batch_converts_every_file(inputs, tmp_path):
+    output = tmp_path / "out"
+    assert GCodeToSTL.run_batch([inputs], str(output), workers=2) == 0
+    report = json.loads((output / "batch_summary.json").read_text())
+    assert [os.path.basename(result["input"]) for result in report["results"]] == SAMPLE_FILES
+    assert all(result["triangles"] > 0 for result in report["results"])
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork",
+                    reason="workers only see the patched convert_file when they are forked")
+def test_dead_worker_fails_only_its_file(inputs, tmp_path, monkeypatch):
+    monkeypatch.setattr(GCodeToSTL, "convert_file", _crashing_convert_file)
+    output = tmp_path / "out"
+    assert GCodeToSTL.run_batch([inputs], str(output), workers=2) == 1
+    results = {os.path.basename(result["input"]): result
+               for result in json.loads((output / "batch_summary.json").read_text())["results"]}
+    assert sorted(results) == SAMPLE_FILES
+    assert "BrokenProcessPool" in results["kv.gcode"]["error"]
+    assert all("error" not in results[name] for name in SAMPLE_FILES if name != "kv.gcode")
+    assert (output / "kv.json").exists()
@@ -0,0 +1,85 @@
+# Tests for the on-disk toolpath cache
+import os
+import shutil
+import time
+
+import numpy as np
+import pytest
+
+import GCodeToSTL
+from GCodeToSTL import GcodeMetadata, GcodeProcessor, GcodeSource, ToolpathCache
+from conftest import REPO_ROOT
+
+
+def parse(path, cache):
+    processor = GcodeProcessor(cache=cache)
+    processor.gcode = GcodeSource.from_file(path)
+    return processor.parse_toolpath()
+
+
+@pytest.fixture
+def cube(tmp_path):
+    path = str(tmp_path / "cube.gcode")
+    shutil.copy(os.path.join(REPO_ROOT, "cube.gcode"), path)
+    return path
+
+
+def test_miss_then_hit(cube, tmp_path):
+    cache = ToolpathCache(str(tmp_path / "cache"))
+    parsed = parse(cube, cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+    cached = parse(cube, cache)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert isinstance(cached, np.memmap)
+    assert cached.tobytes() == parsed.tobytes()
+    assert cache.stats()["entries"] == 1
+
+
+def test_changed_content_misses(cube, tmp_path):
+    cache = ToolpathCache(str(tmp_path / "cache"))
+    parse(cube, cache)
+    # Same size and modification time, different content: only a content hash notices
+    stat = os.stat(cube)
+    with open(cube, "r+b") as file:
+        file.seek(-2, os.SEEK_END)
+        file.write(b";\n")
+    os.utime(cube, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    parse(cube, cache)
+    assert (cache.hits, cache.misses) == (0, 2)
+    # The path, size and modification time shortcut is opt-in, because it cannot tell these files apart
+    trusting = ToolpathCache(str(tmp_path / "cache"), trust_mtime=True)
+    key = trusting.key(GcodeSource.from_file(cube))
+    os.utime(cube, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert trusting.key(GcodeSource.from_file(cube)) == key
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    toolpath = np.zeros(1000, dtype=GCodeToSTL.TOOLPATH_DTYPE)
+    cache = ToolpathCache(str(tmp_path / "cache"), max_bytes=2.5 * toolpath.nbytes)
+    for key in ("a", "b"):
+        cache.store(key, toolpath, GcodeMetadata())
+    # "a" was stored first but is used after "b", so "b" is the least recently used when "c" pushes the cache
+    # over its size
+    for key, age in (("a", 20), ("b", 10)):
+        os.utime(os.path.join(cache.directory, f"{key}.json"), (time.time() - age, time.time() - age))
+    assert cache.load("a") is not None
+    cache.store("c", toolpath, GcodeMetadata())
+    assert cache.load("b") is None
+    assert cache.load("a") is not None and cache.load("c") is not None
+    assert not any(name.startswith("b.") for name in os.listdir(cache.directory))
+
+
+def test_stale_orphans_are_removed(tmp_path):
+    toolpath = np.zeros(10, dtype=GCodeToSTL.TOOLPATH_DTYPE)
+    cache = ToolpathCache(str(tmp_path / "cache"))
+    cache.store("a", toolpath, GcodeMetadata())
+    # Data files whose .json was never written: one left long ago, one from a store that may still be running
+    for name, age in (("old.npy", 2 * GCodeToSTL._CACHE_ORPHAN_SECONDS), ("new.npz", 0)):
+        path = os.path.join(cache.directory, name)
+        with open(path, "wb") as file:
+            np.save(file, toolpath)
+        os.utime(path, (time.time() - age, time.time() - age))
+    assert cache.stats()["orphans"] == 2
+    cache.store("b", toolpath, GcodeMetadata())
+    assert cache.stats()["orphans"] == 1
+    assert "new.npz" in os.listdir(cache.directory)
@@ -0,0 +1,93 @@
+# Tests for the cuboid STL export
+import os
+
+import numpy as np
+import pytest
+
+import GCodeToSTL
+from GCodeToSTL import (STL_RECORD_DTYPE, GcodeProcessor, load_toolpath, parse_toolpath_chunk,
+                        save_toolpath)
+from conftest import REPO_ROOT
+
+
+@pytest.fixture
+def toolpath():
+    with open(os.path.join(REPO_ROOT, "cube.gcode"), "rb") as file:
+        return parse_toolpath_chunk(file.read())[0][:500]
+
+
+# Triangles of the original writer, which built one cuboid per segment in a Python loop
+def reference_triangles(points, extrusion_width=0.2, extrusion_height=0.2):
+    triangles = []
+    for i in range(1, len(points)):
+        start = np.array(points[i - 1], dtype=np.float64)
+        end = np.array(points[i], dtype=np.float64)
+        offset = np.array([extrusion_width, 0, 0])
+        top_start = start + offset + [0, 0, extrusion_height]
+        top_end = end + offset + [0, 0, extrusion_height]
+        bottom_start = start - offset
+        bottom_end = end - offset
+        vertices = [bottom_start, bottom_end, top_end, top_start]
+        for face in ([0, 1, 2], [0, 2, 3], [0, 3, 2], [0, 2, 1], [0, 1, 2], [0, 2, 3]):
+            triangles.append([vertices[j] for j in face])
+    return np.array(triangles, dtype=np.float32).reshape(-1, 3, 3)
+
+
+def read_stl(path):
+    with open(path, "rb") as file:
+        file.seek(80)
+        count = int(np.frombuffer(file.read(4), dtype=np.uint32)[0])
+        records = np.fromfile(file, dtype=STL_RECORD_DTYPE)
+    assert len(records) == count
+    return records
+
+
+def export(paths, tmp_path, **options):
+    path = str(tmp_path / "model.stl")
+    count = GcodeProcessor().export_to_stl(paths, path, **options)
+    records = read_stl(path)
+    assert len(records) == count
+    return records
+
+
+def points_of(toolpath):
+    return np.stack((toolpath['x'], toolpath['y'], toolpath['z']), axis=1)
+
+
+def test_matches_the_per_segment_writer(toolpath, tmp_path):
+    points = points_of(toolpath)
+    records = export(points.tolist(), tmp_path)
+    assert np.array_equal(records['vectors'], reference_triangles(points))
+
+
+def test_point_array(toolpath, tmp_path):
+    points = points_of(toolpath)
+    records = export(points, tmp_path, extrusion_width=0.4, extrusion_height=0.3)
+    assert np.array_equal(records['vectors'], reference_triangles(points, 0.4, 0.3))
+
+
+def test_toolpath_array(toolpath, tmp_path):
+    records = export(toolpath, tmp_path)
+    assert np.array_equal(records['vectors'], reference_triangles(points_of(toolpath)))
+
+
+def test_columnar_toolpath(toolpath, tmp_path):
+    path = str(tmp_path / "cube.gctp")
+    save_toolpath(path, toolpath)
+    records = export(load_toolpath(path), tmp_path)
+    assert np.array_equal(records['vectors'], reference_triangles(points_of(toolpath)))
+
+
+def test_batches_join_into_one_path(toolpath, tmp_path, monkeypatch):
+    # Small chunks so segments also span record buffers
+    monkeypatch.setattr(GCodeToSTL, "STL_CHUNK_SEGMENTS", 64)
+    batches = (toolpath[first:first + 97] for first in range(0, len(toolpath), 97))
+    records = export(batches, tmp_path)
+    assert np.array_equal(records['vectors'], reference_triangles(points_of(toolpath)))
+
+
+def test_travel_moves_can_be_left_out(toolpath, tmp_path):
+    records = export(toolpath, tmp_path, travel_moves=False)
+    extruding = toolpath['move'][1:] == GCodeToSTL.MOVE_EXTRUDE
+    expected = reference_triangles(points_of(toolpath)).reshape(-1, 6, 3, 3)[extruding]
+    assert np.array_equal(records['vectors'], expected.reshape(-1, 3, 3))
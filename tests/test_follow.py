@@ -0,0 +1,125 @@
+# Tests for follow mode: however the G-code arrives, the result must match parsing the whole file at once
+import os
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+
+from GCodeToSTL import (FollowState, GcodeProcessor, LayerIndex, extend_pyramid, parse_toolpath_chunk,
+                        segment_channels, _toolpath_segments)
+from conftest import REPO_ROOT, SAMPLE_FILES
+
+
+def read_sample(name):
+    with open(os.path.join(REPO_ROOT, name), "rb") as file:
+        return file.read()
+
+
+# Cut points at random byte offsets, so most pieces end in the middle of a line
+def random_cuts(size, pieces, seed=0):
+    cuts = np.sort(np.random.default_rng(seed).choice(np.arange(1, size), pieces - 1, replace=False))
+    return [0] + cuts.tolist() + [size]
+
+
+@pytest.mark.parametrize("name", SAMPLE_FILES)
+def test_polled_file_matches_a_full_parse(name, tmp_path):
+    data = read_sample(name)
+    path = str(tmp_path / name)
+    open(path, "wb").close()
+    processor = GcodeProcessor()
+    processor.start_follow(path)
+    added = []
+    cuts = random_cuts(len(data), 40)
+    for start, end in zip(cuts[:-1], cuts[1:]):
+        with open(path, "ab") as file:
+            file.write(data[start:end])
+        added.append(processor.poll_follow().copy())
+    added.append(processor.poll_follow(final=True).copy())
+
+    expected = parse_toolpath_chunk(data)[0]
+    assert processor.toolpath.tobytes() == expected.tobytes()
+    assert np.concatenate(added).tobytes() == expected.tobytes()
+
+
+def test_fed_bytes_match_a_full_parse():
+    # No line break after the last line: it is only parsed once the stream is final
+    data = read_sample("kv.gcode").rstrip(b"\r\n") + b"\nG1 X1 Y1 E0.5"
+    processor = GcodeProcessor()
+    processor.follower = FollowState()
+    cuts = random_cuts(len(data), 200, seed=1)
+    for start, end in zip(cuts[:-1], cuts[1:]):
+        processor.feed_follow(data[start:end])
+    assert processor.toolpath['line'][-1] < data.count(b"\n") + 1
+    processor.feed_follow(b"", final=True)
+    assert processor.toolpath.tobytes() == parse_toolpath_chunk(data)[0].tobytes()
+
+
+def test_replaced_file_is_followed_from_the_start(tmp_path):
+    path = str(tmp_path / "part.gcode")
+    with open(path, "wb") as file:
+        file.write(read_sample("cube.gcode"))
+    processor = GcodeProcessor()
+    processor.start_follow(path)
+    processor.poll_follow()
+    data = read_sample("triangle.gcode")
+    os.remove(path)
+    with open(path, "wb") as file:
+        file.write(data)
+    processor.poll_follow(final=True)
+    assert processor.toolpath.tobytes() == parse_toolpath_chunk(data)[0].tobytes()
+
+
+# The viewer's follow update: segments and colouring values of the moves added by each poll, from the move
+# before them on, go into the pyramid with extend_pyramid
+def test_follow_updates_build_the_same_pyramid(tmp_path):
+    data = read_sample("sphere.gcode")
+    path = str(tmp_path / "sphere.gcode")
+    open(path, "wb").close()
+    processor = GcodeProcessor()
+    processor.start_follow(path)
+    names = ["e_per_mm", "feedrate"]
+    max_segments = 2000
+    levels = LayerIndex(np.empty((0, 2, 3)), np.empty((0, len(names)), dtype=np.float32)).pyramid(max_segments)
+    cuts = random_cuts(len(data), 25, seed=2)
+    for start, end in zip(cuts[:-1], cuts[1:]):
+        with open(path, "ab") as file:
+            file.write(data[start:end])
+        moves = processor.poll_follow(final=end == len(data))
+        first = len(processor.toolpath) - len(moves)
+        rows = processor.toolpath[max(first - 1, 0):]
+        channels = segment_channels(rows)
+        values = np.stack([channels[name] for name in names], axis=1)
+        extend_pyramid(levels, _toolpath_segments(rows), values, max_segments)
+
+    toolpath = parse_toolpath_chunk(data)[0]
+    channels = segment_channels(toolpath)
+    rebuilt = LayerIndex(_toolpath_segments(toolpath),
+                         np.stack([channels[name] for name in names], axis=1)).pyramid(max_segments)
+    assert len(levels) == len(rebuilt) > 2
+    for level, expected in zip(levels, rebuilt):
+        assert np.array_equal(level.segments, expected.segments)
+        assert np.array_equal(level.values, expected.values)
+        assert np.array_equal(level.offsets, expected.offsets)
+
+
+def test_colour_range_is_the_range_of_the_values():
+    # Segments are coloured by the mean E of their ends, 0.5 and 2 here; the range must not reach down to 0
+    toolpath = parse_toolpath_chunk(b"G1 X0 Y0 Z0.2 F1200\nG1 X10 E1\nG1 Y10 E3\n")[0]
+    GcodeProcessor().plot_3d_paths(toolpath)
+    norm = plt.gcf().axes[0].collections[0].norm
+    assert (norm.vmin, norm.vmax) == (0.5, 2)
+    plt.close("all")
+
+
+def test_empty_followed_file_plots(tmp_path):
+    path = str(tmp_path / "empty.gcode")
+    open(path, "wb").close()
+    processor = GcodeProcessor()
+    processor.start_follow(path)
+    processor.poll_follow()
+    toolpath = processor.toolpath
+    processor.plot_3d_paths(_toolpath_segments(toolpath), toolpath['e'], follow_interval=60,
+                            channels=segment_channels(toolpath))
+    norm = plt.gcf().axes[0].collections[0].norm
+    assert (norm.vmin, norm.vmax) == (0, 1)
+    plt.close("all")
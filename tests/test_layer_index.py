@@ -0,0 +1,50 @@
+# Tests for the viewer's layer index and its level-of-detail pyramid
+import os
+
+import numpy as np
+import pytest
+
+from GCodeToSTL import LayerIndex, extend_pyramid, parse_toolpath_chunk
+from conftest import REPO_ROOT
+
+
+@pytest.fixture(scope="module")
+def segments():
+    with open(os.path.join(REPO_ROOT, "sphere.gcode"), "rb") as file:
+        toolpath = parse_toolpath_chunk(file.read())[0]
+    points = np.stack((toolpath['x'], toolpath['y'], toolpath['z']), axis=1).astype(np.float64)
+    values = np.stack((toolpath['e'][1:], toolpath['f'][1:]), axis=1).astype(np.float64)
+    return np.stack((points[:-1], points[1:]), axis=1), values
+
+
+def assert_same_index(actual, expected):
+    assert np.array_equal(actual.segments, expected.segments)
+    assert np.array_equal(actual.values, expected.values)
+    assert np.array_equal(actual.layer_z, expected.layer_z)
+    assert np.array_equal(actual.offsets, expected.offsets)
+
+
+def test_prefix_below_a_height(segments):
+    lines, values = segments
+    index = LayerIndex(lines, values)
+    for z in index.layer_z[::7]:
+        below = lines[:, :, 2].max(axis=1) <= z
+        assert index.count_below(z) == np.count_nonzero(below)
+        assert np.all(index.segments[:index.count_below(z), :, 2] <= z)
+
+
+@pytest.mark.parametrize("pieces", [2, 7])
+def test_extended_pyramid_matches_a_rebuilt_one(segments, pieces):
+    lines, values = segments
+    max_segments = len(lines) // 20
+    expected = LayerIndex(lines, values).pyramid(max_segments)
+
+    # Cuts fall in the middle of layers, so each extension also re-sorts part of the top layer
+    cuts = np.linspace(0, len(lines), pieces + 1).astype(int)
+    levels = LayerIndex(lines[:cuts[1]], values[:cuts[1]]).pyramid(max_segments)
+    for first, last in zip(cuts[1:-1], cuts[2:]):
+        extend_pyramid(levels, lines[first:last], values[first:last], max_segments)
+
+    assert len(levels) == len(expected) > 2
+    for level, rebuilt in zip(levels, expected):
+        assert_same_index(level, rebuilt)
@@ -0,0 +1,32 @@
+# Tests for the slicer summary scan
+import os
+
+from GCodeToSTL import GcodeProcessor, GcodeSource
+from conftest import REPO_ROOT
+
+
+def _processor(text):
+    processor = GcodeProcessor()
+    processor.gcode = GcodeSource.from_text(text)
+    return processor
+
+
+def test_header_fields_do_not_parse_the_body():
+    processor = GcodeProcessor()
+    processor.gcode = GcodeSource.from_file(os.path.join(REPO_ROOT, "sphere.gcode"))
+    processor.find_nozzle_temperature()
+    processor.sum_filament_weight()
+    assert processor.toolpath is None
+
+
+def test_extent_from_the_moves():
+    processor = _processor("G1 X1 Y2 Z0.2\nG1 X5 Y-3 E1\nG1 X9 Y9 E1\nG1 X4 Y4 E2\n")
+    assert processor.find_x_min_max_difference() == (4.0, 5.0, 1.0)
+    assert processor.find_y_min_max_difference() == (-3.0, 4.0, 7.0)
+    assert processor.toolpath is not None
+
+
+def test_extent_from_slicer_bounds():
+    processor = _processor(";MINX:10.5\n;MINY:20\n;MAXX:30\n;MAXY:40.25\nG1 X1 Y2 Z0.2\nG1 X5 Y-3 E1\n")
+    assert processor.find_build_center() == (20.25, 30.125)
+    assert processor.toolpath is None
@@ -0,0 +1,48 @@
+# Tests for parallel parsing: the result must not depend on how the file was split
+import os
+
+import pytest
+
+import GCodeToSTL
+from GCodeToSTL import GcodeProcessor, GcodeSource, parse_toolpath_chunk, parse_toolpath_parallel, split_at_layers
+from conftest import REPO_ROOT, SAMPLE_FILES
+
+
+@pytest.mark.parametrize("name", SAMPLE_FILES)
+def test_parallel_matches_serial(name):
+    path = os.path.join(REPO_ROOT, name)
+    with open(path, "rb") as file:
+        serial, _ = parse_toolpath_chunk(file.read())
+    # Many small ranges and batches, so every kind of boundary is crossed
+    parallel = parse_toolpath_parallel(path, workers=3, chunk_bytes=4096, parts=16)
+    assert parallel.dtype == serial.dtype
+    assert parallel.tobytes() == serial.tobytes()
+
+
+def test_ranges_start_at_layer_changes():
+    data = b"".join(b";LAYER:%d\nG1 Z%d\nG1 X1 E1\n" % (layer, layer) for layer in range(20))
+    ranges = split_at_layers(data, 4)
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    assert all(data[start:].startswith((b";LAYER", b"G1 Z")) for start, _ in ranges[1:])
+    assert len(ranges) == 4
+
+
+@pytest.mark.parametrize("cpus, parallel", [(1, False), (4, True)])
+def test_processor_workers_are_capped_at_the_cpu_count(monkeypatch, cpus, parallel):
+    calls = []
+    real = GCodeToSTL.parse_toolpath_parallel
+
+    def counting(path, workers, *args, **kwargs):
+        calls.append(workers)
+        return real(path, workers, *args, **kwargs)
+
+    monkeypatch.setattr(GCodeToSTL, "parse_toolpath_parallel", counting)
+    monkeypatch.setattr(os, "cpu_count", lambda: cpus)
+    path = os.path.join(REPO_ROOT, "sphere.gcode")
+    processor = GcodeProcessor()
+    processor.gcode = GcodeSource.from_file(path)
+    paths, _ = processor.parse_extrusion_paths(workers=8)
+    assert calls == ([cpus] if parallel else [])
+    with open(path, "rb") as file:
+        assert processor.toolpath.tobytes() == parse_toolpath_chunk(file.read())[0].tobytes()
+    assert len(paths) == len(processor.toolpath)
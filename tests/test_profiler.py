@@ -0,0 +1,88 @@
+# Tests for the stage profiler and its Chrome trace
+import json
+import os
+
+import numpy as np
+import pytest
+
+from GCodeToSTL import GcodeProcessor, GcodeSource, Profiler, ToolpathCache
+from conftest import REPO_ROOT
+
+
+def profiled_run(tmp_path, **options):
+    profiler = Profiler(**options)
+    processor = GcodeProcessor(cache=ToolpathCache(str(tmp_path / "cache")), profiler=profiler)
+    processor.gcode = GcodeSource.from_file(os.path.join(REPO_ROOT, "cube.gcode"))
+    processor.parse_extrusion_paths()
+    processor.parse_toolpath()  # A cache hit
+    triangles = processor.export_to_stl(processor.toolpath, str(tmp_path / "cube.stl"))
+    processor.gcode.close()
+    return profiler.report, processor, triangles
+
+
+def test_stage_tree_and_counts(tmp_path):
+    report, processor, triangles = profiled_run(tmp_path)
+    stages = sorted(report.stages, key=lambda stage: stage.start)
+    assert [(stage.depth, stage.name) for stage in stages] == [
+        (0, "parse_extrusion_paths"), (1, "parse_toolpath"), (2, "cache_load"), (2, "cache_store"),
+        (0, "parse_toolpath"), (1, "cache_load"), (0, "export_to_stl")]
+    # Every child runs inside the stage above it
+    for number, stage in enumerate(stages):
+        parents = [parent for parent in stages[:number] if parent.depth == stage.depth - 1]
+        if parents:
+            parent = parents[-1]
+            assert parent.start <= stage.start
+            assert stage.start + stage.wall_seconds <= parent.start + parent.wall_seconds + 1e-6
+        assert 0 <= stage.wall_seconds and stage.peak_memory_bytes >= 0
+
+    moves = len(processor.toolpath)
+    assert stages[0].counts == {"positions": moves}
+    assert stages[1].counts["moves"] == moves and stages[1].counts["bytes"] == os.path.getsize(
+        os.path.join(REPO_ROOT, "cube.gcode"))
+    assert [stages[2].counts, stages[5].counts] == [{"hits": 0}, {"hits": 1}]
+    assert stages[6].counts == {"triangles": triangles, "bytes": os.path.getsize(tmp_path / "cube.stl")}
+
+    totals = report.totals()
+    assert totals["parse_toolpath"]["calls"] == 2 and totals["cache_load"]["calls"] == 2
+    assert totals["parse_toolpath"]["counts"]["moves"] == 2 * moves
+    assert totals["export_to_stl"]["wall_seconds"] == stages[6].wall_seconds
+
+
+def test_peak_memory_reaches_the_enclosing_stage():
+    profiler = Profiler()
+    with profiler.stage("outer"):
+        with profiler.stage("inner"):
+            block = np.ones(1 << 20)
+            del block
+    inner, outer = sorted(profiler.report.stages, key=lambda stage: stage.start)[::-1]
+    assert inner.name == "inner" and inner.peak_memory_bytes >= 8 << 20
+    assert outer.peak_memory_bytes >= inner.peak_memory_bytes
+
+
+def test_profile_stage_listing(tmp_path):
+    report, _, _ = profiled_run(tmp_path, memory=False, profile_stage="export_to_stl")
+    listings = {stage.name: stage.profile for stage in report.stages}
+    assert "_fill_segment_records" in listings["export_to_stl"]
+    assert listings["parse_toolpath"] is None
+    assert all(stage.peak_memory_bytes is None for stage in report.stages)
+
+
+def test_chrome_trace(tmp_path):
+    report, _, _ = profiled_run(tmp_path)
+    path = str(tmp_path / "trace.json")
+    report.save_chrome_trace(path)
+    with open(path) as file:
+        trace = json.load(file)
+    assert trace["displayTimeUnit"] == "ms"
+    events = trace["traceEvents"]
+    assert len(events) == len(report.stages)
+    for event, stage in zip(events, sorted(report.stages, key=lambda stage: stage.start)):
+        assert event["ph"] == "X" and event["cat"] == "stage" and event["name"] == stage.name
+        assert event["pid"] == os.getpid() and event["tid"] == 0
+        assert isinstance(event["ts"], float) and event["dur"] >= 0
+        assert event["ts"] == pytest.approx((report.started_at + stage.start) * 1e6, abs=1)
+        assert event["args"]["cpu_seconds"] == stage.cpu_seconds
+        assert event["args"]["peak_memory_bytes"] == stage.peak_memory_bytes
+    # Children nest inside their parents on the same row, so the viewer stacks them
+    first, child = events[0], events[1]
+    assert first["ts"] <= child["ts"] and child["ts"] + child["dur"] <= first["ts"] + first["dur"] + 1
@@ -0,0 +1,156 @@
+# Tests for the modal state and arcs of the parser, against a line-by-line reference interpreter
+import math
+
+import numpy as np
+import pytest
+
+from GCodeToSTL import ARC_TOLERANCE, ModalState, parse_toolpath_chunk
+
+
+def parse(text, state=None):
+    return parse_toolpath_chunk(text.encode(), state)[0]
+
+
+# Machine position (x, y, z, e) and feedrate after every G0/G1 line, read one line at a time
+def reference_moves(text):
+    machine = dict.fromkeys("xyze", 0.0)
+    offset = dict.fromkeys("xyze", 0.0)
+    relative = relative_e = False
+    feedrate = 0.0
+    moves = []
+    for line in text.splitlines():
+        words = line.split(";")[0].split()
+        if not words:
+            continue
+        command, values = words[0], {word[0].lower(): float(word[1:]) for word in words[1:]}
+        if command == "G90":
+            relative = False
+        elif command == "G91":
+            relative = True
+        elif command == "M82":
+            relative_e = False
+        elif command == "M83":
+            relative_e = True
+        elif command == "G92":
+            # Without any axis every axis is set to zero; the machine does not move
+            for axis in [axis for axis in "xyze" if axis in values] or "xyze":
+                offset[axis] = machine[axis] - values.get(axis, 0.0)
+        elif command in ("G0", "G1"):
+            for axis in "xyze":
+                if axis in values:
+                    if relative or (axis == "e" and relative_e):
+                        machine[axis] += values[axis]
+                    else:
+                        machine[axis] = values[axis] + offset[axis]
+            feedrate = values.get("f", feedrate)
+            moves.append([machine[axis] for axis in "xyze"] + [feedrate])
+    return np.array(moves)
+
+
+def random_program(seed, lines=400):
+    rng = np.random.default_rng(seed)
+    program = []
+    for _ in range(lines):
+        kind = rng.choice(["G1", "G0", "G90", "G91", "M82", "M83", "G92"], p=[.5, .1, .08, .08, .08, .08, .08])
+        if kind in ("G0", "G1", "G92"):
+            axes = [axis for axis in "XYZE" if rng.random() < 0.5]
+            if kind == "G92" and rng.random() < 0.3:
+                axes = []
+            words = [f"{axis}{rng.uniform(-50, 50):.3f}" for axis in axes]
+            if kind != "G92" and rng.random() < 0.2:
+                words.append(f"F{rng.integers(600, 9000)}")
+            program.append(" ".join([kind] + words))
+        else:
+            program.append(kind)
+    return "\n".join(program) + "\n"
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_modal_state_matches_the_reference(seed):
+    text = random_program(seed)
+    toolpath = parse(text)
+    expected = reference_moves(text)
+    actual = np.stack([toolpath[axis] for axis in ("x", "y", "z", "e", "f")], axis=1)
+    assert np.allclose(actual, expected, atol=1e-3)
+    de = np.diff(np.concatenate(([0.0], expected[:, 3])))
+    assert np.allclose(toolpath['de'], de, atol=1e-3)
+
+
+def test_modal_state_carries_across_chunks():
+    text = random_program(11)
+    lines = text.splitlines(keepends=True)
+    state, parts = ModalState(), []
+    for first in range(0, len(lines), 37):
+        toolpath, state = parse_toolpath_chunk("".join(lines[first:first + 37]).encode(), state)
+        parts.append(toolpath)
+    chunked = np.concatenate(parts)
+    whole = parse(text)
+    assert np.array_equal(chunked[['x', 'y', 'z', 'e', 'de', 'f']], whole[['x', 'y', 'z', 'e', 'de', 'f']])
+
+
+def test_relative_extrusion_under_absolute_moves():
+    toolpath = parse("G90\nM83\nG1 X10 E1\nG1 X20 E1\nG92 E0\nG1 X30 E0.5\nM82\nG1 X40 E2\n")
+    assert toolpath['x'].tolist() == [10, 20, 30, 40]
+    # M82 reads E2 against the G92 origin, which was set when the extruder was at 2
+    assert toolpath['e'].tolist() == [1, 2, 2.5, 4]
+    assert toolpath['de'].tolist() == [1, 1, 0.5, 1.5]
+
+
+def arc_points(text, tolerance=ARC_TOLERANCE):
+    toolpath = parse_toolpath_chunk(text.encode(), arc_tolerance=tolerance)[0]
+    return np.stack((toolpath['x'], toolpath['y']), axis=1).astype(np.float64), toolpath
+
+
+# Largest distance between the arc and the chords through the given points, which all lie on it
+def chord_error(points, centre, radius):
+    middles = (points[:-1] + points[1:]) / 2
+    return radius - np.linalg.norm(middles - centre, axis=1).min()
+
+
+@pytest.mark.parametrize("tolerance", [0.1, 0.01, 0.001])
+@pytest.mark.parametrize("command", ["G2", "G3"])
+def test_arc_chords_stay_within_tolerance(command, tolerance):
+    points, _ = arc_points(f"G1 X10 Y0 F1200\n{command} X0 Y10 I-10 J0 E5\n", tolerance)
+    on_arc = points[1:]
+    assert np.allclose(np.linalg.norm(on_arc, axis=1), 10, atol=1e-4)
+    assert chord_error(on_arc, np.zeros(2), 10) <= tolerance + 1e-5
+    # Chords are no finer than the tolerance needs: one chord fewer would miss it
+    sweep = math.pi / 2 if command == "G3" else 3 * math.pi / 2
+    assert len(on_arc) == math.ceil(sweep / (2 * math.acos(1 - tolerance / 10)))
+    # G2 turns clockwise, G3 counter-clockwise
+    chords = np.diff(points, axis=0)
+    turns = chords[:-1, 0] * chords[1:, 1] - chords[:-1, 1] * chords[1:, 0]
+    assert np.all(turns < 0) if command == "G2" else np.all(turns > 0)
+
+
+def test_full_circle():
+    points, toolpath = arc_points("G1 X5 Y0 F1200\nG3 X5 Y0 I-5 J0 E3\n")
+    on_arc = points[1:]
+    assert np.allclose(np.linalg.norm(on_arc, axis=1), 5, atol=1e-4)
+    assert len(on_arc) == math.ceil(2 * math.pi / (2 * math.acos(1 - ARC_TOLERANCE / 5)))
+    assert tuple(on_arc[-1]) == (5, 0)
+    angles = np.unwrap(np.arctan2(on_arc[:, 1], on_arc[:, 0]))
+    assert angles[-1] == pytest.approx(2 * math.pi)
+    # Filament is fed evenly along the arc
+    assert toolpath['e'][-1] == 3
+    assert np.allclose(toolpath['de'][1:], 3 / len(on_arc), atol=1e-5)
+
+
+@pytest.mark.parametrize("command, radius, centre", [
+    # G2 from (0, 0) to (10, 0): the short way round has its centre below the chord, the long way above it
+    ("G2", 10, (5, -math.sqrt(75))), ("G2", -10, (5, math.sqrt(75))),
+    ("G3", 10, (5, math.sqrt(75))), ("G3", -10, (5, -math.sqrt(75))),
+])
+def test_arc_radius_sign(command, radius, centre):
+    points, _ = arc_points(f"G1 X0 Y0 F1200\n{command} X10 Y0 R{radius} E1\n")
+    assert np.allclose(np.linalg.norm(points - centre, axis=1), 10, atol=1e-4)
+    sweep = np.abs(np.diff(np.unwrap(np.arctan2(points[:, 1] - centre[1], points[:, 0] - centre[0])))).sum()
+    short = 2 * math.asin(0.5)
+    assert sweep == pytest.approx(short if radius > 0 else 2 * math.pi - short)
+
+
+def test_relative_arcs_match_absolute_ones():
+    relative = parse("G1 X20 Y20 Z0.2 F1200\nG91\nG2 X10 Y0 I5 J0 E2\nG3 X-10 Y10 R10 E1\n")
+    absolute = parse("G1 X20 Y20 Z0.2 F1200\nG90\nG2 X30 Y20 I5 J0 E2\nG3 X20 Y30 R10 E3\n")
+    assert len(relative) > 3
+    assert relative.tobytes() == absolute.tobytes()
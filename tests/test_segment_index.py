@@ -0,0 +1,142 @@
+# Tests for the spatial segment index, against brute force over every segment
+import os
+
+import numpy as np
+import pytest
+
+from GCodeToSTL import (MOVE_EXTRUDE, MOVE_RETRACT, MOVE_TRAVEL, TOOLPATH_DTYPE, SegmentIndex,
+                        parse_toolpath_chunk)
+from conftest import REPO_ROOT
+
+
+# Layers of short moves in random directions, some sloped, some of zero length, some travels and retracts
+def random_toolpath(seed, count=3000):
+    rng = np.random.default_rng(seed)
+    toolpath = np.zeros(count, dtype=TOOLPATH_DTYPE)
+    toolpath['x'] = np.cumsum(rng.normal(0, 2, count)) % 40
+    toolpath['y'] = np.cumsum(rng.normal(0, 2, count)) % 30
+    toolpath['z'] = 0.2 * (1 + np.arange(count) // 300) + np.where(rng.random(count) < 0.05, 0.1, 0)
+    toolpath['move'] = rng.choice([MOVE_EXTRUDE, MOVE_TRAVEL, MOVE_RETRACT], count, p=[0.8, 0.15, 0.05])
+    still = rng.random(count) < 0.03
+    toolpath['x'][1:][still[1:]] = toolpath['x'][:-1][still[1:]]
+    toolpath['y'][1:][still[1:]] = toolpath['y'][:-1][still[1:]]
+    toolpath['z'][1:][still[1:]] = toolpath['z'][:-1][still[1:]]
+    return toolpath
+
+
+@pytest.fixture(scope="module")
+def kv():
+    with open(os.path.join(REPO_ROOT, "kv.gcode"), "rb") as file:
+        return parse_toolpath_chunk(file.read())[0]
+
+
+# (rows, start, end) of every segment ending in one of the moves
+def segments(toolpath, moves):
+    rows = np.array([row for row in range(1, len(toolpath)) if toolpath['move'][row] in moves], dtype=np.int64)
+    points = np.stack([toolpath[axis] for axis in 'xyz'], axis=1).astype(np.float64)
+    return rows, points[rows - 1], points[rows]
+
+
+def crosses(start, end, low, high):
+    enter, leave = 0.0, 1.0
+    for axis in range(3):
+        step = end[axis] - start[axis]
+        if step == 0:
+            if not low[axis] <= start[axis] <= high[axis]:
+                return False
+            continue
+        a, b = sorted(((low[axis] - start[axis]) / step, (high[axis] - start[axis]) / step))
+        enter, leave = max(enter, a), min(leave, b)
+    return enter <= leave
+
+
+def distances(start, end, point):
+    direction = end - start
+    length = np.einsum('ij,ij->i', direction, direction)
+    t = np.clip(np.einsum('ij,ij->i', point - start, direction) / np.where(length > 0, length, 1), 0, 1)
+    return np.linalg.norm(start + t[:, None] * direction - point, axis=1)
+
+
+CASES = [
+    ("kv", (MOVE_EXTRUDE,), None),
+    ("kv", (MOVE_EXTRUDE, MOVE_TRAVEL), 0.5),
+    ("random", (MOVE_EXTRUDE,), None),
+    ("random", (MOVE_EXTRUDE, MOVE_TRAVEL, MOVE_RETRACT), 0.7),
+    ("random", (MOVE_TRAVEL,), 5.0),
+]
+
+
+@pytest.fixture(params=CASES, ids=lambda case: f"{case[0]}-{len(case[1])}-{case[2]}")
+def indexed(request, kv):
+    name, moves, cell_size = request.param
+    toolpath = kv if name == "kv" else random_toolpath(len(moves))
+    return SegmentIndex(toolpath, moves, cell_size), segments(toolpath, moves)
+
+
+def test_indexes_the_segments_of_the_moves(indexed):
+    index, (rows, _, _) = indexed
+    assert len(index) == len(rows)
+    np.testing.assert_array_equal(index.rows, rows)
+
+
+def test_region_matches_brute_force(indexed):
+    index, (rows, start, end) = indexed
+    rng = np.random.default_rng(1)
+    low, high = index.bounds
+    for _ in range(40):
+        corner = rng.uniform(low - 1, high + 1)
+        size = rng.uniform(0, 1, 3) * (high - low) * rng.choice([0.02, 0.2, 1.2])
+        box_low, box_high = corner - size / 2, corner + size / 2
+        expected = rows[[crosses(a, b, box_low, box_high) for a, b in zip(start, end)]]
+        np.testing.assert_array_equal(index.region(*box_low[:2], *box_high[:2], box_low[2], box_high[2]), expected)
+    # The whole index, and the default Z limits
+    np.testing.assert_array_equal(index.region(*(low[:2] - 1), *(high[:2] + 1)), rows)
+
+
+def test_z_slice_matches_brute_force(indexed):
+    index, (rows, start, end) = indexed
+    heights = np.concatenate((index.layer_z, index.layer_z + 0.05, [index.bounds[0, 2] - 1, index.bounds[1, 2] + 1]))
+    for z in heights:
+        for tolerance in (1e-3, 0.15):
+            keep = (np.minimum(start[:, 2], end[:, 2]) <= z + tolerance) & \
+                (np.maximum(start[:, 2], end[:, 2]) >= z - tolerance)
+            np.testing.assert_array_equal(index.z_slice(z, tolerance), rows[keep])
+
+
+def test_nearest_matches_brute_force(indexed):
+    index, (rows, start, end) = indexed
+    rng = np.random.default_rng(2)
+    low, high = index.bounds
+    for point in rng.uniform(low - 5, high + 5, (40, 3)):
+        distance = distances(start, end, point)
+        row, found = index.nearest(*point)
+        assert found == pytest.approx(distance.min())
+        assert distance[np.searchsorted(rows, row)] == pytest.approx(found)
+        # Within a max_distance just short of the nearest segment there is nothing
+        assert index.nearest(*point, max_distance=distance.min() * 0.99) is None
+        assert index.nearest(*point, max_distance=distance.min() * 1.01)[0] == row
+
+
+def test_nearest_on_a_segment(indexed):
+    index, (rows, start, end) = indexed
+    for k in np.random.default_rng(3).choice(len(rows), 20):
+        _, found = index.nearest(*(start[k] + end[k]) / 2)
+        assert found == pytest.approx(0, abs=1e-9)
+
+
+def test_rebuilt_from_arrays_answers_the_same(indexed):
+    index, _ = indexed
+    copy = SegmentIndex.from_arrays(index.toolpath, index.to_arrays())
+    low, high = index.bounds
+    middle = (low + high) / 2
+    np.testing.assert_array_equal(copy.region(*low[:2], *middle[:2]), index.region(*low[:2], *middle[:2]))
+    np.testing.assert_array_equal(copy.z_slice(index.layer_z[0]), index.z_slice(index.layer_z[0]))
+    assert copy.nearest(*middle) == index.nearest(*middle)
+
+
+def test_empty_index():
+    index = SegmentIndex(random_toolpath(0, 10), ())
+    assert len(index) == 0
+    assert len(index.region(-1, -1, 1, 1)) == 0
+    assert len(index.z_slice(0.2)) == 0
+    assert index.nearest(0, 0, 0) is None
@@ -0,0 +1,73 @@
+# Tests for toolpath simplification
+import numpy as np
+
+from GCodeToSTL import (MOVE_EXTRUDE, SIMPLIFY_DISTANCE_TOLERANCE, parse_toolpath_chunk,
+                        simplify_toolpath)
+
+
+def parse(lines):
+    return parse_toolpath_chunk(b"\n".join(lines) + b"\n")[0]
+
+
+def points_of(toolpath):
+    return np.stack((toolpath['x'], toolpath['y'], toolpath['z']), axis=1).astype(np.float64)
+
+
+# Two layers of a jittery circle, one G1 per line, with a travel move to the start of each layer
+def jittery_circles():
+    rng = np.random.default_rng(7)
+    lines, e = [b"G1 F1800"], 0.0
+    for z in (0.2, 0.4):
+        angles = np.linspace(0, 2 * np.pi, 400)
+        radius = 20 + rng.uniform(-0.005, 0.005, len(angles))
+        x, y = 50 + radius * np.cos(angles), 50 + radius * np.sin(angles)
+        lines.append(b"G0 X%.4f Y%.4f Z%.2f" % (x[0], y[0], z))
+        for step in range(1, len(angles)):
+            e += 0.01
+            lines.append(b"G1 X%.4f Y%.4f E%.4f" % (x[step], y[step], e))
+    return parse(lines)
+
+
+def test_removed_vertices_stay_within_tolerance():
+    toolpath = jittery_circles()
+    simplified = simplify_toolpath(toolpath, angle_tolerance=5.0, drop_travel=False)
+    assert len(simplified) < len(toolpath) // 2
+    # Rows come from one G1 line each, so line numbers tell which original rows each kept row spans
+    kept = np.searchsorted(toolpath['line'], simplified['line'])
+    assert np.array_equal(toolpath['line'][kept], simplified['line'])
+    points = points_of(toolpath)
+    for first, last in zip(kept[:-1], kept[1:]):
+        a, b = points[first], points[last]
+        chord = b - a
+        for point in points[first + 1:last]:
+            offset = np.linalg.norm(np.cross(point - a, chord)) / np.linalg.norm(chord)
+            assert offset <= SIMPLIFY_DISTANCE_TOLERANCE + 1e-6
+
+
+def test_filament_is_conserved():
+    toolpath = jittery_circles()
+    simplified = simplify_toolpath(toolpath, angle_tolerance=5.0, drop_travel=False)
+    kept = np.searchsorted(toolpath['line'], simplified['line'])
+    # Each kept row feeds the filament of every original row it replaced
+    expected = [toolpath['de'][first + 1:last + 1].sum(dtype=np.float64)
+                for first, last in zip(kept[:-1], kept[1:])]
+    assert np.allclose(simplified['de'][1:], expected, rtol=1e-5)
+    assert np.isclose(simplified['de'].sum(dtype=np.float64), toolpath['de'].sum(dtype=np.float64), rtol=1e-5)
+
+
+def test_collinear_runs_collapse():
+    lines = [b"G1 X0 Y0 Z0.2 F1800"] + [b"G1 X%d E%d" % (step, step) for step in range(1, 101)]
+    simplified = simplify_toolpath(parse(lines))
+    assert len(simplified) == 2
+    assert (simplified['x'][0], simplified['x'][1]) == (0, 100)
+    assert simplified['move'][1] == MOVE_EXTRUDE
+    assert simplified['de'][1] == 100
+
+
+def test_layers_and_feedrates_are_not_merged():
+    lines = [b"G1 X0 Y0 Z0.2 F1800", b"G1 X10 E1", b"G1 X20 E2 F1200", b"G1 X30 E3",
+             b"G1 X30 Y0 Z0.4", b"G1 X40 E4", b"G1 X50 E5"]
+    simplified = simplify_toolpath(parse(lines))
+    # The feedrate change at X10 stays, and both layers keep their own ends
+    assert list(zip(simplified['x'], simplified['z'].round(1))) == [
+        (0, 0.2), (10, 0.2), (30, 0.2), (30, 0.4), (50, 0.4)]
@@ -0,0 +1,28 @@
+# Tests for streaming file ingestion
+import itertools
+import os
+
+from GCodeToSTL import GcodeSource
+from conftest import REPO_ROOT
+
+
+def test_batches_are_line_aligned_and_cover_the_file():
+    source = GcodeSource.from_file(os.path.join(REPO_ROOT, "cube.gcode"))
+    data = bytes(source.data)
+    batches = list(source.batches(1024))
+    assert b"".join(chunk for chunk, _ in batches) == data
+    assert all(chunk.endswith(b"\n") for chunk, _ in batches[:-1])
+    assert all(len(chunk) <= 1024 for chunk, _ in batches)
+    assert [offset for _, offset in batches] == [0] + list(
+        itertools.accumulate(chunk.count(b"\n") for chunk, _ in batches[:-1]))
+    assert source.line_count == data.count(b"\n") + (not data.endswith(b"\n"))
+    source.close()
+
+
+def test_line_longer_than_a_batch():
+    data = b"G1 X1\n" * 200 + b";" + b"x" * 5000 + b"\n" + b"G1 X2\n" * 2000
+    batches = list(GcodeSource.from_text(data).batches(1024))
+    assert b"".join(chunk for chunk, _ in batches) == data
+    # Only the batch holding the long line may exceed the batch size, and only by that line
+    assert max(len(chunk) for chunk, _ in batches) == 5002
+    assert sum(len(chunk) > 1024 for chunk, _ in batches) == 1
@@ -0,0 +1,29 @@
+# Tests for the columnar G-code tokenizer
+import numpy as np
+
+from GCodeToSTL import MOVE_EXTRUDE, MOVE_TRAVEL, parse_toolpath_chunk, tokenize_gcode
+
+
+def test_batch_without_comments():
+    records = tokenize_gcode(b"G1 X1 Y2 E0.5\nG1 X3 Y4 E1\n")
+    assert len(records) == 2
+    assert records['x'].tolist() == [1.0, 3.0]
+
+
+def test_empty_batch():
+    assert len(tokenize_gcode(b"")) == 0
+
+
+def test_comments_end_words():
+    records = tokenize_gcode(b"G1 X1 ; Y2\n; G1 X9\nG1 Y5;X7 ;Z3\n")
+    assert len(records) == 2
+    assert records['x'][0] == 1.0 and np.isnan(records['y'][0])
+    assert np.isnan(records['x'][1]) and records['y'][1] == 5.0 and np.isnan(records['z'][1])
+
+
+def test_modal_axes_carry_over():
+    toolpath, _ = parse_toolpath_chunk(b"G1 X1 Y2 Z0.2 F1200\nG1 X3 E1\nG0 Y7\n")
+    assert toolpath['y'].tolist() == [2.0, 2.0, 7.0]
+    assert toolpath['f'].tolist() == [1200.0] * 3
+    assert toolpath['line'].tolist() == [1, 2, 3]
+    assert toolpath['move'].tolist() == [MOVE_TRAVEL, MOVE_EXTRUDE, MOVE_TRAVEL]
@@ -0,0 +1,29 @@
+# Tests for columnar toolpath files
+import os
+
+import pytest
+
+import GCodeToSTL
+from GCodeToSTL import load_toolpath, parse_toolpath_chunk, save_toolpath
+from conftest import REPO_ROOT
+
+
+@pytest.fixture
+def toolpath():
+    with open(os.path.join(REPO_ROOT, "cube.gcode"), "rb") as file:
+        return parse_toolpath_chunk(file.read())[0]
+
+
+def test_round_trip(toolpath, tmp_path):
+    path = str(tmp_path / "cube.gctp")
+    save_toolpath(path, toolpath)
+    assert load_toolpath(path).to_array().tobytes() == toolpath.tobytes()
+
+
+def test_other_parser_version_is_rejected(toolpath, tmp_path, monkeypatch):
+    path = str(tmp_path / "cube.gctp")
+    monkeypatch.setattr(GCodeToSTL, "PARSER_VERSION", GCodeToSTL.PARSER_VERSION - 1)
+    save_toolpath(path, toolpath)
+    monkeypatch.undo()
+    with pytest.raises(ValueError, match="parser version"):
+        load_toolpath(path)
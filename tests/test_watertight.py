@@ -0,0 +1,83 @@
+# Tests for the watertight STL export
+import os
+
+import numpy as np
+import pytest
+
+from GCodeToSTL import STL_RECORD_DTYPE, GcodeProcessor, parse_toolpath_chunk, voxel_surface
+from conftest import REPO_ROOT
+
+PATHS = {
+    "straight": [(0, 0, 0.2), (10, 0, 0.2)],
+    "diagonal": [(0, 0, 0.2), (7, 7, 0.2)],
+    "two layers": [(0, 0, 0.2), (10, 0, 0.2), (10, 5, 0.2), (0, 5, 0.4), (3, -2, 0.4)],
+}
+
+
+@pytest.fixture(scope="module")
+def toolpath():
+    with open(os.path.join(REPO_ROOT, "kv.gcode"), "rb") as file:
+        return parse_toolpath_chunk(file.read())[0]
+
+
+def surface(paths, **options):
+    return np.concatenate(list(voxel_surface(paths, **options)))
+
+
+# Welds the vertices and checks that every directed edge appears once and its reverse once, so every edge is
+# shared by exactly two triangles that agree on the orientation
+def assert_manifold(triangles):
+    _, corners = np.unique(triangles.reshape(-1, 3), axis=0, return_inverse=True)
+    corners = corners.reshape(-1, 3)
+    assert np.all((corners[:, 0] != corners[:, 1]) & (corners[:, 1] != corners[:, 2])
+                  & (corners[:, 2] != corners[:, 0]))
+    tail, head = corners.reshape(-1), corners[:, [1, 2, 0]].reshape(-1)
+    count = corners.max() + 1
+    edges = tail.astype(np.int64) * count + head
+    assert len(np.unique(edges)) == len(edges)
+    assert np.array_equal(np.sort(edges), np.sort(head.astype(np.int64) * count + tail))
+
+
+def volume(triangles):
+    triangles = triangles.astype(np.float64)
+    return np.einsum('ij,ij->i', triangles[:, 0], np.cross(triangles[:, 1], triangles[:, 2])).sum() / 6
+
+
+@pytest.mark.parametrize("name", PATHS)
+@pytest.mark.parametrize("voxel_tolerance", [0, 0.25, 1])
+def test_paths_give_a_closed_surface(name, voxel_tolerance):
+    triangles = surface(PATHS[name], extrusion_height=0.2, voxel_tolerance=voxel_tolerance)
+    assert_manifold(triangles)
+    assert volume(triangles) > 0
+
+
+def test_simplifying_keeps_the_surface_closed_and_its_volume(toolpath):
+    full = surface(toolpath, voxel_tolerance=0)
+    simplified = surface(toolpath)
+    assert_manifold(full)
+    assert_manifold(simplified)
+    assert len(simplified) < len(full) / 2
+    assert volume(simplified) == pytest.approx(volume(full), rel=0.01)
+
+
+def test_simplifying_merges_flat_faces():
+    # A single bead along X: its top, bottom and sides are flat, so only the rounded ends keep many triangles
+    full = surface(PATHS["straight"], extrusion_height=0.2, voxel_tolerance=0)
+    simplified = surface(PATHS["straight"], extrusion_height=0.2)
+    assert len(simplified) < len(full) / 10
+    # Every vertex is a marching cubes vertex, and stays inside the box around the full surface
+    assert np.isin(simplified.reshape(-1, 3).view('V12'), full.reshape(-1, 3).view('V12')).all()
+    assert np.all(simplified.reshape(-1, 3).min(axis=0) >= full.reshape(-1, 3).min(axis=0))
+    assert np.all(simplified.reshape(-1, 3).max(axis=0) <= full.reshape(-1, 3).max(axis=0))
+
+
+def test_export_writes_the_surface(tmp_path, toolpath):
+    path = tmp_path / "part.stl"
+    count = GcodeProcessor().export_watertight_stl(toolpath, str(path))
+    with open(path, "rb") as file:
+        file.seek(80)
+        assert int(np.frombuffer(file.read(4), dtype=np.uint32)[0]) == count
+        records = np.fromfile(file, dtype=STL_RECORD_DTYPE)
+    assert len(records) == count
+    np.testing.assert_array_equal(records['vectors'], surface(toolpath))
+    assert_manifold(records['vectors'])